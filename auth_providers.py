@@ -0,0 +1,424 @@
+from functools import wraps
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
+import json
+import os
+import threading
+import time
+
+from oauth2client.client import OAuth2WebServerFlow
+
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import registry
+from process_local import ProcessLocal
+
+
+# Client Secrets --------------------------------------------------------------
+
+
+# Read once when the module is loaded, not on every login.
+with open('client_secrets_google.json', 'r') as secrets_file:
+    GOOGLE_SECRETS = json.load(secrets_file)['web']
+
+with open('client_secrets_facebook.json', 'r') as secrets_file:
+    FACEBOOK_SECRETS = json.load(secrets_file)['web']
+
+GOOGLE_CLIENT_ID = GOOGLE_SECRETS['client_id']
+
+FACEBOOK_CLIENT_ID = FACEBOOK_SECRETS['app_id']
+FACEBOOK_CLIENT_SECRET = FACEBOOK_SECRETS['app_secret']
+
+
+# Provider Endpoints ----------------------------------------------------------
+
+
+# Every endpoint can be pointed at a local stub server from the environment.
+GOOGLE_TOKEN_URI = os.environ.get(
+    'ITEMCATALOG_GOOGLE_TOKEN_URI',
+    GOOGLE_SECRETS.get('token_uri',
+                       'https://accounts.google.com/o/oauth2/token'))
+
+GOOGLE_API_URL = os.environ.get('ITEMCATALOG_GOOGLE_API_URL',
+                                'https://www.googleapis.com')
+
+GOOGLE_ACCOUNTS_URL = os.environ.get('ITEMCATALOG_GOOGLE_ACCOUNTS_URL',
+                                     'https://accounts.google.com')
+
+FACEBOOK_GRAPH_URL = os.environ.get('ITEMCATALOG_FACEBOOK_GRAPH_URL',
+                                    'https://graph.facebook.com')
+
+# Seconds to wait for a provider to connect and to answer.
+HTTP_TIMEOUT = float(os.environ.get('ITEMCATALOG_OAUTH_TIMEOUT', 10))
+
+# Keep-alive connections kept open per provider host.
+HTTP_POOL_SIZE = int(os.environ.get('ITEMCATALOG_OAUTH_POOL_SIZE', 10))
+
+# Seconds a whole login may spend waiting on providers, across every call.
+LOGIN_BUDGET = float(os.environ.get('ITEMCATALOG_LOGIN_BUDGET', 15))
+
+# Threads used to call providers concurrently.
+PROVIDER_THREADS = int(os.environ.get('ITEMCATALOG_OAUTH_THREADS', 8))
+
+
+class ProviderError(Exception):
+    """ A provider did not answer in time, or could not be reached. """
+
+
+# HTTP Clients ----------------------------------------------------------------
+
+
+def CreateHTTPSession():
+    """ Create an HTTP session that keeps connections to providers open.
+
+    Returns:
+        http_session: a requests Session with a pooled adapter.
+    """
+    http_session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                          pool_maxsize=HTTP_POOL_SIZE)
+    http_session.mount('https://', adapter)
+    http_session.mount('http://', adapter)
+    return http_session
+
+
+# Shared by every thread. The connection pool is thread-safe.
+http_session = CreateHTTPSession()
+
+# oauth2client needs an httplib2 client, which is not thread-safe, so each
+# thread keeps its own, and with it its open connections.
+_thread_local = threading.local()
+
+
+def GetHttplib2Client():
+    """ Get this thread's httplib2 client.
+
+    Returns:
+        http: an httplib2.Http with the provider timeout.
+    """
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        http = httplib2.Http(timeout=HTTP_TIMEOUT)
+        _thread_local.http = http
+    return http
+
+
+def GetJSON(url, params=None, timeout=HTTP_TIMEOUT):
+    """ GET a provider URL and decode the JSON response.
+
+    Args:
+        url: the URL to get.
+        params: a dict of query string parameters.
+        timeout: seconds to wait for the provider.
+    Returns:
+        data: the decoded response.
+    """
+    return http_session.get(url, params=params, timeout=timeout).json()
+
+
+# Metrics Helper Methods ------------------------------------------------------
+
+
+registry.declare('itemcatalog_oauth_call_seconds', 'histogram',
+                 'Time spent waiting on each call to a login provider.')
+
+
+def Timed(f):
+    """ Record how long every call to a provider method takes. """
+    labels = (('call', f.__name__),)
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        start = default_timer()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            registry.observe('itemcatalog_oauth_call_seconds',
+                             default_timer() - start,
+                             labels)
+    return decorated_function
+
+
+# Concurrency Helper Methods --------------------------------------------------
+
+
+_provider_pool = ProcessLocal(lambda: ThreadPool(PROVIDER_THREADS))
+
+
+def GetProviderPool():
+    """ Get the thread pool used to call providers concurrently.
+
+    Returns:
+        pool: a ThreadPool.
+    """
+    return _provider_pool.get()
+
+
+class Deadline(object):
+    """ The time left for a login to finish talking to providers. """
+
+    def __init__(self, budget=LOGIN_BUDGET):
+        self.expires = time.time() + budget
+
+    def timeout(self):
+        """ Get the timeout for the next provider call.
+
+        Returns:
+            timeout: the per-call timeout, or the time left if that is less.
+        Raises:
+            ProviderError: if the budget has run out.
+        """
+        remaining = self.expires - time.time()
+        if remaining <= 0:
+            raise ProviderError('Login took too long.')
+        return min(HTTP_TIMEOUT, remaining)
+
+
+def CallProvider(deadline, f, *args):
+    """ Call a provider within the login's deadline.
+
+    Args:
+        deadline: the login's Deadline.
+        f: the provider method to call. It must accept a timeout argument
+           after args.
+        args: the arguments to call it with.
+    Returns:
+        The provider method's result.
+    Raises:
+        ProviderError: if the call timed out or failed to connect.
+    """
+    try:
+        return f(*(args + (deadline.timeout(),)))
+    except requests.RequestException as e:
+        raise ProviderError(str(e))
+
+
+def CallProviders(deadline, *calls):
+    """ Make independent provider calls concurrently.
+
+    Args:
+        deadline: the login's Deadline, shared by every call.
+        calls: (f, args) tuples, as for CallProvider.
+    Returns:
+        results: a list of the calls' results, in order.
+    Raises:
+        ProviderError: if any call timed out or failed to connect.
+    """
+    pool = GetProviderPool()
+    pending = [pool.apply_async(CallProvider, (deadline, f) + tuple(args))
+               for f, args in calls]
+    try:
+        return [result.get(deadline.timeout()) for result in pending]
+    except TimeoutError:
+        raise ProviderError('Login took too long.')
+
+
+# Google Methods --------------------------------------------------------------
+
+
+# Built once from the cached secrets instead of re-reading the secrets file
+# for every login.
+google_flow = OAuth2WebServerFlow(client_id=GOOGLE_CLIENT_ID,
+                                  client_secret=GOOGLE_SECRETS['client_secret'],
+                                  scope='',
+                                  redirect_uri='postmessage',
+                                  token_uri=GOOGLE_TOKEN_URI)
+
+
+@Timed
+def ExchangeGoogleCode(auth_code):
+    """ Exchange a one-time authorization code for credentials.
+
+    Args:
+        auth_code: the code the client got from Google.
+    Returns:
+        credentials: an oauth2client credentials object.
+    Raises:
+        FlowExchangeError: if Google refused the code.
+    """
+    return google_flow.step2_exchange(auth_code, http=GetHttplib2Client())
+
+
+@Timed
+def GetGoogleTokenInfo(access_token, timeout=HTTP_TIMEOUT):
+    """ Ask Google who an access token was issued to.
+
+    Args:
+        access_token: the access token to check.
+        timeout: seconds to wait for Google.
+    Returns:
+        data: a dict with user_id and issued_to, or error.
+    """
+    return GetJSON(GOOGLE_API_URL + '/oauth2/v1/tokeninfo',
+                   {'access_token': access_token},
+                   timeout)
+
+
+@Timed
+def GetGoogleUserInfo(access_token, timeout=HTTP_TIMEOUT):
+    """ Get the profile of the user an access token belongs to.
+
+    Args:
+        access_token: the user's access token.
+        timeout: seconds to wait for Google.
+    Returns:
+        data: a dict with name, picture and email.
+    """
+    return GetJSON(GOOGLE_API_URL + '/oauth2/v1/userinfo',
+                   {'access_token': access_token, 'alt': 'json'},
+                   timeout)
+
+
+@Timed
+def RevokeGoogleToken(access_token, timeout=HTTP_TIMEOUT):
+    """ Revoke an access token.
+
+    Args:
+        access_token: the access token to revoke.
+        timeout: seconds to wait for Google.
+    Returns:
+        status: the HTTP status code of Google's answer.
+    """
+    response = http_session.get(GOOGLE_ACCOUNTS_URL + '/o/oauth2/revoke',
+                                params={'token': access_token},
+                                timeout=timeout)
+    return response.status_code
+
+
+# Facebook Methods ------------------------------------------------------------
+
+
+@Timed
+def ExchangeFacebookToken(short_lived_token, timeout=HTTP_TIMEOUT):
+    """ Exchange a short-lived access token for a long-lived one.
+
+    Args:
+        short_lived_token: the token the client got from Facebook.
+        timeout: seconds to wait for Facebook.
+    Returns:
+        access_token: the long-lived access token.
+    """
+    response = http_session.get(
+        FACEBOOK_GRAPH_URL + '/oauth/access_token',
+        params={'grant_type': 'fb_exchange_token',
+                'client_id': FACEBOOK_CLIENT_ID,
+                'client_secret': FACEBOOK_CLIENT_SECRET,
+                'fb_exchange_token': short_lived_token},
+        timeout=timeout)
+    try:
+        return response.json()['access_token']
+    except ValueError:
+        # Older Graph API versions answer with a query string,
+        # access_token=...&expires=...
+        token = response.text.split('&')[0]
+        return token.split('=')[1]
+
+
+@Timed
+def GetFacebookUser(access_token, timeout=HTTP_TIMEOUT):
+    """ Get the profile of the user an access token belongs to.
+
+    Args:
+        access_token: the user's access token.
+        timeout: seconds to wait for Facebook.
+    Returns:
+        data: a dict with name, id and email.
+    """
+    return GetJSON(FACEBOOK_GRAPH_URL + '/v2.4/me',
+                   {'access_token': access_token,
+                    'fields': 'name,id,email'},
+                   timeout)
+
+
+@Timed
+def GetFacebookPicture(access_token, timeout=HTTP_TIMEOUT):
+    """ Get the URL of the profile picture of the user a token belongs to.
+
+    Args:
+        access_token: the user's access token.
+        timeout: seconds to wait for Facebook.
+    Returns:
+        url: the picture's URL.
+    """
+    data = GetJSON(FACEBOOK_GRAPH_URL + '/v2.4/me/picture',
+                   {'access_token': access_token,
+                    'redirect': 0,
+                    'height': 200,
+                    'width': 200},
+                   timeout)
+    return data['data']['url']
+
+
+@Timed
+def RevokeFacebookPermissions(facebook_id, access_token,
+                              timeout=HTTP_TIMEOUT):
+    """ Revoke the permissions a user granted the app.
+
+    Args:
+        facebook_id: the user's Facebook ID.
+        access_token: the user's access token.
+        timeout: seconds to wait for Facebook.
+    Returns:
+        status: the HTTP status code of Facebook's answer.
+    """
+    response = http_session.delete(
+        FACEBOOK_GRAPH_URL + '/%s/permissions' % facebook_id,
+        params={'access_token': access_token},
+        timeout=timeout)
+    return response.status_code
+
+
+# Login Flow Methods ----------------------------------------------------------
+
+
+def FetchGoogleProfile(access_token, budget=LOGIN_BUDGET):
+    """ Check a Google access token and get its user's profile.
+
+    Both calls only need the token, so they run at the same time. The
+    profile is only used once the caller has checked the token info.
+
+    Args:
+        access_token: the access token from the code exchange.
+        budget: seconds the calls may take in total.
+    Returns:
+        token_info: a dict with user_id and issued_to, or error.
+        profile: a dict with name, picture and email.
+    Raises:
+        ProviderError: if Google did not answer in time.
+    """
+    deadline = Deadline(budget)
+    token_info, profile = CallProviders(
+        deadline,
+        (GetGoogleTokenInfo, (access_token,)),
+        (GetGoogleUserInfo, (access_token,)))
+    return token_info, profile
+
+
+def FetchFacebookProfile(short_lived_token, budget=LOGIN_BUDGET):
+    """ Exchange a Facebook token and get its user's profile and picture.
+
+    The profile and the picture only depend on the long-lived token, so
+    they are fetched at the same time once it has been exchanged.
+
+    Args:
+        short_lived_token: the token the client got from Facebook.
+        budget: seconds the calls may take in total.
+    Returns:
+        access_token: the long-lived access token.
+        profile: a dict with name, id and email.
+        picture: the URL of the user's picture.
+    Raises:
+        ProviderError: if Facebook did not answer in time.
+    """
+    deadline = Deadline(budget)
+    access_token = CallProvider(deadline,
+                                ExchangeFacebookToken,
+                                short_lived_token)
+    profile, picture = CallProviders(
+        deadline,
+        (GetFacebookUser, (access_token,)),
+        (GetFacebookPicture, (access_token,)))
+    return access_token, profile, picture
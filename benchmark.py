@@ -0,0 +1,559 @@
+from timeit import default_timer
+import argparse
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+
+# The app and its db modules read their settings from the environment when
+# they are imported, so they are only imported once the benchmark has
+# pointed ITEMCATALOG_DATABASE_URL at its own db. See LoadApp.
+
+
+# Scale and run settings used when none are given on the command line.
+DEFAULT_USERS = 10
+DEFAULT_CATEGORIES = 50
+DEFAULT_PRODUCTS = 200
+DEFAULT_REQUESTS = 200
+DEFAULT_THREADS = 8
+DEFAULT_DURATION = 10.0
+
+# How much slower a route may get before a comparison fails, as a fraction
+# of the baseline.
+DEFAULT_TOLERANCE = 0.25
+
+SEED_BATCH_SIZE = 1000
+
+WORDS = ['red', 'blue', 'green', 'light', 'heavy', 'classic', 'pro',
+         'junior', 'waterproof', 'leather', 'carbon', 'wool', 'racing',
+         'trail', 'indoor', 'outdoor', 'summer', 'winter', 'padded', 'slim']
+
+
+# Catalog Helper Methods ------------------------------------------------------
+
+
+def Describe(rng, count):
+    """ Make up a few words of product text.
+
+    Args:
+        rng: the random.Random to pick words with.
+        count: the number of words.
+    Returns:
+        text: the words joined by spaces.
+    """
+    return ' '.join(rng.choice(WORDS) for i in xrange(count))
+
+
+def SeedCatalog(engine, users, categories, products, seed=0):
+    """ Fill an empty db with a synthetic catalog.
+
+    Rows are inserted in batches with executemany, so large catalogs take
+    seconds rather than minutes. The search index is filled by its
+    triggers, the category stats are rebuilt at the end.
+
+    Args:
+        engine: the engine of the db to fill.
+        users: the number of users.
+        categories: the number of categories.
+        products: the number of products in each category.
+        seed: the random seed, so the same arguments give the same catalog.
+    Returns:
+        catalog: a dict with the user, category and product IDs.
+    """
+    from sqlalchemy.orm import sessionmaker
+    from database_schema import Category, Product, User
+    from catalog_stats import RebuildCategoryStats
+
+    rng = random.Random(seed)
+    connection = engine.connect()
+    with connection.begin():
+        connection.execute(User.__table__.insert(),
+                           [{'id': user_id,
+                             'name': 'User %d' % user_id,
+                             'email': 'user%d@example.com' % user_id,
+                             'provider': 'google',
+                             'picture': ''}
+                            for user_id in xrange(1, users + 1)])
+        connection.execute(Category.__table__.insert(),
+                           [{'id': category_id,
+                             'name': 'Category %d' % category_id,
+                             'user_id': (category_id - 1) % users + 1}
+                            for category_id in xrange(1, categories + 1)])
+
+    product_owners = {}
+    rows = []
+    product_id = 0
+    for category_id in xrange(1, categories + 1):
+        for i in xrange(products):
+            product_id += 1
+            user_id = rng.randint(1, users)
+            product_owners[product_id] = (category_id, user_id)
+            rows.append({'id': product_id,
+                         'name': '%s %d' % (Describe(rng, 2), i),
+                         'description': Describe(rng, 8),
+                         'price': round(rng.uniform(1, 500), 2),
+                         'category_id': category_id,
+                         'user_id': user_id})
+            if len(rows) == SEED_BATCH_SIZE:
+                with connection.begin():
+                    connection.execute(Product.__table__.insert(), rows)
+                rows = []
+    if rows:
+        with connection.begin():
+            connection.execute(Product.__table__.insert(), rows)
+    connection.close()
+
+    session = sessionmaker(bind=engine)()
+    RebuildCategoryStats(session)
+    session.commit()
+    session.close()
+
+    return {'users': range(1, users + 1),
+            'categories': range(1, categories + 1),
+            'products': product_owners}
+
+
+def LoadApp(database_url, directory):
+    """ Import the app against the benchmark db.
+
+    Args:
+        database_url: the SQLAlchemy URL of the db.
+        directory: where the app keeps its snapshot and job files, so that
+                   none from another db are served.
+    Returns:
+        item_catalog: the app module.
+    """
+    os.environ['ITEMCATALOG_DATABASE_URL'] = database_url
+    os.environ.pop('ITEMCATALOG_READ_DATABASE_URL', None)
+    os.environ['ITEMCATALOG_SNAPSHOT_DIR'] = os.path.join(directory,
+                                                          'snapshots')
+    os.environ['ITEMCATALOG_JOB_DIR'] = os.path.join(directory, 'jobs')
+    os.environ.setdefault('ITEMCATALOG_SESSION_BACKEND', 'memory')
+    import item_catalog
+    item_catalog.app.secret_key = 'benchmark'
+    return item_catalog
+
+
+# Measurement Helper Methods --------------------------------------------------
+
+
+class QueryCounter(object):
+    """ Counts the SQL statements run by the current thread. """
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+        self._local = threading.local()
+        for engine in set(engines):
+            event.listen(engine, 'before_cursor_execute', self.count)
+
+    def count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        """ Get the number of statements counted, and start again at 0. """
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+
+def Percentile(values, percent):
+    """ Get a percentile of a list of numbers by the nearest-rank method.
+
+    Args:
+        values: a sorted list of numbers.
+        percent: the percentile, from 0 to 100.
+    Returns:
+        value: the percentile, None if there are no values.
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def Summarize(latencies, elapsed, queries=None):
+    """ Summarize the timings of one route.
+
+    Args:
+        latencies: the seconds each request took.
+        elapsed: the seconds all the requests took together.
+        queries: the number of SQL statements each request ran, if counted.
+    Returns:
+        summary: a dict of results, with latencies in milliseconds.
+    """
+    latencies = sorted(latencies)
+    summary = {'requests': len(latencies),
+               'p50': Percentile(latencies, 50) * 1000,
+               'p95': Percentile(latencies, 95) * 1000,
+               'p99': Percentile(latencies, 99) * 1000,
+               'throughput': len(latencies) / elapsed if elapsed else 0}
+    if queries:
+        summary['queries'] = float(sum(queries)) / len(queries)
+    return summary
+
+
+def PeakRSS():
+    """ Get the peak resident memory of this process in kilobytes. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes.
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+# Workload Helper Methods -----------------------------------------------------
+
+
+def GetReadRoutes(catalog, rng):
+    """ Get the read-only routes and a way to pick a URL for each.
+
+    Args:
+        catalog: the dict returned by SeedCatalog.
+        rng: the random.Random to pick IDs with.
+    Returns:
+        routes: a list of (name, url_function) tuples.
+    """
+    products = catalog['products']
+    product_ids = sorted(products)
+
+    def AnyCategory():
+        return rng.choice(catalog['categories'])
+
+    def AnyProduct():
+        product_id = rng.choice(product_ids)
+        return products[product_id][0], product_id
+
+    return [
+        ('categoryListing', lambda: '/catalog/'),
+        ('productListing', lambda: '/catalog/%d/' % AnyCategory()),
+        ('productListing.sorted',
+         lambda: '/catalog/%d/?sort=-price' % AnyCategory()),
+        ('viewProduct', lambda: '/catalog/%d/%d/view/' % AnyProduct()),
+        ('searchProducts',
+         lambda: '/catalog/search/?q=%s' % rng.choice(WORDS)),
+        ('searchProductsJSON',
+         lambda: '/catalog/search/json/?q=%s' % rng.choice(WORDS)),
+        ('allCategoriesJSON', lambda: '/catalog/allcategories/json/'),
+        ('allCategoriesXML', lambda: '/catalog/allcategories/xml/'),
+        ('allProductsJSON.page',
+         lambda: '/catalog/allProducts/json/?limit=100'),
+        ('allProductsJSON', lambda: '/catalog/allProducts/json/'),
+        ('allProductsXML', lambda: '/catalog/allProducts/xml/'),
+        ('categoryFacetsJSON', lambda: '/catalog/facets/json/'),
+    ]
+
+
+def LogIn(client, user_id):
+    """ Log a test client in and give it a CSRF token for its next POST.
+
+    Args:
+        client: the Flask test client.
+        user_id: the ID of the user to log in as.
+    Returns:
+        csrf_token: the token to submit with the form.
+    """
+    with client.session_transaction() as login_session:
+        login_session['provider'] = 'google'
+        login_session['user_id'] = user_id
+        login_session['username'] = 'User %d' % user_id
+        login_session['email'] = 'user%d@example.com' % user_id
+        login_session['picture'] = ''
+        login_session['credentials'] = 'benchmark'
+        login_session['csrf_token'] = 'benchmark'
+    return 'benchmark'
+
+
+def GetProductID(item_catalog, category_id, name):
+    """ Look up a product the benchmark just added. """
+    with item_catalog.app.app_context():
+        product_id = item_catalog.session.query(item_catalog.Product.id).\
+            filter_by(category_id=category_id, name=name).scalar()
+        item_catalog.session.remove()
+    return product_id
+
+
+# Benchmark Methods -----------------------------------------------------------
+
+
+def RunTestClient(item_catalog, catalog, requests_per_route, seed=0):
+    """ Time every route in-process with Flask's test client.
+
+    Each mutation round adds a product, edits it and deletes it again, so
+    the catalog is the same size at the end as it was at the start.
+
+    Args:
+        item_catalog: the app module.
+        catalog: the dict returned by SeedCatalog.
+        requests_per_route: the number of timed requests per route.
+        seed: the random seed for picking IDs.
+    Returns:
+        results: a dict of route name to summary.
+    """
+    rng = random.Random(seed)
+    counter = QueryCounter([item_catalog.write_engine,
+                            item_catalog.read_engine])
+    latencies = {}
+    queries = {}
+
+    def Time(name, send):
+        counter.reset()
+        start = default_timer()
+        response = send()
+        latencies.setdefault(name, []).append(default_timer() - start)
+        queries.setdefault(name, []).append(counter.reset())
+        if response.status_code >= 400:
+            raise AssertionError('%s answered %d' % (name,
+                                                     response.status_code))
+        response.close()
+
+    anonymous = item_catalog.app.test_client()
+    client = item_catalog.app.test_client()
+    user_id = catalog['users'][0]
+    read_routes = GetReadRoutes(catalog, rng)
+
+    for name, url in read_routes:
+        for i in xrange(requests_per_route):
+            Time(name, lambda: anonymous.get(url()))
+
+    # Logged-in users skip the response cache, so the HTML pages are timed
+    # again for them.
+    LogIn(client, user_id)
+    for name, url in read_routes[:4]:
+        for i in xrange(requests_per_route):
+            Time(name + '.loggedIn', lambda: client.get(url()))
+
+    owned = [category_id for category_id in catalog['categories']
+             if (category_id - 1) % len(catalog['users']) == 0]
+    for i in xrange(requests_per_route):
+        category_id = rng.choice(owned)
+        name = 'benchmark %d' % i
+        data = {'name': name,
+                'description': Describe(rng, 8),
+                'price': '9.99',
+                'csrf_token': LogIn(client, user_id)}
+        Time('addProduct',
+             lambda: client.post('/catalog/%d/add/' % category_id, data=data))
+
+        url = '/catalog/%d/%d/' % (category_id,
+                                   GetProductID(item_catalog,
+                                                category_id,
+                                                name))
+        data = {'name': name,
+                'description': Describe(rng, 8),
+                'price': '19.99',
+                'csrf_token': LogIn(client, user_id)}
+        Time('editProduct', lambda: client.post(url + 'edit/', data=data))
+
+        data = {'csrf_token': LogIn(client, user_id)}
+        Time('deleteProduct', lambda: client.post(url + 'delete/', data=data))
+
+    return dict((name, Summarize(latencies[name],
+                                 sum(latencies[name]),
+                                 queries[name]))
+                for name in latencies)
+
+
+def RunHTTPLoad(item_catalog, catalog, threads, duration, seed=0):
+    """ Load the read-only routes over real HTTP from several threads.
+
+    The app is served by a threaded werkzeug server on a free local port,
+    and every load thread keeps its own keep-alive connection.
+
+    Args:
+        item_catalog: the app module.
+        catalog: the dict returned by SeedCatalog.
+        threads: the number of concurrent clients.
+        duration: the number of seconds to run for.
+        seed: the random seed for picking IDs.
+    Returns:
+        results: a dict of route name to summary, with the totals under
+                 'all'.
+    """
+    import requests
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, item_catalog.app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    base_url = 'http://127.0.0.1:%d' % server.server_port
+
+    # Each client appends to its own lists, so no lock is needed.
+    samples = [{} for i in xrange(threads)]
+    errors = []
+    deadline = default_timer() + duration
+
+    def Client(number):
+        rng = random.Random(seed + number)
+        routes = [route for route in GetReadRoutes(catalog, rng)
+                  if route[0] not in ('allProductsJSON', 'allProductsXML')]
+        http_session = requests.Session()
+        while default_timer() < deadline:
+            name, url = rng.choice(routes)
+            start = default_timer()
+            response = http_session.get(base_url + url())
+            # Read the whole body, streamed exports included.
+            response.content
+            samples[number].setdefault(name, []).append(
+                default_timer() - start)
+            if response.status_code >= 400:
+                errors.append((name, response.status_code))
+
+    started = default_timer()
+    clients = [threading.Thread(target=Client, args=(number,))
+               for number in xrange(threads)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = default_timer() - started
+    server.shutdown()
+
+    if errors:
+        raise AssertionError('%d requests failed, the first was %s %d'
+                             % ((len(errors),) + errors[0]))
+
+    latencies = {}
+    for client_samples in samples:
+        for name, values in client_samples.items():
+            latencies.setdefault(name, []).extend(values)
+    results = dict((name, Summarize(values, elapsed))
+                   for name, values in latencies.items())
+    results['all'] = Summarize(sum(latencies.values(), []), elapsed)
+    return results
+
+
+# Report Helper Methods -------------------------------------------------------
+
+
+def PrintResults(title, results):
+    """ Print a table of route summaries. """
+    print title
+    print '%-28s %8s %9s %9s %9s %10s %8s' % ('route', 'requests', 'p50 ms',
+                                             'p95 ms', 'p99 ms', 'req/s',
+                                             'queries')
+    for name in sorted(results):
+        summary = results[name]
+        queries = summary.get('queries')
+        print '%-28s %8d %9.2f %9.2f %9.2f %10.1f %8s' % (
+            name, summary['requests'], summary['p50'], summary['p95'],
+            summary['p99'], summary['throughput'],
+            '%.1f' % queries if queries is not None else '-')
+    print
+
+
+def CompareResults(baseline, report, tolerance=DEFAULT_TOLERANCE):
+    """ Find routes that got slower than a saved baseline.
+
+    A route regresses when its p95 latency grew, or its throughput fell, by
+    more than the tolerance, or when it runs more queries than before.
+
+    Args:
+        baseline: a report loaded from a baseline file.
+        report: the report of this run.
+        tolerance: the allowed slowdown, as a fraction of the baseline.
+    Returns:
+        regressions: a list of messages, empty if nothing regressed.
+    """
+    regressions = []
+    for mode in ('test_client', 'http'):
+        for name, summary in sorted(report.get(mode, {}).items()):
+            old = baseline.get(mode, {}).get(name)
+            if old is None:
+                continue
+            label = '%s %s' % (mode, name)
+            if summary['p95'] > old['p95'] * (1 + tolerance):
+                regressions.append('%s: p95 %.2f ms, was %.2f ms'
+                                   % (label, summary['p95'], old['p95']))
+            if summary['throughput'] < old['throughput'] * (1 - tolerance):
+                regressions.append('%s: %.1f req/s, was %.1f req/s'
+                                   % (label, summary['throughput'],
+                                      old['throughput']))
+            if summary.get('queries', 0) > old.get('queries', 0):
+                regressions.append('%s: %.1f queries, was %.1f'
+                                   % (label, summary['queries'],
+                                      old.get('queries', 0)))
+    if baseline.get('scale') != report.get('scale'):
+        regressions.append('the baseline was made at a different scale, '
+                           '%s' % (baseline.get('scale'),))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark every route of the item catalog against a '
+                    'synthetic catalog.')
+    parser.add_argument('--users', type=int, default=DEFAULT_USERS,
+                        help='the number of users to create')
+    parser.add_argument('--categories', type=int, default=DEFAULT_CATEGORIES,
+                        help='the number of categories to create')
+    parser.add_argument('--products', type=int, default=DEFAULT_PRODUCTS,
+                        help='the number of products per category')
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS,
+                        help='the number of timed requests per route with '
+                             'the test client')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help='the number of concurrent HTTP clients, 0 to '
+                             'skip the HTTP load')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+                        help='the number of seconds to run the HTTP load for')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='the random seed for the catalog and workload')
+    parser.add_argument('--save', metavar='PATH',
+                        help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='the allowed slowdown against the baseline, as '
+                             'a fraction')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='itemcatalog-benchmark-')
+    try:
+        database_url = 'sqlite:///' + os.path.join(directory, 'catalog.db')
+        item_catalog = LoadApp(database_url, directory)
+
+        start = default_timer()
+        catalog = SeedCatalog(item_catalog.engine, args.users,
+                              args.categories, args.products, args.seed)
+        print 'Seeded %d users, %d categories and %d products in %.1fs.' % (
+            args.users, args.categories, len(catalog['products']),
+            default_timer() - start)
+        print
+
+        report = {'scale': {'users': args.users,
+                            'categories': args.categories,
+                            'products': args.products}}
+        report['test_client'] = RunTestClient(item_catalog, catalog,
+                                              args.requests, args.seed)
+        PrintResults('Test client', report['test_client'])
+
+        if args.threads:
+            report['http'] = RunHTTPLoad(item_catalog, catalog, args.threads,
+                                         args.duration, args.seed)
+            PrintResults('HTTP, %d threads' % args.threads, report['http'])
+
+        report['peak_rss_kb'] = PeakRSS()
+        print 'Peak RSS: %.1f MB' % (report['peak_rss_kb'] / 1024.0)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2, sort_keys=True)
+        print 'Saved the baseline to %s.' % args.save
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = CompareResults(baseline, report, args.tolerance)
+        for message in regressions:
+            print 'Regression: %s' % message
+        if not regressions:
+            print 'No regressions against %s.' % args.compare
+        sys.exit(1 if regressions else 0)
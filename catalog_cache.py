@@ -0,0 +1,144 @@
+from collections import namedtuple, OrderedDict
+import threading
+import time
+
+from catalog_queries import CategoryListQuery
+from catalog_version import GetVersion, CATEGORIES_VERSION
+
+
+# How long, in seconds, a process trusts its cached category list before it
+# checks the shared version row for changes made by other processes.
+CATEGORY_CACHE_CHECK_INTERVAL = 1.0
+
+# How many rendered sidebars a process keeps for the current category list.
+FRAGMENT_CACHE_SIZE = 256
+
+
+class CategoryRow(namedtuple('CategoryRow', ['id', 'name', 'user_id'])):
+    """ The columns of a category needed to render the sidebar. """
+    __slots__ = ()
+
+    # Return the category row in a format for JSON.
+    @property
+    def serialize(self):
+        return {'id': self.id,
+                'name': self.name
+                }
+
+
+class CategoryCache(object):
+    """ A process-local cache of the sorted category list.
+
+    The cache remembers the value of the categories change counter it was
+    loaded at. Changes made in this process call invalidate() directly,
+    changes made by other processes are picked up the next time the counter
+    is checked.
+    """
+
+    def __init__(self, check_interval=CATEGORY_CACHE_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._categories = None
+        self._generation = None
+        self._checked = 0
+
+    def get(self, session):
+        """ Get the sorted category list, reloading it if it is stale.
+
+        Args:
+            session: the db session to load categories with.
+        Returns:
+            categories: a tuple of CategoryRow tuples sorted by name.
+        """
+        categories = self._categories
+        now = time.time()
+        if categories is not None and now - self._checked < self.check_interval:
+            return categories
+
+        generation = GetVersion(session, CATEGORIES_VERSION)
+        with self._lock:
+            if self._categories is None or generation != self._generation:
+                rows = CategoryListQuery(session)
+                self._categories = tuple(CategoryRow(*row) for row in rows)
+                self._generation = generation
+            self._checked = now
+            return self._categories
+
+    def invalidate(self):
+        """ Drop the cached category list. """
+        with self._lock:
+            self._categories = None
+            self._generation = None
+
+
+class FragmentCache(object):
+    """ A process-local cache of fragments rendered from the category list.
+
+    Fragments are only kept for the category list they were rendered from.
+    Once CategoryCache loads a new list after a change, every fragment
+    cached for the old one is dropped.
+    """
+
+    def __init__(self, size=FRAGMENT_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._categories = None
+        self._owners = None
+        self._fragments = OrderedDict()
+
+    def _reset(self, categories):
+        # Called with the lock held.
+        if categories is not self._categories:
+            self._categories = categories
+            self._owners = None
+            self._fragments.clear()
+
+    def owned(self, categories, user_id):
+        """ Get the IDs of the categories a user owns.
+
+        Args:
+            categories: the category list from CategoryCache.
+            user_id: the ID of the user, or None.
+        Returns:
+            category_ids: a frozenset of category IDs.
+        """
+        with self._lock:
+            self._reset(categories)
+            if self._owners is None:
+                owners = {}
+                for category in categories:
+                    owners.setdefault(category.user_id, set()).add(
+                        category.id)
+                self._owners = dict((owner, frozenset(ids))
+                                    for owner, ids in owners.items())
+            return self._owners.get(user_id, frozenset())
+
+    def get(self, categories, key, render):
+        """ Get a fragment, rendering it if it is not cached.
+
+        Args:
+            categories: the category list from CategoryCache.
+            key: what else the fragment depends on.
+            render: a function that renders the fragment.
+        Returns:
+            fragment: the rendered fragment.
+        """
+        with self._lock:
+            self._reset(categories)
+            fragment = self._fragments.pop(key, None)
+            if fragment is not None:
+                self._fragments[key] = fragment
+                return fragment
+
+        fragment = render()
+        with self._lock:
+            if categories is self._categories:
+                self._fragments[key] = fragment
+                while len(self._fragments) > self.size:
+                    self._fragments.popitem(last=False)
+        return fragment
+
+
+class UserProfile(namedtuple('UserProfile', ['id', 'name', 'picture'])):
+    """ The columns of a user needed to render pages for them. """
+    __slots__ = ()
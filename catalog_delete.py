@@ -0,0 +1,91 @@
+import os
+
+from sqlalchemy import func, select
+
+from database_schema import Category, Product
+from catalog_stats import CategoryDeleted
+from catalog_version import BumpVersion, CategoryVersionName
+from catalog_version import CATEGORIES_VERSION, CATALOG_VERSION
+
+
+# Products deleted per transaction. Each chunk commits, so the single
+# writer connection is handed back to other requests between chunks.
+DELETE_CHUNK_SIZE = int(os.environ.get('ITEMCATALOG_DELETE_CHUNK_SIZE', 5000))
+
+# Categories with more products than this are deleted by a background job.
+BACKGROUND_DELETE_THRESHOLD = int(os.environ.get(
+    'ITEMCATALOG_BACKGROUND_DELETE_THRESHOLD', 10000))
+
+
+def CountProducts(session, category_id):
+    """ Count the products in a category.
+
+    Args:
+        session: the db session to read with.
+        category_id: the ID of the category.
+    Returns:
+        count: the number of products.
+    """
+    return session.query(func.count(Product.id)).\
+        filter_by(category_id=category_id).scalar()
+
+
+def DeleteProductChunk(session, category_id, chunk_size=DELETE_CHUNK_SIZE):
+    """ Delete up to chunk_size products of a category in one statement.
+
+    The products are picked by a subquery on the category index, so their
+    IDs never leave the db.
+
+    Args:
+        session: the db session to delete with.
+        category_id: the ID of the category.
+        chunk_size: the most products to delete.
+    Returns:
+        deleted: the number of products deleted.
+    """
+    chunk = select([Product.id]).\
+        where(Product.category_id == category_id).\
+        limit(chunk_size)
+    result = session.execute(Product.__table__.delete().
+                             where(Product.id.in_(chunk)))
+    return result.rowcount
+
+
+def DeleteCategory(session, category_id, chunk_size=DELETE_CHUNK_SIZE,
+                   progress=None):
+    """ Delete a category and its products in bounded transactions.
+
+    Products go first, a chunk per commit, then the category, its stats and
+    the change counters in a final transaction. The search index is kept up
+    to date by its triggers.
+
+    Args:
+        session: the db session to delete with.
+        category_id: the ID of the category to delete.
+        chunk_size: the number of products deleted per transaction.
+        progress: called with the number of products deleted so far after
+                  each chunk.
+    Returns:
+        deleted: the number of products deleted.
+    """
+    deleted = 0
+    while True:
+        count = DeleteProductChunk(session, category_id, chunk_size)
+        if not count:
+            break
+        deleted += count
+        # Pages of the category show the products that are left.
+        BumpVersion(session, CategoryVersionName(category_id))
+        BumpVersion(session, CATALOG_VERSION)
+        session.commit()
+        if progress is not None:
+            progress(deleted)
+
+    session.query(Category).filter_by(id=category_id).\
+        delete(synchronize_session=False)
+    CategoryDeleted(session, category_id)
+    BumpVersion(session, CategoryVersionName(category_id))
+    BumpVersion(session, CATEGORIES_VERSION)
+    BumpVersion(session, CATALOG_VERSION)
+    session.commit()
+    return deleted
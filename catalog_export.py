@@ -0,0 +1,185 @@
+import json
+
+from xml.sax.saxutils import escape
+
+from database_schema import Product
+from catalog_filters import ApplyProductFilters, GetProductOrder
+from catalog_paging import GetPage
+
+
+# Rows fetched from the db per round trip, and written to the response per
+# chunk, while exporting.
+EXPORT_BATCH_SIZE = 1000
+
+# The product columns included in an export, in the order they are queried.
+PRODUCT_FIELDS = ('id', 'name', 'description', 'price', 'category_id')
+
+
+def GetProductColumns(session):
+    """ Get a query for the exported product columns.
+
+    Args:
+        session: the db session to query with.
+    Returns:
+        query: a query returning tuples in the order of PRODUCT_FIELDS.
+    """
+    columns = [getattr(Product, field) for field in PRODUCT_FIELDS]
+    return session.query(*columns)
+
+
+def ProductRowsQuery(session, filters=None):
+    """ Get a query for every product as a plain column tuple, in order.
+
+    Args:
+        session: the db session to query with.
+        filters: a ProductFilters tuple, None for every product in id order.
+    Returns:
+        query: a query returning tuples in the order of PRODUCT_FIELDS.
+    """
+    rows = GetProductColumns(session)
+    if filters is None:
+        return rows.order_by(Product.id)
+    return ApplyProductFilters(rows, filters).\
+        order_by(*[column.desc() if descending else column
+                   for column, descending in GetProductOrder(filters)])
+
+
+def GetProductRows(session, filters=None, batch_size=EXPORT_BATCH_SIZE):
+    """ Get every product as a plain column tuple.
+
+    Rows are fetched from the db in batches as the result is iterated, and
+    no Product objects are built.
+
+    Args:
+        session: the db session to query with.
+        filters: a ProductFilters tuple, None for every product in id order.
+        batch_size: the number of rows to fetch per batch.
+    Returns:
+        rows: an iterable of tuples in the order of PRODUCT_FIELDS.
+    """
+    return ProductRowsQuery(session, filters).yield_per(batch_size)
+
+
+def GetProductPage(session, after, limit, filters=None):
+    """ Get one page of products as plain column tuples.
+
+    Args:
+        session: the db session to query with.
+        after: the cursor of the page to get, None for the first page.
+        limit: the number of products per page.
+        filters: a ProductFilters tuple, None for every product in id order.
+    Returns:
+        page: a Page tuple of rows in the order of PRODUCT_FIELDS.
+    Raises:
+        ValueError: if the cursor is malformed.
+    """
+    rows = GetProductColumns(session)
+    if filters is None:
+        return GetPage(rows, [(Product.id, False)], after, limit)
+    return GetPage(ApplyProductFilters(rows, filters),
+                   GetProductOrder(filters),
+                   after,
+                   limit)
+
+
+def StreamJSON(name, fields, rows, batch_size=EXPORT_BATCH_SIZE,
+               next_url=None):
+    """ Write rows as a JSON document, one chunk at a time.
+
+    The document has the same shape as jsonify(name=[...]).
+
+    Args:
+        name: the key holding the list of rows.
+        fields: the field names of the row tuples.
+        rows: an iterable of row tuples.
+        batch_size: the number of rows per chunk.
+        next_url: if given, added under "next" as the link to the next page.
+    Yields:
+        Chunks of the JSON document.
+    """
+    yield '{%s: [' % json.dumps(name)
+    separator = ''
+    chunk = []
+    for row in rows:
+        chunk.append(separator)
+        chunk.append(json.dumps(dict(zip(fields, row)), sort_keys=True))
+        separator = ', '
+        if len(chunk) >= 2 * batch_size:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']')
+    if next_url is not None:
+        chunk.append(', "next": %s' % json.dumps(next_url))
+    chunk.append('}')
+    yield ''.join(chunk)
+
+
+def StreamNDJSON(fields, rows, batch_size=EXPORT_BATCH_SIZE):
+    """ Write rows as newline delimited JSON, one chunk at a time.
+
+    Args:
+        fields: the field names of the row tuples.
+        rows: an iterable of row tuples.
+        batch_size: the number of rows per chunk.
+    Yields:
+        Chunks of lines, each line holding one JSON object.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(dict(zip(fields, row)), sort_keys=True))
+        chunk.append('\n')
+        if len(chunk) >= 2 * batch_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def StreamXML(root, element, fields, rows, batch_size=EXPORT_BATCH_SIZE,
+              next_url=None):
+    """ Write rows as an XML document, one chunk at a time.
+
+    Each row becomes an element with one child per field, the same layout
+    an ElementTree built with SubElement would serialize to.
+
+    Args:
+        root: the tag of the document element.
+        element: the tag of the element written for each row.
+        fields: the field names of the row tuples, used as child tags.
+        rows: an iterable of row tuples.
+        batch_size: the number of rows per chunk.
+        next_url: if given, added as a <next> element linking to the next
+                  page.
+    Yields:
+        Chunks of the XML document.
+    """
+    # Build the tags once instead of once per value. Like ElementTree, an
+    # empty value is written as a self-closing tag.
+    tags = [('<%s>' % field, '</%s>' % field, '<%s />' % field)
+            for field in fields]
+    row_open = '<%s>' % element
+    row_close = '</%s>' % element
+
+    yield '<%s>' % root
+    chunk = []
+    count = 0
+    for row in rows:
+        chunk.append(row_open)
+        for (tag_open, tag_close, tag_empty), value in zip(tags, row):
+            text = escape('%s' % (value,))
+            if text:
+                chunk.append(tag_open)
+                chunk.append(text)
+                chunk.append(tag_close)
+            else:
+                chunk.append(tag_empty)
+        chunk.append(row_close)
+        count += 1
+        if count >= batch_size:
+            yield ''.join(chunk)
+            chunk = []
+            count = 0
+    if next_url is not None:
+        chunk.append('<next>%s</next>' % escape(next_url))
+    chunk.append('</%s>' % root)
+    yield ''.join(chunk)
@@ -0,0 +1,91 @@
+from collections import namedtuple
+
+from database_schema import Product
+from catalog_stats import ParsePrice
+
+
+# The sort orders a client can ask for, as (column, descending) tuples.
+# Each one ends with the primary key so that keyset pagination works.
+PRODUCT_SORTS = {
+    'name': [(Product.name, False), (Product.id, False)],
+    'price': [(Product.price, False), (Product.id, False)],
+    '-price': [(Product.price, True), (Product.id, True)],
+    'id': [(Product.id, False)],
+}
+
+
+# The filters a client can apply to a product listing.
+ProductFilters = namedtuple('ProductFilters', ['min_price',
+                                               'max_price',
+                                               'category_ids',
+                                               'sort'])
+
+
+def ParseCategoryIDs(args):
+    """ Read the category IDs from a request's query string.
+
+    Args:
+        args: the request's query string arguments. category_id may be
+              given several times.
+    Returns:
+        category_ids: a list of ints, empty if none were given.
+    Raises:
+        ValueError: if a category ID is not a number.
+    """
+    return [int(category_id) for category_id in args.getlist('category_id')]
+
+
+def ParseProductFilters(args, default_sort):
+    """ Read the product filters from a request's query string.
+
+    Args:
+        args: the request's query string arguments. min_price and max_price
+              bound the price, category_id may be given several times, and
+              sort is one of PRODUCT_SORTS.
+        default_sort: the sort to use when none is given.
+    Returns:
+        filters: a ProductFilters tuple.
+    Raises:
+        ValueError: if a price is not a finite number, a category ID is not
+                    a number or the sort is unknown.
+    """
+    sort = args.get('sort') or default_sort
+    if sort not in PRODUCT_SORTS:
+        raise ValueError('Unknown sort %s.' % sort)
+    return ProductFilters(ParsePrice(args.get('min_price')),
+                          ParsePrice(args.get('max_price')),
+                          ParseCategoryIDs(args),
+                          sort)
+
+
+def ApplyProductFilters(query, filters):
+    """ Restrict a product query to the rows matching the filters.
+
+    Filtering or sorting on price leaves out products without a price.
+
+    Args:
+        query: a query over the product table.
+        filters: a ProductFilters tuple.
+    Returns:
+        query: the filtered query.
+    """
+    if filters.min_price is not None:
+        query = query.filter(Product.price >= filters.min_price)
+    if filters.max_price is not None:
+        query = query.filter(Product.price <= filters.max_price)
+    if filters.sort in ('price', '-price'):
+        query = query.filter(Product.price != None)
+    if filters.category_ids:
+        query = query.filter(Product.category_id.in_(filters.category_ids))
+    return query
+
+
+def GetProductOrder(filters):
+    """ Get the sort order asked for by the filters.
+
+    Args:
+        filters: a ProductFilters tuple.
+    Returns:
+        order: a list of (column, descending) tuples.
+    """
+    return PRODUCT_SORTS[filters.sort]
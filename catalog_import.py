@@ -0,0 +1,300 @@
+""" Bulk import products from a CSV or NDJSON file.
+
+Usage:
+    python catalog_import.py products.csv --user-id 1
+    python catalog_import.py products.ndjson --user-id 1 --chunk-size 5000
+
+Each record needs a name and a category (the category's name), and may
+have a description and a price. CSV files need a header row with those
+column names.
+"""
+from collections import namedtuple
+import argparse
+import csv
+import json
+import sys
+
+from sqlalchemy.orm import sessionmaker
+
+from database_engine import CreateEngine
+from database_schema import Category, Product
+from catalog_stats import ParseProductPrice, ProductsAdded
+from catalog_version import BumpVersion, CategoryVersionName
+from catalog_version import CATALOG_VERSION
+
+
+# Rows inserted per transaction. Each chunk is committed on its own, so a
+# large import never holds the write lock for long.
+IMPORT_CHUNK_SIZE = 1000
+
+# The most values bound to a single IN clause, below SQLite's limit on
+# query parameters.
+MAX_IN_VALUES = 400
+
+# Column lengths from database_schema.py.
+MAX_NAME_LENGTH = 80
+MAX_DESCRIPTION_LENGTH = 250
+
+
+# A record that could not be imported, and why.
+RowError = namedtuple('RowError', ['line', 'message'])
+
+# The outcome of an import.
+ImportResult = namedtuple('ImportResult', ['imported', 'errors'])
+
+
+# Reader Helper Methods -------------------------------------------------------
+
+
+def DecodeText(value):
+    """ Decode a value read from a file into text.
+
+    Args:
+        value: a byte string, text or None.
+    Returns:
+        text: the value as text, None if it was None.
+    """
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def ReadCSV(stream):
+    """ Read records from a CSV file with a header row.
+
+    Args:
+        stream: the open file.
+    Yields:
+        (line, record, error) tuples. record is a dict, or None if the line
+        could not be parsed, in which case error says why.
+    """
+    reader = csv.DictReader(stream)
+    try:
+        for record in reader:
+            yield (reader.line_num,
+                   dict((DecodeText(key), DecodeText(value))
+                        for key, value in record.items()),
+                   None)
+    except (csv.Error, UnicodeError) as e:
+        yield reader.line_num, None, str(e)
+
+
+def ReadNDJSON(stream):
+    """ Read records from a file holding one JSON object per line.
+
+    Args:
+        stream: the open file.
+    Yields:
+        (line, record, error) tuples. record is a dict, or None if the line
+        could not be parsed, in which case error says why.
+    """
+    for line_number, line in enumerate(stream, 1):
+        line = DecodeText(line).strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, str(e)
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, 'Expected a JSON object.'
+            continue
+        yield line_number, record, None
+
+
+READERS = {
+    'csv': ReadCSV,
+    'ndjson': ReadNDJSON,
+}
+
+
+# Import Helper Methods -------------------------------------------------------
+
+
+def GetText(record, field):
+    """ Get a field of a record as stripped text.
+
+    Args:
+        record: a dict read from the import file.
+        field: the name of the field.
+    Returns:
+        text: the field's value, '' if it is missing.
+    """
+    value = record.get(field)
+    if value is None:
+        return ''
+    return ('%s' % (value,)).strip()
+
+
+def ValidateRecord(record, category_ids):
+    """ Check a record and turn it into a product row.
+
+    Args:
+        record: a dict read from the import file.
+        category_ids: a dict of category name to category ID.
+    Returns:
+        row: a dict of Product column values, None if the record is invalid.
+        error: why the record is invalid, None if it is valid.
+    """
+    name = GetText(record, 'name')
+    if not name:
+        return None, 'Name is required.'
+    if len(name) > MAX_NAME_LENGTH:
+        return None, 'Name is longer than %d characters.' % MAX_NAME_LENGTH
+
+    description = GetText(record, 'description')
+    if len(description) > MAX_DESCRIPTION_LENGTH:
+        return None, ('Description is longer than %d characters.'
+                      % MAX_DESCRIPTION_LENGTH)
+
+    try:
+        price = ParseProductPrice(record.get('price'))
+    except ValueError as e:
+        return None, str(e)
+
+    category = GetText(record, 'category')
+    if category not in category_ids:
+        return None, 'Category "%s" does not exist.' % category
+
+    return {'name': name,
+            'description': description,
+            'price': price,
+            'category_id': category_ids[category]}, None
+
+
+def GetExistingProducts(session, keys):
+    """ Find which (category_id, name) pairs are already taken in the db.
+
+    Args:
+        session: the db session to query with.
+        keys: a list of (category_id, name) tuples.
+    Returns:
+        existing: the set of the given tuples that already exist.
+    """
+    existing = set()
+    for start in range(0, len(keys), MAX_IN_VALUES):
+        batch = keys[start:start + MAX_IN_VALUES]
+        category_ids = list(set(category_id for category_id, name in batch))
+        names = list(set(name for category_id, name in batch))
+        existing.update(session.query(Product.category_id, Product.name).
+                        filter(Product.category_id.in_(category_ids),
+                               Product.name.in_(names)))
+    return existing.intersection(keys)
+
+
+def InsertChunk(session, chunk, user_id, seen, errors):
+    """ Insert one chunk of validated rows in a single transaction.
+
+    Rows whose name is already taken in their category, in the db or
+    earlier in the import, are reported as errors instead.
+
+    Args:
+        session: the db session to insert with.
+        chunk: a list of (line, row) tuples.
+        user_id: the ID of the user that will own the products.
+        seen: a set of (category_id, name) pairs imported so far.
+        errors: the list to add RowError tuples to.
+    Returns:
+        imported: the number of products inserted.
+    """
+    keys = [(row['category_id'], row['name']) for line, row in chunk]
+    existing = GetExistingProducts(session, keys)
+
+    rows = []
+    category_prices = {}
+    for (line, row), key in zip(chunk, keys):
+        if key in existing or key in seen:
+            errors.append(RowError(line, 'Product "%s" already exists in '
+                                         'this category.' % row['name']))
+            continue
+        seen.add(key)
+        row['user_id'] = user_id
+        rows.append(row)
+        category_prices.setdefault(row['category_id'], []).append(
+            row['price'])
+
+    if rows:
+        session.execute(Product.__table__.insert(), rows)
+        BumpVersion(session, CATALOG_VERSION)
+        for category_id, prices in category_prices.items():
+            ProductsAdded(session, category_id, prices)
+            BumpVersion(session, CategoryVersionName(category_id))
+    session.commit()
+    return len(rows)
+
+
+def ImportProducts(session, records, user_id, chunk_size=IMPORT_CHUNK_SIZE):
+    """ Import products, inserting them in batched transactions.
+
+    Category names are resolved to IDs with a single query up front.
+
+    Args:
+        session: the db session to insert with.
+        records: an iterable of (line, record, error) tuples, as yielded by
+                 ReadCSV or ReadNDJSON.
+        user_id: the ID of the user that will own the products.
+        chunk_size: the number of products inserted per transaction.
+    Returns:
+        result: an ImportResult with the number of products imported and a
+                list of RowError tuples for the records that were skipped,
+                in line order.
+    """
+    category_ids = dict(session.query(Category.name, Category.id))
+    seen = set()
+    errors = []
+    imported = 0
+    chunk = []
+
+    for line, record, error in records:
+        if error is None:
+            row, error = ValidateRecord(record, category_ids)
+        if error is not None:
+            errors.append(RowError(line, error))
+            continue
+        chunk.append((line, row))
+        if len(chunk) >= chunk_size:
+            imported += InsertChunk(session, chunk, user_id, seen, errors)
+            chunk = []
+
+    if chunk:
+        imported += InsertChunk(session, chunk, user_id, seen, errors)
+    # Duplicates are only found when their chunk is inserted, after the
+    # invalid records that follow them.
+    errors.sort(key=lambda error: error.line)
+    return ImportResult(imported, errors)
+
+
+# -----------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Bulk import products into the item catalog.')
+    parser.add_argument('path', help='the CSV or NDJSON file to import')
+    parser.add_argument('--user-id', type=int, required=True,
+                        help='the ID of the user that will own the products')
+    parser.add_argument('--format', choices=sorted(READERS),
+                        help='the file format, guessed from the extension '
+                             'if not given')
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE,
+                        help='the number of products inserted per '
+                             'transaction')
+    args = parser.parse_args()
+
+    file_format = args.format
+    if file_format is None:
+        file_format = 'csv' if args.path.endswith('.csv') else 'ndjson'
+
+    session = sessionmaker(bind=CreateEngine())()
+    with open(args.path, 'rb') as stream:
+        result = ImportProducts(session,
+                                READERS[file_format](stream),
+                                args.user_id,
+                                args.chunk_size)
+
+    for error in result.errors:
+        print 'Line %d: %s' % (error.line, error.message)
+    print 'Imported %d products, skipped %d.' % (result.imported,
+                                                len(result.errors))
+    sys.exit(1 if result.errors else 0)
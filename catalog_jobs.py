@@ -0,0 +1,527 @@
+from timeit import default_timer
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.exc import OperationalError, TimeoutError
+from sqlalchemy.orm import sessionmaker
+
+from database_engine import CreateEngine
+from database_schema import Job
+from catalog_delete import CountProducts, DeleteCategory
+from catalog_export import GetProductRows, StreamJSON, StreamNDJSON
+from catalog_export import StreamXML, PRODUCT_FIELDS, EXPORT_BATCH_SIZE
+from catalog_filters import ProductFilters
+from catalog_import import ImportProducts, READERS
+from catalog_snapshots import BuildSnapshot, SNAPSHOT_DELAY
+
+
+# Where job results and uploaded import files are kept.
+JOB_DIR = os.environ.get('ITEMCATALOG_JOB_DIR',
+                         os.path.join(tempfile.gettempdir(),
+                                      'itemcatalog-jobs'))
+
+# Worker threads the web app runs itself. Set to 0 when jobs are run by
+# catalog_jobs.py instead.
+APP_JOB_THREADS = int(os.environ.get('ITEMCATALOG_APP_JOB_THREADS', 1))
+
+# Seconds a worker sleeps when there is no job to run.
+JOB_POLL_INTERVAL = float(os.environ.get('ITEMCATALOG_JOB_POLL_INTERVAL', 1))
+
+# Times a job is tried before it is marked failed, and the wait before the
+# first retry, which doubles with every attempt.
+JOB_MAX_ATTEMPTS = int(os.environ.get('ITEMCATALOG_JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_DELAY = float(os.environ.get('ITEMCATALOG_JOB_RETRY_DELAY', 5))
+
+# Errors a retry may get past, such as a locked db or a full disk. Any other
+# error fails the job at once.
+TRANSIENT_ERRORS = (OperationalError, TimeoutError, EnvironmentError)
+
+# Seconds without a heartbeat before a running job is thought to have lost
+# its worker and is queued again.
+JOB_STALE_AFTER = int(os.environ.get('ITEMCATALOG_JOB_STALE_AFTER', 3600))
+
+# Seconds finished jobs and their files are kept.
+JOB_RESULT_TTL = int(os.environ.get('ITEMCATALOG_JOB_RESULT_TTL', 24 * 3600))
+
+# The most jobs of each kind that may run at once, over all workers.
+JOB_CONCURRENCY = {'export': 2,
+                   'delete_category': 1,
+                   'import_products': 1,
+                   'snapshot': 1}
+
+# The file type of each export format.
+EXPORT_FORMATS = {'json': ('json', 'application/json'),
+                  'ndjson': ('ndjson', 'application/x-ndjson'),
+                  'xml': ('xml', 'application/xml')}
+
+
+# Queue Helper Methods --------------------------------------------------------
+
+
+def JobKey(kind, params):
+    """ Hash a job's kind and arguments, to find earlier runs of it.
+
+    Args:
+        kind: the kind of job.
+        params: the job's arguments, a dict.
+    Returns:
+        key: a hex digest.
+    """
+    return hashlib.sha1(json.dumps([kind, params],
+                                   sort_keys=True)).hexdigest()
+
+
+def EnqueueJob(session, kind, params, user_id=None,
+               max_attempts=JOB_MAX_ATTEMPTS, delay=0):
+    """ Add a job to the queue as part of the current transaction.
+
+    The caller is responsible for committing.
+
+    Args:
+        session: the db session to add the job with.
+        kind: the kind of job, one of JOB_HANDLERS.
+        params: the job's arguments, a dict that can be stored as JSON.
+        user_id: the ID of the user the job belongs to, None for anyone.
+        max_attempts: the times to try the job before giving up.
+        delay: the seconds to wait before running the job.
+    Returns:
+        job: the new Job object.
+    """
+    now = datetime.datetime.utcnow()
+    job = Job(kind=kind,
+              params=json.dumps(params, sort_keys=True),
+              key=JobKey(kind, params),
+              status='queued',
+              attempts=0,
+              max_attempts=max_attempts,
+              progress=0,
+              created=now,
+              run_after=now + datetime.timedelta(seconds=delay),
+              user_id=user_id)
+    session.add(job)
+    session.flush()
+    return job
+
+
+def DebounceJob(session, kind, params, delay):
+    """ Queue a job to run after a delay, unless it is queued already.
+
+    However often it is called, the job then runs once, delay seconds after
+    the first call. The caller is responsible for committing.
+
+    Args:
+        session: the db session to add the job with.
+        kind: the kind of job, one of JOB_HANDLERS.
+        params: the job's arguments.
+        delay: the seconds to wait before running the job.
+    Returns:
+        job: the queued Job object.
+    """
+    job = session.query(Job).\
+        filter(Job.key == JobKey(kind, params), Job.status == 'queued').\
+        first()
+    if job is None:
+        job = EnqueueJob(session, kind, params, delay=delay)
+    return job
+
+
+def FindJob(session, kind, params):
+    """ Find the latest run of a job.
+
+    Args:
+        session: the db session to read with.
+        kind: the kind of job.
+        params: the job's arguments.
+    Returns:
+        job: the latest Job with the same kind and arguments, None if there
+             is none.
+    """
+    return session.query(Job).\
+        filter(Job.key == JobKey(kind, params)).\
+        order_by(Job.id.desc()).first()
+
+
+def ClaimJob(session, worker_id):
+    """ Take the oldest due job whose kind has a free slot.
+
+    A job is claimed with a single UPDATE that also checks the running
+    count of its kind, so workers in different processes can't both take
+    it or run more jobs of a kind than JOB_CONCURRENCY allows.
+
+    Args:
+        session: the db session to claim with.
+        worker_id: a name for the worker.
+    Returns:
+        job: the claimed Job, None if nothing can run now.
+    """
+    now = datetime.datetime.utcnow()
+    candidates = session.query(Job.id, Job.kind).\
+        filter(Job.status == 'queued', Job.run_after <= now).\
+        order_by(Job.id).limit(20).all()
+    for job_id, kind in candidates:
+        running = select([func.count(Job.id)]).\
+            where(and_(Job.kind == kind, Job.status == 'running')).\
+            as_scalar()
+        result = session.execute(
+            Job.__table__.update().
+            where(and_(Job.id == job_id,
+                       Job.status == 'queued',
+                       running < JOB_CONCURRENCY.get(kind, 1))).
+            values(status='running',
+                   attempts=Job.attempts + 1,
+                   started=now,
+                   heartbeat=now,
+                   locked_by=worker_id))
+        session.commit()
+        if result.rowcount:
+            return session.query(Job).get(job_id)
+    # Ends the read transaction, so its connection goes back to the pool.
+    session.rollback()
+    return None
+
+
+def RetryDelay(attempts):
+    """ Get the seconds to wait before a job's next attempt.
+
+    Args:
+        attempts: the attempts made so far.
+    Returns:
+        delay: the seconds to wait.
+    """
+    return JOB_RETRY_DELAY * 2 ** max(attempts - 1, 0)
+
+
+def RunJob(session, read_session, job):
+    """ Run a claimed job, and record how it went.
+
+    A job that raises one of TRANSIENT_ERRORS is queued again after a
+    growing delay, until it has used up its attempts. Any other error fails
+    it straight away, as it would only fail the same way again.
+
+    Args:
+        session: the db session the job was claimed with, which the job
+                 writes with.
+        read_session: a db session for reads that take a long time, such as
+                      exports, so that they don't hold the writer.
+        job: the claimed Job.
+    """
+    job_id = job.id
+
+    def Progress(done, total=None):
+        values = {'progress': done,
+                  'heartbeat': datetime.datetime.utcnow()}
+        if total is not None:
+            values['total'] = total
+        session.query(Job).filter_by(id=job_id).\
+            update(values, synchronize_session=False)
+        session.commit()
+
+    try:
+        result_path = JOB_HANDLERS[job.kind](session, read_session, job,
+                                             json.loads(job.params),
+                                             Progress)
+    except Exception as e:
+        session.rollback()
+        read_session.rollback()
+        job = session.query(Job).get(job_id)
+        job.error = '%s: %s' % (type(e).__name__, e)
+        job.locked_by = None
+        if isinstance(e, TRANSIENT_ERRORS) and \
+                job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_after = datetime.datetime.utcnow() + \
+                datetime.timedelta(seconds=RetryDelay(job.attempts))
+        else:
+            job.status = 'failed'
+            job.finished = datetime.datetime.utcnow()
+        session.commit()
+        return
+
+    read_session.rollback()
+    job = session.query(Job).get(job_id)
+    job.status = 'done'
+    job.error = None
+    job.result_path = result_path
+    job.locked_by = None
+    job.finished = datetime.datetime.utcnow()
+    session.commit()
+
+
+def RequeueStaleJobs(session):
+    """ Queue running jobs again whose worker stopped sending heartbeats.
+
+    Returns:
+        count: the number of jobs queued again.
+    """
+    cutoff = datetime.datetime.utcnow() - \
+        datetime.timedelta(seconds=JOB_STALE_AFTER)
+    count = session.query(Job).\
+        filter(Job.status == 'running', Job.heartbeat < cutoff).\
+        update({Job.status: 'queued', Job.locked_by: None},
+               synchronize_session=False)
+    session.commit()
+    return count
+
+
+def PruneJobs(session, ttl=JOB_RESULT_TTL):
+    """ Delete finished jobs, and their files, after ttl seconds.
+
+    Returns:
+        count: the number of jobs deleted.
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+    old = session.query(Job).\
+        filter(Job.status.in_(['done', 'failed']), Job.finished < cutoff).\
+        all()
+    for job in old:
+        if job.result_path:
+            try:
+                os.remove(job.result_path)
+            except OSError:
+                pass
+        session.delete(job)
+    session.commit()
+    return len(old)
+
+
+# Job Handler Methods ---------------------------------------------------------
+
+
+def JobPath(job, extension):
+    """ Get the path of a job's result file.
+
+    Args:
+        job: the Job.
+        extension: the file extension.
+    Returns:
+        path: a path in JOB_DIR.
+    """
+    if not os.path.isdir(JOB_DIR):
+        os.makedirs(JOB_DIR)
+    return os.path.join(JOB_DIR, 'job-%d.%s' % (job.id, extension))
+
+
+def WriteFile(path, chunks):
+    """ Write text chunks to a file, atomically.
+
+    The chunks go to a temporary file that is renamed into place once it is
+    complete, so a download never sees half a file.
+
+    Args:
+        path: where the file goes.
+        chunks: an iterable of strings.
+    """
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk.encode('utf-8') if isinstance(chunk, unicode)
+                        else chunk)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def CountRows(rows, progress, every=EXPORT_BATCH_SIZE):
+    """ Pass rows through, reporting how many there were every so often. """
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if count % every == 0:
+            progress(count)
+    progress(count)
+
+
+def RunExport(session, read_session, job, params, progress):
+    """ Export the products to a file.
+
+    params holds the format ('json', 'ndjson' or 'xml') and the filters
+    that select and sort the products, a ProductFilters tuple as a dict.
+    The products are read with read_session, while progress is written
+    with session.
+
+    Returns:
+        path: the exported file.
+    """
+    extension, mimetype = EXPORT_FORMATS[params['format']]
+    filters = ProductFilters(**params['filters'])
+    rows = CountRows(GetProductRows(read_session, filters), progress)
+    if params['format'] == 'json':
+        chunks = StreamJSON('Product', PRODUCT_FIELDS, rows)
+    elif params['format'] == 'ndjson':
+        chunks = StreamNDJSON(PRODUCT_FIELDS, rows)
+    else:
+        chunks = StreamXML('catalog', 'product', PRODUCT_FIELDS, rows)
+    path = JobPath(job, extension)
+    WriteFile(path, chunks)
+    return path
+
+
+def RunDeleteCategory(session, read_session, job, params, progress):
+    """ Delete a category and its products.
+
+    params holds the category_id.
+    """
+    category_id = params['category_id']
+    progress(0, CountProducts(session, category_id))
+    DeleteCategory(session, category_id, progress=progress)
+    DebounceJob(session, 'snapshot', {}, SNAPSHOT_DELAY)
+    return None
+
+
+def RunImportProducts(session, read_session, job, params, progress):
+    """ Import products from an uploaded file.
+
+    params holds the path of the upload and its format. The upload is
+    deleted once it has been imported.
+
+    Returns:
+        path: a JSON file with the number of products imported and the
+              records that were skipped.
+    """
+    with open(params['path'], 'rb') as stream:
+        result = ImportProducts(session,
+                                READERS[params['format']](stream),
+                                job.user_id)
+    path = JobPath(job, 'json')
+    WriteFile(path, [json.dumps({'imported': result.imported,
+                                 'errors': [{'line': error.line,
+                                             'error': error.message}
+                                            for error in result.errors]})])
+    progress(result.imported)
+    os.remove(params['path'])
+    if result.imported:
+        DebounceJob(session, 'snapshot', {}, SNAPSHOT_DELAY)
+    return path
+
+
+def RunBuildSnapshot(session, read_session, job, params, progress):
+    """ Build the export snapshot of the current catalog version. """
+    BuildSnapshot(read_session, progress=progress)
+    return None
+
+
+JOB_HANDLERS = {'export': RunExport,
+                'delete_category': RunDeleteCategory,
+                'import_products': RunImportProducts,
+                'snapshot': RunBuildSnapshot}
+
+
+# Worker Methods --------------------------------------------------------------
+
+
+class JobWorker(object):
+    """ Runs queued jobs on a number of threads until stopped.
+
+    Each thread claims and runs one job at a time with its own db sessions.
+    One of them also queues stale jobs again and prunes old ones.
+    """
+
+    # Seconds between checks for stale and old jobs.
+    MAINTENANCE_INTERVAL = 60
+
+    def __init__(self, session_factory, read_session_factory=None,
+                 threads=1, poll_interval=JOB_POLL_INTERVAL):
+        """ Create a worker.
+
+        Args:
+            session_factory: creates the db sessions jobs write with.
+            read_session_factory: creates the db sessions exports read with,
+                                  session_factory if not given.
+            threads: the number of jobs to run at once.
+            poll_interval: seconds to sleep when there is no job to run.
+        """
+        self.session_factory = session_factory
+        self.read_session_factory = read_session_factory or session_factory
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.name = '%s:%d' % (socket.gethostname(), os.getpid())
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """ Start the worker threads in the background. """
+        for number in xrange(self.threads):
+            thread = threading.Thread(target=self.run, args=(number,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """ Ask the threads to stop once their current job is done. """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def run(self, number=0, once=False):
+        """ Claim and run jobs until stopped.
+
+        Args:
+            number: the thread's number, 0 also does the maintenance.
+            once: if True return when there is no job left to run.
+        """
+        worker_id = '%s:%d' % (self.name, number)
+        session = self.session_factory()
+        read_session = self.read_session_factory()
+        last_maintenance = 0
+        try:
+            while not self._stop.is_set():
+                if number == 0 and (default_timer() - last_maintenance >
+                                    self.MAINTENANCE_INTERVAL):
+                    RequeueStaleJobs(session)
+                    PruneJobs(session)
+                    last_maintenance = default_timer()
+
+                job = ClaimJob(session, worker_id)
+                if job is not None:
+                    RunJob(session, read_session, job)
+                # Hand the connections back to the pool between jobs.
+                session.close()
+                read_session.close()
+                if job is None:
+                    if once:
+                        return
+                    self._stop.wait(self.poll_interval)
+        finally:
+            session.close()
+            read_session.close()
+
+
+# -----------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run queued item catalog jobs.')
+    parser.add_argument('--threads', type=int, default=2,
+                        help='the number of jobs to run at once in this '
+                             'process')
+    parser.add_argument('--once', action='store_true',
+                        help='run the queued jobs that are due, then exit')
+    args = parser.parse_args()
+
+    worker = JobWorker(sessionmaker(bind=CreateEngine()),
+                       threads=args.threads)
+    if args.once:
+        worker.run(once=True)
+        sys.exit(0)
+
+    print 'Running jobs on %d threads as %s.' % (args.threads, worker.name)
+    worker.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print 'Stopping once the running jobs are done.'
+        worker.stop()
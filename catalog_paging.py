@@ -0,0 +1,157 @@
+from collections import namedtuple
+import base64
+import json
+import math
+
+from sqlalchemy import and_, or_
+
+
+# Page sizes for the HTML listings.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Page sizes for the JSON and XML endpoints.
+DEFAULT_API_PAGE_SIZE = 1000
+MAX_API_PAGE_SIZE = 10000
+
+
+# The types a sort column value may have in a cursor. Anything else, such as
+# a list or an object, can't be bound to the SQL filter.
+CURSOR_VALUE_TYPES = (int, long, float, unicode, type(None))
+
+# A page of rows and the cursor of the page after it, None on the last page.
+Page = namedtuple('Page', ['rows', 'next_cursor'])
+
+
+def EncodeCursor(values):
+    """ Encode the sort key of the last row on a page as an opaque cursor.
+
+    Args:
+        values: a list of the row's values for each sort column.
+    Returns:
+        cursor: a URL safe string.
+    """
+    encoded = base64.urlsafe_b64encode(json.dumps(values).encode('utf-8'))
+    return encoded.decode('ascii').rstrip('=')
+
+
+def DecodeCursor(cursor, size):
+    """ Decode a cursor made by EncodeCursor.
+
+    Args:
+        cursor: the cursor from the query string.
+        size: the number of sort columns the cursor must hold values for.
+    Returns:
+        values: the list of sort column values.
+    Raises:
+        ValueError: if the cursor is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(
+            base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (TypeError, UnicodeError, ValueError):
+        raise ValueError('Invalid cursor.')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor.')
+    for value in values:
+        if (isinstance(value, bool) or
+                not isinstance(value, CURSOR_VALUE_TYPES) or
+                (isinstance(value, float) and
+                 (math.isnan(value) or math.isinf(value)))):
+            raise ValueError('Invalid cursor.')
+    return values
+
+
+def ParsePageArgs(args, default, maximum):
+    """ Read the page size and cursor from a request's query string.
+
+    Args:
+        args: the request's query string arguments.
+        default: the page size to use when limit is not given.
+        maximum: the largest page size a client may ask for.
+    Returns:
+        limit: the page size, between 1 and maximum.
+        after: the cursor of the page to get, None for the first page.
+    Raises:
+        ValueError: if limit is not a number.
+    """
+    limit = args.get('limit')
+    if limit is None or limit == '':
+        limit = default
+    else:
+        limit = int(limit)
+    limit = max(1, min(limit, maximum))
+    return limit, args.get('after') or None
+
+
+def KeysetFilter(order, values):
+    """ Build the filter that selects the rows after a sort key.
+
+    For a sort on (a, b) this is a >= x AND (a > x OR b > y), which lets the
+    db seek straight to x through an index on a.
+
+    Args:
+        order: a list of (column, descending) tuples. The last column must
+               be unique, e.g. the primary key.
+        values: the sort key of the last row on the previous page.
+    Returns:
+        A SQLAlchemy filter expression.
+    """
+    column, descending = order[0]
+    value = values[0]
+    if len(order) == 1:
+        return column < value if descending else column > value
+    rest = KeysetFilter(order[1:], values[1:])
+    if descending:
+        return and_(column <= value, or_(column < value, rest))
+    return and_(column >= value, or_(column > value, rest))
+
+
+def PageQuery(query, order, after, limit):
+    """ Build the query for one page of a query using keyset pagination.
+
+    The query fetches one row more than limit, to find out if there is a
+    next page.
+
+    Args:
+        query: the query to page through, without an order_by.
+        order: a list of (column, descending) tuples to sort by. The last
+               column must be unique, e.g. the primary key.
+        after: the cursor of the page to get, None for the first page.
+        limit: the number of rows per page.
+    Returns:
+        query: the page's query.
+    Raises:
+        ValueError: if the cursor is malformed.
+    """
+    if after is not None:
+        query = query.filter(KeysetFilter(order, DecodeCursor(after,
+                                                              len(order))))
+    query = query.order_by(*[column.desc() if descending else column
+                             for column, descending in order])
+    return query.limit(limit + 1)
+
+
+def GetPage(query, order, after, limit):
+    """ Get one page of a query using keyset pagination.
+
+    Args:
+        query: the query to page through, without an order_by.
+        order: a list of (column, descending) tuples to sort by. The last
+               column must be unique, e.g. the primary key.
+        after: the cursor of the page to get, None for the first page.
+        limit: the number of rows per page.
+    Returns:
+        page: a Page tuple.
+    Raises:
+        ValueError: if the cursor is malformed.
+    """
+    rows = PageQuery(query, order, after, limit).all()
+    if len(rows) <= limit:
+        return Page(rows, None)
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return Page(rows, EncodeCursor([getattr(last, column.key)
+                                    for column, descending in order]))
@@ -0,0 +1,111 @@
+from sqlalchemy.orm import joinedload
+
+from database_schema import Category, Product, User
+from catalog_filters import ApplyProductFilters, GetProductOrder
+from catalog_filters import PRODUCT_SORTS
+
+
+# The queries behind the page helpers in item_catalog.py. They are built
+# here, unexecuted, so that database_migrate.py --check explains the very
+# statements the app runs.
+
+
+def CategoryListQuery(session):
+    """ Get a query for the sorted category list.
+
+    Args:
+        session: the db session to query with.
+    Returns:
+        query: a query of (id, name, user_id) tuples sorted by name.
+    """
+    return session.query(Category.id, Category.name, Category.user_id).\
+        order_by(Category.name)
+
+
+def CategoryQuery(session, category_id):
+    """ Get a query for a single category.
+
+    Args:
+        session: the db session to query with.
+        category_id: the ID of the category.
+    Returns:
+        query: a query of the Category object.
+    """
+    return session.query(Category).filter_by(id=category_id)
+
+
+def ProductListQuery(session, category_id, filters=None):
+    """ Get a query for the products in a category, and its sort order.
+
+    Args:
+        session: the db session to query with.
+        category_id: the ID of the category.
+        filters: a ProductFilters tuple to filter and sort by, None for all
+                 products sorted by name.
+    Returns:
+        query: a query of Product objects, without an order_by.
+        order: a list of (column, descending) tuples to page it by.
+    """
+    products = session.query(Product).\
+        options(joinedload(Product.user)).\
+        filter_by(category_id=category_id)
+    if filters is None:
+        return products, PRODUCT_SORTS['name']
+    # The listing is of a single category, whatever the filters say.
+    products = ApplyProductFilters(products,
+                                   filters._replace(category_ids=[]))
+    return products, GetProductOrder(filters)
+
+
+def LatestProductsQuery(session, count=5):
+    """ Get a query for the most recently added products.
+
+    Args:
+        session: the db session to query with.
+        count: the number of products.
+    Returns:
+        query: a query of Product objects, newest first.
+    """
+    return session.query(Product).\
+        options(joinedload(Product.category)).\
+        order_by(Product.id.desc()).limit(count)
+
+
+def ProductQuery(session, product_id):
+    """ Get a query for a single product with its category and owner.
+
+    Args:
+        session: the db session to query with.
+        product_id: the ID of the product.
+    Returns:
+        query: a query of the Product object.
+    """
+    return session.query(Product).\
+        options(joinedload(Product.category), joinedload(Product.user)).\
+        filter_by(id=product_id)
+
+
+def UserByEmailQuery(session, email, provider):
+    """ Get a query for the user who logged in with an email and provider.
+
+    Args:
+        session: the db session to query with.
+        email: the user's email.
+        provider: 'google' or 'facebook'.
+    Returns:
+        query: a query of the User object.
+    """
+    return session.query(User).filter_by(email=email, provider=provider)
+
+
+def UserProfileQuery(session, user_id):
+    """ Get a query for the parts of a user shown on pages.
+
+    Args:
+        session: the db session to query with.
+        user_id: the ID of the user.
+    Returns:
+        query: a query of an (id, name, picture) tuple.
+    """
+    return session.query(User.id, User.name, User.picture).\
+        filter_by(id=user_id)
@@ -0,0 +1,86 @@
+import re
+
+from sqlalchemy import text
+
+from database_schema import PRODUCT_SEARCH_DDL
+
+
+# Page sizes for search results.
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# The product columns returned with each search result.
+SEARCH_FIELDS = ('id', 'name', 'description', 'price', 'category_id')
+
+
+def BuildMatchQuery(terms):
+    """ Turn what a user typed into an FTS5 MATCH query.
+
+    Every word must match the start of a word in the name or description,
+    so 'gog' finds 'Goggles'. Words are quoted, so FTS5 operators typed by
+    the user are searched for instead of being interpreted.
+
+    Args:
+        terms: the text the user searched for.
+    Returns:
+        match: the MATCH query, None if there is nothing to search for.
+    """
+    words = re.findall(r'\w+', terms or '', re.UNICODE)
+    if not words:
+        return None
+    return ' '.join('"%s"*' % word for word in words)
+
+
+def SearchProducts(session, terms, category_id=None,
+                   limit=DEFAULT_SEARCH_LIMIT, offset=0):
+    """ Search product names and descriptions, best matches first.
+
+    Args:
+        session: the db session to query with.
+        terms: the text the user searched for.
+        category_id: if given, only products in this category are returned.
+        limit: the number of results to return.
+        offset: the number of results to skip.
+    Returns:
+        rows: a list of tuples in the order of SEARCH_FIELDS.
+    """
+    match = BuildMatchQuery(terms)
+    if match is None:
+        return []
+
+    sql = ('SELECT product.id, product.name, product.description, '
+           'product.price, product.category_id '
+           'FROM product_search '
+           'JOIN product ON product.id = product_search.rowid '
+           'WHERE product_search MATCH :match ')
+    params = {'match': match, 'limit': limit, 'offset': offset}
+    if category_id is not None:
+        sql += 'AND product.category_id = :category_id '
+        params['category_id'] = category_id
+    sql += 'ORDER BY product_search.rank LIMIT :limit OFFSET :offset'
+    return session.execute(text(sql), params).fetchall()
+
+
+def CreateSearchIndex(engine):
+    """ Create the full-text index and its triggers if they are missing.
+
+    Args:
+        engine: the engine of the db.
+    Returns:
+        True if the index did not exist before and needs to be rebuilt.
+    """
+    exists = engine.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE name = 'product_search'")).first()
+    for statement in PRODUCT_SEARCH_DDL:
+        engine.execute(text(statement))
+    return exists is None
+
+
+def RebuildSearchIndex(engine):
+    """ Rebuild the full-text index from the product table.
+
+    Args:
+        engine: the engine of the db.
+    """
+    engine.execute(text(
+        "INSERT INTO product_search(product_search) VALUES ('rebuild')"))
@@ -0,0 +1,196 @@
+""" Precompressed snapshot files of the public export endpoints.
+
+Usage:
+    python catalog_snapshots.py    build the snapshot of the current catalog
+
+A snapshot holds the full category and product exports of one catalog
+version, each written plain, gzipped and, if the brotli module is
+installed, brotli compressed. The export endpoints serve the snapshot of
+the current version as a file, and generate the export live only while the
+snapshot is being rebuilt.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from sqlalchemy.orm import sessionmaker
+
+from database_engine import CreateEngine
+from database_schema import Category
+from catalog_export import GetProductRows, PRODUCT_FIELDS
+from catalog_export import StreamJSON, StreamNDJSON, StreamXML
+from catalog_version import GetVersion, CATALOG_VERSION
+from compression import WriteCompressedFiles
+
+
+# Where snapshots are kept, in a directory per catalog version.
+SNAPSHOT_DIR = os.environ.get('ITEMCATALOG_SNAPSHOT_DIR',
+                              os.path.join(tempfile.gettempdir(),
+                                           'itemcatalog-snapshots'))
+
+# Seconds a rebuild waits after the first change, so that a burst of
+# changes is snapshotted once.
+SNAPSHOT_DELAY = float(os.environ.get('ITEMCATALOG_SNAPSHOT_DELAY', 10))
+
+# The number of versions kept, so a download that started before a rebuild
+# can still finish.
+SNAPSHOT_KEEP = 2
+
+# Compression levels. Brotli's highest levels are too slow for a large
+# catalog.
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+# The files of a snapshot and their mimetypes.
+SNAPSHOT_FILES = {'categories.json': 'application/json',
+                  'categories.xml': 'application/xml',
+                  'products.json': 'application/json',
+                  'products.ndjson': 'application/x-ndjson',
+                  'products.xml': 'application/xml'}
+
+# The compressed copies of each file, by content coding, best first.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+# Snapshot Helper Methods -----------------------------------------------------
+
+
+def SnapshotChunks(session, name):
+    """ Generate the contents of a snapshot file.
+
+    The files match what the export endpoints return without arguments.
+
+    Args:
+        session: the db session to read with.
+        name: one of SNAPSHOT_FILES.
+    Returns:
+        chunks: an iterable of strings.
+    """
+    if name.startswith('categories.'):
+        rows = session.query(Category.id, Category.name).\
+            order_by(Category.name)
+        if name == 'categories.json':
+            return StreamJSON('Category', ('id', 'name'), rows)
+        return StreamXML('catalog', 'category', ('id', 'name'), rows)
+
+    rows = GetProductRows(session)
+    if name == 'products.json':
+        return StreamJSON('Product', PRODUCT_FIELDS, rows)
+    elif name == 'products.ndjson':
+        return StreamNDJSON(PRODUCT_FIELDS, rows)
+    return StreamXML('catalog', 'product', PRODUCT_FIELDS, rows)
+
+
+def SnapshotPath(version, snapshot_dir=SNAPSHOT_DIR):
+    """ Get the directory of a version's snapshot.
+
+    Args:
+        version: the catalog change version.
+        snapshot_dir: where snapshots are kept.
+    Returns:
+        path: the snapshot's directory.
+    """
+    return os.path.join(snapshot_dir, '%d' % version)
+
+
+def FindSnapshot(version, name, accept_encodings,
+                 snapshot_dir=SNAPSHOT_DIR):
+    """ Find the best copy of a snapshot file a client accepts.
+
+    Args:
+        version: the current catalog change version.
+        name: one of SNAPSHOT_FILES.
+        accept_encodings: the request's parsed Accept-Encoding header.
+        snapshot_dir: where snapshots are kept.
+    Returns:
+        path: the file to send, None if there is no snapshot of version.
+        encoding: the file's content coding, None if it is plain.
+    """
+    path = os.path.join(SnapshotPath(version, snapshot_dir), name)
+    if not os.path.exists(path):
+        return None, None
+    for encoding, suffix in ENCODINGS:
+        if encoding in accept_encodings and os.path.exists(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+def BuildSnapshot(session, snapshot_dir=SNAPSHOT_DIR, progress=None):
+    """ Write the snapshot of the current catalog version, if it is missing.
+
+    The files are written to a temporary directory that is renamed into
+    place once all of them are complete. The version is read before the
+    rows, so if the catalog changes during the build the snapshot may hold
+    newer rows than its version, but it is never served: by then the
+    current version is a newer one.
+
+    Args:
+        session: the db session to read with.
+        snapshot_dir: where snapshots are kept.
+        progress: called with the number of files written and the total.
+    Returns:
+        version: the catalog version of the snapshot.
+    """
+    version = GetVersion(session, CATALOG_VERSION)
+    path = SnapshotPath(version, snapshot_dir)
+    if os.path.isdir(path):
+        return version
+
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir)
+    build_dir = tempfile.mkdtemp(prefix='.build-', dir=snapshot_dir)
+    try:
+        for count, name in enumerate(sorted(SNAPSHOT_FILES), 1):
+            WriteCompressedFiles(os.path.join(build_dir, name),
+                                 SnapshotChunks(session, name),
+                                 GZIP_LEVEL, BROTLI_QUALITY)
+            if progress is not None:
+                progress(count, len(SNAPSHOT_FILES))
+        os.rename(build_dir, path)
+    except OSError:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        # Another process finished the same snapshot first.
+        if not os.path.isdir(path):
+            raise
+    except:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+    PruneSnapshots(snapshot_dir)
+    return version
+
+
+def PruneSnapshots(snapshot_dir=SNAPSHOT_DIR, keep=SNAPSHOT_KEEP):
+    """ Delete all but the newest snapshots.
+
+    Args:
+        snapshot_dir: where snapshots are kept.
+        keep: the number of snapshots to keep.
+    Returns:
+        count: the number of snapshots deleted.
+    """
+    versions = sorted((int(name) for name in os.listdir(snapshot_dir)
+                       if name.isdigit()), reverse=True)
+    for version in versions[keep:]:
+        shutil.rmtree(SnapshotPath(version, snapshot_dir),
+                      ignore_errors=True)
+    return len(versions[keep:])
+
+
+# -----------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build the export snapshot of the current catalog.')
+    parser.add_argument('--dir', default=SNAPSHOT_DIR,
+                        help='where snapshots are kept')
+    args = parser.parse_args()
+
+    session = sessionmaker(bind=CreateEngine())()
+    version = BuildSnapshot(session, args.dir)
+    print 'Snapshot of catalog version %d is in %s.' % (
+        version, SnapshotPath(version, args.dir))
+    sys.exit(0)
@@ -0,0 +1,212 @@
+import math
+
+from sqlalchemy import text, func
+
+from database_schema import CategoryStats, Product
+
+
+def ParsePrice(value):
+    """ Turn a submitted price into a number.
+
+    Args:
+        value: the price as submitted, or None.
+    Returns:
+        price: the price as a float, None if it is empty.
+    Raises:
+        ValueError: if the price is not a finite number.
+    """
+    if value is None or ('%s' % (value,)).strip() == '':
+        return None
+    price = float(value)
+    # float() also accepts 'nan' and 'inf', which no price can be.
+    if math.isnan(price) or math.isinf(price):
+        raise ValueError('Invalid price %s.' % value)
+    return price
+
+
+def ParseProductPrice(value):
+    """ Turn the price of a product being added or edited into a number.
+
+    Unlike a price to filter by, a product's price can't be negative.
+
+    Args:
+        value: the price as submitted, or None.
+    Returns:
+        price: the price as a float, None if it is empty.
+    Raises:
+        ValueError: if the price is not a finite number or is negative. Its
+                    message says which, for the user.
+    """
+    try:
+        price = ParsePrice(value)
+    except (TypeError, ValueError):
+        raise ValueError('Price is not a number.')
+    if price is not None and price < 0:
+        raise ValueError('Price is negative.')
+    return price
+
+
+def EnsureCategoryStats(session, category_id):
+    """ Create the empty stats row of a category if it is missing.
+
+    Args:
+        session: the db session holding the pending change.
+        category_id: the ID of the category.
+    """
+    session.execute(CategoryStats.__table__.insert().prefix_with('OR IGNORE'),
+                    {'category_id': category_id,
+                     'product_count': 0,
+                     'priced_count': 0,
+                     'price_sum': 0})
+
+
+def ProductsAdded(session, category_id, prices):
+    """ Add products to their category's stats.
+
+    Args:
+        session: the db session holding the pending change.
+        category_id: the ID of the category the products were added to.
+        prices: a list of the new products' prices, None for no price.
+    """
+    priced = [price for price in prices if price is not None]
+    EnsureCategoryStats(session, category_id)
+    session.execute(text(
+        'UPDATE category_stats SET '
+        'product_count = product_count + :count, '
+        'priced_count = priced_count + :priced_count, '
+        'price_sum = price_sum + :price_sum, '
+        'price_min = CASE WHEN price_min IS NULL OR :price_min < price_min '
+        'THEN :price_min ELSE price_min END, '
+        'price_max = CASE WHEN price_max IS NULL OR :price_max > price_max '
+        'THEN :price_max ELSE price_max END '
+        'WHERE category_id = :category_id'),
+        {'count': len(prices),
+         'priced_count': len(priced),
+         'price_sum': sum(priced),
+         'price_min': min(priced) if priced else None,
+         'price_max': max(priced) if priced else None,
+         'category_id': category_id})
+
+
+def ProductRemoved(session, category_id, price):
+    """ Take a product out of its category's stats.
+
+    Call after the product has been deleted in the session. Removing the
+    cheapest or dearest product looks up the new one through the
+    (category_id, price) index.
+
+    Args:
+        session: the db session holding the pending change.
+        category_id: the ID of the category the product was in.
+        price: the product's price, None for no price.
+    """
+    EnsureCategoryStats(session, category_id)
+    priced = 0 if price is None else 1
+    session.execute(text(
+        'UPDATE category_stats SET '
+        'product_count = product_count - 1, '
+        'priced_count = priced_count - :priced, '
+        'price_sum = price_sum - :price '
+        'WHERE category_id = :category_id'),
+        {'priced': priced,
+         'price': price or 0,
+         'category_id': category_id})
+
+    stats = session.query(CategoryStats.price_min, CategoryStats.price_max).\
+        filter_by(category_id=category_id).one()
+    if price is not None and price in (stats.price_min, stats.price_max):
+        session.flush()
+        prices = session.query(Product.price).\
+            filter(Product.category_id == category_id,
+                   Product.price != None)
+        session.query(CategoryStats).\
+            filter_by(category_id=category_id).\
+            update({CategoryStats.price_min:
+                    prices.order_by(Product.price).limit(1).as_scalar(),
+                    CategoryStats.price_max:
+                    prices.order_by(Product.price.desc()).limit(1).
+                    as_scalar()},
+                   synchronize_session=False)
+
+
+def ProductPriceChanged(session, category_id, old_price, new_price):
+    """ Update a category's stats for a product whose price changed.
+
+    Call after the new price has been set in the session.
+
+    Args:
+        session: the db session holding the pending change.
+        category_id: the ID of the product's category.
+        old_price: the product's previous price, None for no price.
+        new_price: the product's new price, None for no price.
+    """
+    if old_price == new_price:
+        return
+    ProductRemoved(session, category_id, old_price)
+    ProductsAdded(session, category_id, [new_price])
+
+
+def CategoryDeleted(session, category_id):
+    """ Drop the stats of a deleted category.
+
+    Args:
+        session: the db session holding the pending change.
+        category_id: the ID of the deleted category.
+    """
+    session.query(CategoryStats).filter_by(category_id=category_id).\
+        delete(synchronize_session=False)
+
+
+def CategoryStatsQuery(session, category_ids=None):
+    """ Get a query for the price aggregates of categories.
+
+    Args:
+        session: the db session to read with.
+        category_ids: the IDs of the categories to get, None for all.
+    Returns:
+        query: a query of CategoryStats objects in category order.
+    """
+    stats = session.query(CategoryStats)
+    if category_ids:
+        stats = stats.filter(CategoryStats.category_id.in_(category_ids))
+    return stats.order_by(CategoryStats.category_id)
+
+
+def GetCategoryStats(session, category_ids=None):
+    """ Get the price aggregates of categories.
+
+    Args:
+        session: the db session to read with.
+        category_ids: the IDs of the categories to get, None for all.
+    Returns:
+        stats: a list of CategoryStats objects.
+    """
+    return CategoryStatsQuery(session, category_ids).all()
+
+
+def RebuildCategoryStats(session):
+    """ Recompute every category's stats from the product table.
+
+    Only needed for dbs created before the stats existed, or after products
+    were changed without going through the helpers above.
+
+    Args:
+        session: the db session to rebuild with. The caller commits.
+    """
+    session.query(CategoryStats).delete(synchronize_session=False)
+    rows = session.query(Product.category_id,
+                         func.count(Product.id),
+                         func.count(Product.price),
+                         func.coalesce(func.sum(Product.price), 0),
+                         func.min(Product.price),
+                         func.max(Product.price)).\
+        filter(Product.category_id != None).\
+        group_by(Product.category_id)
+    values = [{'category_id': row[0],
+               'product_count': row[1],
+               'priced_count': row[2],
+               'price_sum': row[3],
+               'price_min': row[4],
+               'price_max': row[5]} for row in rows]
+    if values:
+        session.execute(CategoryStats.__table__.insert(), values)
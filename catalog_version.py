@@ -0,0 +1,100 @@
+import datetime
+
+from database_schema import Version
+
+
+# Names of the change counters kept in the version table.
+# Bumped when a category is added, renamed or deleted.
+CATEGORIES_VERSION = 'categories'
+
+# Bumped by every change to the catalog.
+CATALOG_VERSION = 'catalog'
+
+
+def CategoryVersionName(category_id):
+    """ Get the name of the counter bumped when a category's products change.
+
+    Args:
+        category_id: the ID of the category.
+    Returns:
+        name: the counter name.
+    """
+    return 'category:%d' % category_id
+
+
+def ProductVersionName(product_id):
+    """ Get the name of the counter bumped when a product changes.
+
+    Args:
+        product_id: the ID of the product.
+    Returns:
+        name: the counter name.
+    """
+    return 'product:%d' % product_id
+
+
+def GetVersion(session, name):
+    """ Get the current value of a change counter.
+
+    Args:
+        session: the db session to read with.
+        name: the name of the change counter.
+    Returns:
+        value: the counter value, 0 if it has never been bumped.
+    """
+    value = session.query(Version.value).filter_by(name=name).scalar()
+    return value or 0
+
+
+def GetVersions(session, names):
+    """ Get the current values of several change counters in one query.
+
+    Args:
+        session: the db session to read with.
+        names: the names of the change counters.
+    Returns:
+        versions: a dict of counter name to value, 0 for counters that have
+                  never been bumped.
+    """
+    versions = dict.fromkeys(names, 0)
+    if versions:
+        versions.update(session.query(Version.name, Version.value).
+                        filter(Version.name.in_(list(versions))))
+    return versions
+
+
+def GetVersionInfo(session, name):
+    """ Get the current value of a change counter and when it last changed.
+
+    Args:
+        session: the db session to read with.
+        name: the name of the change counter.
+    Returns:
+        value: the counter value, 0 if it has never been bumped.
+        modified: the UTC datetime of the last bump, None if it has never
+                  been bumped.
+    """
+    row = session.query(Version.value, Version.modified).\
+        filter_by(name=name).first()
+    if row is None:
+        return 0, None
+    return row.value, row.modified
+
+
+def BumpVersion(session, name):
+    """ Increment a change counter as part of the current transaction.
+
+    The counter row is created on first use. The caller is responsible for
+    committing, so the bump becomes visible together with the change it
+    describes.
+
+    Args:
+        session: the db session that holds the pending change.
+        name: the name of the change counter.
+    """
+    session.execute(Version.__table__.insert().prefix_with('OR IGNORE'),
+                    {'name': name, 'value': 0})
+    session.query(Version).filter_by(name=name).\
+        update({Version.value: Version.value + 1,
+                Version.modified: datetime.datetime.utcnow()},
+               synchronize_session=False)
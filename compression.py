@@ -0,0 +1,215 @@
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    # Responses and files are then only compressed with gzip.
+    brotli = None
+
+from flask import request
+
+
+# Responses smaller than this many bytes are sent as they are, as
+# compressing them saves less than it costs.
+COMPRESS_MIN_SIZE = int(os.environ.get('ITEMCATALOG_COMPRESS_MIN_SIZE', 1024))
+
+# Compression levels for responses, which are compressed on every request,
+# so favour speed over size.
+COMPRESS_GZIP_LEVEL = int(os.environ.get('ITEMCATALOG_COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get(
+    'ITEMCATALOG_COMPRESS_BROTLI_QUALITY', 4))
+
+# Mimetypes worth compressing. Everything else, such as images, is already
+# compressed.
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'text/plain',
+                      'application/json', 'application/x-ndjson',
+                      'application/xml', 'application/javascript',
+                      'image/svg+xml')
+
+
+def ChooseEncoding(accept_encodings):
+    """ Pick the best content coding a client accepts.
+
+    Args:
+        accept_encodings: the request's parsed Accept-Encoding header.
+    Returns:
+        encoding: 'br', 'gzip' or None.
+    """
+    if brotli is not None and 'br' in accept_encodings:
+        return 'br'
+    if 'gzip' in accept_encodings:
+        return 'gzip'
+    return None
+
+
+class StreamCompressor(object):
+    """ Compresses bytes with gzip or brotli, a chunk at a time. """
+
+    def __init__(self, encoding, level):
+        """ Create a compressor.
+
+        Args:
+            encoding: 'br' or 'gzip'.
+            level: the brotli quality or gzip level.
+        """
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            # A window of 16 + MAX_WBITS writes a gzip header and trailer.
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                                16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """ Get everything compressed so far, so the client can use it. """
+        if self.encoding == 'br':
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+# Compressed File Helper Methods ----------------------------------------------
+
+
+def WriteCompressedFiles(path, chunks, gzip_level=9, brotli_quality=9):
+    """ Write a file and its compressed copies in a single pass.
+
+    The gzip copy goes to path + '.gz' and, if the brotli module is
+    installed, the brotli copy to path + '.br'.
+
+    Args:
+        path: where the plain file goes.
+        chunks: an iterable of strings.
+        gzip_level: the gzip compression level.
+        brotli_quality: the brotli quality.
+    """
+    copies = [('gzip', '.gz', gzip_level)]
+    if brotli is not None:
+        copies.append(('br', '.br', brotli_quality))
+
+    files = []
+    try:
+        plain = open(path, 'wb')
+        files.append(plain)
+        compressed = []
+        for encoding, suffix, level in copies:
+            f = open(path + suffix, 'wb')
+            files.append(f)
+            compressed.append((StreamCompressor(encoding, level), f))
+
+        for chunk in chunks:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            plain.write(chunk)
+            for compressor, f in compressed:
+                f.write(compressor.compress(chunk))
+        for compressor, f in compressed:
+            f.write(compressor.finish())
+    finally:
+        for f in files:
+            f.close()
+
+
+# Response Compression Methods ------------------------------------------------
+
+
+class ResponseCompressor(object):
+    """ Compresses responses with the best coding the client accepts.
+
+    Responses smaller than min_size are left alone. Streamed responses are
+    compressed as they stream, each chunk flushed to the client as soon as
+    the route yields it, so they are never buffered whole. Responses that
+    are already encoded, such as export snapshots, and files sent with
+    send_file are left as they are.
+    """
+
+    def __init__(self, app, min_size=COMPRESS_MIN_SIZE,
+                 gzip_level=COMPRESS_GZIP_LEVEL,
+                 brotli_quality=COMPRESS_BROTLI_QUALITY):
+        self.min_size = min_size
+        self.levels = {'gzip': gzip_level, 'br': brotli_quality}
+        app.after_request(self.compress)
+
+    def compress(self, response):
+        if (response.mimetype not in COMPRESSIBLE_TYPES or
+                response.direct_passthrough or
+                'Content-Encoding' in response.headers):
+            return response
+        if response.status_code == 304:
+            return self.not_modified(response)
+        if (response.status_code < 200 or
+                response.status_code in (204, 206)):
+            return response
+
+        # Caches must keep the compressed and plain responses apart, even
+        # for clients that get the plain one.
+        response.vary.add('Accept-Encoding')
+        encoding = ChooseEncoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        compressor = StreamCompressor(encoding, self.levels[encoding])
+        if response.is_streamed:
+            response.response = CompressStream(response.response, compressor)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(compressor.compress(data) +
+                              compressor.finish())
+
+        response.content_encoding = encoding
+        # The compressed body is a different representation, but the same
+        # content, so the ETag only holds for weak comparison.
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def not_modified(self, response):
+        """ Give a 304 the ETag and Vary of the response it stands for.
+
+        A 304 has no body to compress, but it must carry the same ETag as
+        the full response would have, and that is weak when the client
+        accepts a compressed one.
+        """
+        response.vary.add('Accept-Encoding')
+        if ChooseEncoding(request.accept_encodings) is not None:
+            etag, weak = response.get_etag()
+            if etag is not None:
+                response.set_etag(etag, weak=True)
+        return response
+
+
+def CompressStream(chunks, compressor):
+    """ Compress the chunks of a streamed response as they are generated.
+
+    Args:
+        chunks: the response's iterable of strings.
+        compressor: a StreamCompressor.
+    Yields:
+        Compressed chunks.
+    """
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        # Lets stream_with_context release the request context.
+        if hasattr(chunks, 'close'):
+            chunks.close()
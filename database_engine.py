@@ -0,0 +1,198 @@
+from timeit import default_timer
+import os
+
+# To connect to the db engine.
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from metrics import registry
+
+
+# Engine settings. Each one can be overridden from the environment so that
+# the same code can serve the dev server and a multi-threaded deployment.
+DATABASE_URL = os.environ.get('ITEMCATALOG_DATABASE_URL',
+                              'sqlite:///itemcatalog.db')
+
+# The db that read-only requests are served from. Defaults to the main db,
+# which with WAL enabled lets readers run alongside the writer.
+READ_DATABASE_URL = os.environ.get('ITEMCATALOG_READ_DATABASE_URL',
+                                   DATABASE_URL)
+
+# Connections kept open in the pool, and extra connections allowed on top
+# of those under load.
+POOL_SIZE = int(os.environ.get('ITEMCATALOG_POOL_SIZE', 5))
+POOL_MAX_OVERFLOW = int(os.environ.get('ITEMCATALOG_POOL_MAX_OVERFLOW', 10))
+
+# Seconds to wait for a free connection before giving up.
+POOL_TIMEOUT = int(os.environ.get('ITEMCATALOG_POOL_TIMEOUT', 30))
+
+# Seconds after which a pooled connection is closed and reopened.
+POOL_RECYCLE = int(os.environ.get('ITEMCATALOG_POOL_RECYCLE', 3600))
+
+# SQLite pragmas applied to every new connection. WAL lets readers keep
+# reading while a write is in progress, NORMAL sync is safe in WAL mode.
+SQLITE_JOURNAL_MODE = os.environ.get('ITEMCATALOG_SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('ITEMCATALOG_SQLITE_SYNCHRONOUS', 'NORMAL')
+
+# Bytes of the db file to memory map.
+SQLITE_MMAP_SIZE = int(os.environ.get('ITEMCATALOG_SQLITE_MMAP_SIZE',
+                                      256 * 1024 * 1024))
+
+# Page cache size per connection. Negative values are in KiB.
+SQLITE_CACHE_SIZE = int(os.environ.get('ITEMCATALOG_SQLITE_CACHE_SIZE',
+                                       -64 * 1024))
+
+
+registry.declare('itemcatalog_db_pool_checkouts_total', 'counter',
+                 'Connections checked out of the db pool.')
+registry.declare('itemcatalog_db_pool_timeouts_total', 'counter',
+                 'Checkouts that gave up waiting for a free connection.')
+registry.declare('itemcatalog_db_pool_wait_seconds', 'histogram',
+                 'Time spent waiting for a connection from the db pool.')
+
+
+class TimedQueuePool(QueuePool):
+    """ A QueuePool that records checkouts and how long they waited.
+
+    The pool's logging name, 'read' or 'write', labels its metrics.
+    """
+
+    def _do_get(self):
+        labels = (('pool', getattr(self, 'logging_name', None) or 'db'),)
+        start = default_timer()
+        try:
+            connection = QueuePool._do_get(self)
+        except exc.TimeoutError:
+            registry.inc('itemcatalog_db_pool_timeouts_total', labels)
+            raise
+        registry.observe('itemcatalog_db_pool_wait_seconds',
+                         default_timer() - start,
+                         labels)
+        registry.inc('itemcatalog_db_pool_checkouts_total', labels)
+        return connection
+
+
+def IsMemoryDatabase(url):
+    """ Check if a db url points at an in-memory SQLite db.
+
+    Args:
+        url: the db url.
+    Returns:
+        True if every connection would get its own empty db.
+    """
+    return url in ('sqlite://', 'sqlite:///:memory:')
+
+
+def SetSqlitePragmas(dbapi_connection, read_only=False):
+    """ Apply the configured pragmas to a new SQLite connection.
+
+    Args:
+        dbapi_connection: the raw sqlite3 connection.
+        read_only: if True the connection refuses to write.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=%s' % SQLITE_JOURNAL_MODE)
+    cursor.execute('PRAGMA synchronous=%s' % SQLITE_SYNCHRONOUS)
+    cursor.execute('PRAGMA mmap_size=%d' % SQLITE_MMAP_SIZE)
+    cursor.execute('PRAGMA cache_size=%d' % SQLITE_CACHE_SIZE)
+    if read_only:
+        cursor.execute('PRAGMA query_only=ON')
+    cursor.close()
+
+
+def CreateEngine(url=DATABASE_URL,
+                 read_only=False,
+                 pool_size=POOL_SIZE,
+                 max_overflow=POOL_MAX_OVERFLOW,
+                 pool_timeout=POOL_TIMEOUT,
+                 pool_recycle=POOL_RECYCLE):
+    """ Create a db engine with a connection pool shared by all threads.
+
+    Args:
+        url: the db url to connect to.
+        read_only: if True SQLite connections are opened read-only.
+        pool_size: the number of connections kept open.
+        max_overflow: the number of extra connections allowed under load.
+        pool_timeout: seconds to wait for a free connection.
+        pool_recycle: seconds after which a connection is reopened.
+    Returns:
+        engine: a SQLAlchemy engine.
+    """
+    pool_name = 'read' if read_only else 'write'
+    if not url.startswith('sqlite'):
+        return create_engine(url,
+                             poolclass=TimedQueuePool,
+                             pool_size=pool_size,
+                             max_overflow=max_overflow,
+                             pool_timeout=pool_timeout,
+                             pool_recycle=pool_recycle,
+                             pool_logging_name=pool_name)
+
+    # The pool hands each connection to one thread at a time, so SQLite's
+    # own same-thread check only gets in the way.
+    connect_args = {'check_same_thread': False}
+
+    if IsMemoryDatabase(url):
+        # Every new connection would see a different empty db, so all
+        # threads have to share a single one.
+        engine = create_engine(url,
+                               poolclass=StaticPool,
+                               connect_args=connect_args)
+    else:
+        engine = create_engine(url,
+                               poolclass=TimedQueuePool,
+                               pool_size=pool_size,
+                               max_overflow=max_overflow,
+                               pool_timeout=pool_timeout,
+                               pool_recycle=pool_recycle,
+                               pool_logging_name=pool_name,
+                               connect_args=connect_args)
+
+    @event.listens_for(engine, 'connect')
+    def OnConnect(dbapi_connection, connection_record):
+        SetSqlitePragmas(dbapi_connection, read_only)
+
+    return engine
+
+
+def CreateEngines():
+    """ Create the engines for the writer and the readers.
+
+    SQLite only allows one writer at a time, so the write engine holds a
+    single connection and writers queue in the pool instead of failing with
+    "database is locked". Readers get their own pool of read-only
+    connections and never wait on the writer.
+
+    Returns:
+        write_engine: the engine to use for anything that changes the db.
+        read_engine: the engine to use for read-only work.
+    """
+    if IsMemoryDatabase(DATABASE_URL):
+        engine = CreateEngine(DATABASE_URL)
+        return engine, engine
+
+    if DATABASE_URL.startswith('sqlite'):
+        write_engine = CreateEngine(DATABASE_URL, pool_size=1, max_overflow=0)
+    else:
+        write_engine = CreateEngine(DATABASE_URL)
+    read_engine = CreateEngine(READ_DATABASE_URL, read_only=True)
+    return write_engine, read_engine
+
+
+def CreateJobEngine(threads, write_engine):
+    """ Create the engine background job threads write with.
+
+    Jobs get connections of their own, so that a worker waiting for work or
+    running a long job never holds the connection requests write with.
+
+    Args:
+        threads: the number of job threads.
+        write_engine: the requests' write engine, shared for an in-memory
+                      db, where every connection would see a different db.
+    Returns:
+        engine: a SQLAlchemy engine.
+    """
+    if IsMemoryDatabase(DATABASE_URL):
+        return write_engine
+    return CreateEngine(DATABASE_URL, pool_size=max(threads, 1),
+                        max_overflow=0)
@@ -0,0 +1,243 @@
+""" Bring an existing itemcatalog.db up to date with database_schema.py.
+
+Usage:
+    python database_migrate.py          create missing tables, columns and
+                                        indexes
+    python database_migrate.py --check  also report queries that scan tables
+    python database_migrate.py --rebuild-search
+                                        also rebuild the full-text index
+    python database_migrate.py --rebuild-stats
+                                        also recompute the category stats
+"""
+import argparse
+import sys
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from database_engine import CreateEngine
+from database_schema import Base
+from catalog_export import GetProductColumns, ProductRowsQuery
+from catalog_filters import ProductFilters, PRODUCT_SORTS
+from catalog_paging import EncodeCursor, PageQuery
+from catalog_paging import DEFAULT_PAGE_SIZE, DEFAULT_API_PAGE_SIZE
+from catalog_queries import CategoryListQuery, CategoryQuery
+from catalog_queries import ProductListQuery, LatestProductsQuery
+from catalog_queries import ProductQuery, UserByEmailQuery, UserProfileQuery
+from catalog_search import CreateSearchIndex, RebuildSearchIndex
+from catalog_stats import CategoryStatsQuery, RebuildCategoryStats
+
+
+# Migration Helper Methods ----------------------------------------------------
+
+
+def CreateMissingTables(engine):
+    """ Create any table that is declared in the schema but not in the db.
+
+    Args:
+        engine: the engine of the db to migrate.
+    """
+    Base.metadata.create_all(engine)
+
+
+def AddMissingColumns(engine):
+    """ Add any column that is declared in the schema but not in the db.
+
+    Only nullable columns can be added to an existing SQLite table, which is
+    all the schema has needed so far.
+
+    Args:
+        engine: the engine of the db to migrate.
+    Returns:
+        added: a list of "table.column" names that were added.
+    """
+    added = []
+    for table in Base.metadata.sorted_tables:
+        existing = set(row[1] for row in
+                       engine.execute(text('PRAGMA table_info("%s")'
+                                           % table.name)))
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            engine.execute(text('ALTER TABLE "%s" ADD COLUMN "%s" %s' % (
+                table.name,
+                column.name,
+                column.type.compile(dialect=engine.dialect))))
+            added.append('%s.%s' % (table.name, column.name))
+    return added
+
+
+def CreateMissingIndexes(engine):
+    """ Create any index that is declared in the schema but not in the db.
+
+    SQLite cannot add a constraint to an existing table, so unique
+    constraints are declared as unique indexes and created here.
+
+    Args:
+        engine: the engine of the db to migrate.
+    Returns:
+        failed: a list of (index name, error) tuples for indexes that could
+                not be created, e.g. because of duplicate rows.
+    """
+    failed = []
+    for table in Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            statement = 'CREATE %sINDEX IF NOT EXISTS "%s" ON "%s" (%s)' % (
+                'UNIQUE ' if index.unique else '',
+                index.name,
+                table.name,
+                ', '.join('"%s"' % column.name for column in index.columns))
+            try:
+                engine.execute(text(statement))
+            except IntegrityError as e:
+                failed.append((index.name, str(e.orig)))
+    return failed
+
+
+# Query Plan Helper Methods ---------------------------------------------------
+
+
+def GetCheckedQueries(session):
+    """ Get the queries run by the helper methods in item_catalog.py.
+
+    The queries come from the same builders the helpers call, so a change to
+    a helper is checked as soon as it is made. Paged queries are checked for
+    a page after the first, as that is when the keyset filter is applied.
+
+    Each query is paired with the kind of plan it must get:
+     - 'search': it must look rows up through an index.
+     - 'ordered': it reads every row in the order of an index or of the
+       primary key. Only queries with a LIMIT may sort in a temporary
+       b-tree, since they stop after a few rows.
+
+    Args:
+        session: a db session to build the queries with.
+    Returns:
+        queries: a list of (name, kind, query) tuples.
+    """
+    price_filters = ProductFilters(min_price=10, max_price=100,
+                                   category_ids=[], sort='price')
+    products, order = ProductListQuery(session, 1)
+    priced_products, price_order = ProductListQuery(session, 1,
+                                                    price_filters)
+    return [
+        ('GetAllCategories', 'ordered', CategoryListQuery(session)),
+        ('GetSingleCategory', 'search', CategoryQuery(session, 1)),
+        ('GetAllProducts', 'search',
+         PageQuery(products, order, EncodeCursor([u'Cap', 1]),
+                   DEFAULT_PAGE_SIZE)),
+        ('GetAllProducts(sort=price)', 'search',
+         PageQuery(priced_products, price_order, EncodeCursor([10.0, 1]),
+                   DEFAULT_PAGE_SIZE)),
+        ('GetProductRows', 'ordered', ProductRowsQuery(session)),
+        ('GetProductPage', 'search',
+         PageQuery(GetProductColumns(session), PRODUCT_SORTS['id'],
+                   EncodeCursor([1]), DEFAULT_API_PAGE_SIZE)),
+        ('GetLatestProducts', 'ordered', LatestProductsQuery(session)),
+        ('GetSingleProduct', 'search', ProductQuery(session, 1)),
+        ('GetCategoryStats', 'search', CategoryStatsQuery(session, [1])),
+        ('GetUserIDFromEmail', 'search',
+         UserByEmailQuery(session, 'a@b.c', 'google')),
+        ('GetUserInfo', 'search', UserProfileQuery(session, 1)),
+    ]
+
+
+def CheckQueryPlan(engine, kind, query):
+    """ Run EXPLAIN QUERY PLAN for a query.
+
+    Args:
+        engine: the engine of the db to check.
+        kind: the kind of plan the query must get, as in GetCheckedQueries.
+        query: the query to check.
+    Returns:
+        problems: the plan detail of every step that scans a table it should
+                  search, or sorts an unbounded result in a temporary
+                  b-tree. Empty when the query is served by an index.
+    """
+    sql = str(query.statement.compile(
+        dialect=engine.dialect,
+        compile_kwargs={'literal_binds': True}))
+    limited = ' LIMIT ' in sql
+    problems = []
+    for row in engine.execute(text('EXPLAIN QUERY PLAN ' + sql)):
+        detail = row[-1]
+        words = detail.split()
+        if 'TEMP B-TREE' in detail:
+            if not limited:
+                problems.append(detail)
+        elif words[0] == 'SCAN':
+            # Older SQLite versions print "SCAN TABLE <name>".
+            table = words[2] if words[1] == 'TABLE' else words[1]
+            if table not in Base.metadata.tables:
+                continue
+            # A scan of an ordered query reads the rows it needs anyway, the
+            # sort that may come with it is caught above.
+            if kind == 'search':
+                problems.append(detail)
+    return problems
+
+
+def CheckQueryPlans(engine):
+    """ Run EXPLAIN QUERY PLAN for every helper query.
+
+    Args:
+        engine: the engine of the db to check.
+    Returns:
+        problems: a list of (name, plan detail) tuples, as CheckQueryPlan
+                  reports them. Empty when every query is served by an
+                  index.
+    """
+    session = sessionmaker(bind=engine)()
+    problems = []
+    for name, kind, query in GetCheckedQueries(session):
+        problems.extend((name, detail)
+                        for detail in CheckQueryPlan(engine, kind, query))
+    session.close()
+    return problems
+
+
+# -----------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Bring the item catalog db up to date.')
+    parser.add_argument('--check', action='store_true',
+                        help='report helper queries that scan tables')
+    parser.add_argument('--rebuild-search', action='store_true',
+                        help='rebuild the full-text product index')
+    parser.add_argument('--rebuild-stats', action='store_true',
+                        help='recompute the price aggregates of every '
+                             'category')
+    args = parser.parse_args()
+
+    engine = CreateEngine()
+    had_stats = engine.has_table('category_stats')
+    CreateMissingTables(engine)
+    for column_name in AddMissingColumns(engine):
+        print 'Added column %s' % column_name
+    failed = CreateMissingIndexes(engine)
+    for index_name, error in failed:
+        print 'Could not create index %s: %s' % (index_name, error)
+
+    if CreateSearchIndex(engine) or args.rebuild_search:
+        RebuildSearchIndex(engine)
+        print 'Rebuilt the full-text product index.'
+
+    if not had_stats or args.rebuild_stats:
+        session = sessionmaker(bind=engine)()
+        RebuildCategoryStats(session)
+        session.commit()
+        session.close()
+        print 'Recomputed the category stats.'
+
+    if args.check:
+        problems = CheckQueryPlans(engine)
+        for name, detail in problems:
+            print '%s: %s' % (name, detail)
+        if not problems:
+            print 'All helper queries use an index.'
+        failed = failed or problems
+
+    sys.exit(1 if failed else 0)
@@ -2,7 +2,9 @@ import os
 import sys
 
 # To support mapper code.
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Text
+from sqlalchemy import Index
 
 # Inherit from base class.
 from sqlalchemy.ext.declarative import declarative_base
@@ -10,8 +12,11 @@ from sqlalchemy.ext.declarative import declarative_base
 # To create FK.
 from sqlalchemy.orm import relationship
 
+# To keep the full-text index in sync.
+from sqlalchemy import DDL, event
+
 # To connect to the db engine.
-from sqlalchemy import create_engine
+from database_engine import CreateEngine
 
 
 # An instance of the SQLA base class.
@@ -22,26 +27,34 @@ Base = declarative_base()
 class User(Base):
     __tablename__ = 'user'
 
+    # Users are looked up by email and provider when they login.
+    __table_args__ = (
+        Index('ux_user_email_provider', 'email', 'provider', unique=True),
+    )
+
     id = Column(Integer, primary_key=True)
     name = Column(String(250), nullable=False)
     email = Column(String(250), nullable=False)
     provider = Column(String(50), nullable=False)
     picture = Column(String(250))
 
-    unique_email = UniqueConstraint('email', 'provider')
-
 
 class Category(Base):
     __tablename__ = 'category'
 
+    __table_args__ = (
+        # Names need to be unique to support vanity URLs. The index also
+        # returns the sidebar in name order without a sort.
+        Index('ux_category_name', 'name', unique=True),
+        Index('ix_category_user_id', 'user_id'),
+    )
+
     id = Column(Integer, primary_key=True)
     name = Column(String(80), nullable=False)
 
-    # Names need to be unique to support vanity URLs.
-    unique_category_name = UniqueConstraint('name')
-
-    # When a category is deleted, remove all products.
-    products = relationship("Product", cascade="delete")
+    # Products are removed with their category by DeleteCategory, in
+    # set-based chunks, never loaded and deleted one by one by the ORM.
+    products = relationship("Product", passive_deletes='all')
 
     user_id = Column(Integer, ForeignKey('user.id'))
     user = relationship(User)
@@ -57,6 +70,17 @@ class Category(Base):
 class Product(Base):
     __tablename__ = 'product'
 
+    __table_args__ = (
+        # Names need to be unique to a category to support vanity URLs. The
+        # index also serves the category listing in name order.
+        Index('ux_product_category_id_name', 'category_id', 'name',
+              unique=True),
+        # Serves price filters and sorts, and finds a category's cheapest
+        # and dearest product without a scan.
+        Index('ix_product_category_id_price', 'category_id', 'price'),
+        Index('ix_product_user_id', 'user_id'),
+    )
+
     id = Column(Integer, primary_key=True)
     name = Column(String(80), nullable=False)
     description = Column(String(250))
@@ -65,9 +89,6 @@ class Product(Base):
     category_id = Column(Integer, ForeignKey('category.id'))
     category = relationship(Category)
 
-    # Names need to be unique to a category to support vanity URLs.
-    unique_product_name = UniqueConstraint('category_id', 'name')
-
     user_id = Column(Integer, ForeignKey('user.id'))
     user = relationship(User)
 
@@ -82,8 +103,137 @@ class Product(Base):
                 }
 
 
+class CategoryStats(Base):
+    __tablename__ = 'category_stats'
+
+    # Price aggregates of the products in a category. Kept up to date by
+    # every product change, so facets never need a GROUP BY over products.
+    category_id = Column(Integer, ForeignKey('category.id'), primary_key=True)
+    product_count = Column(Integer, nullable=False, default=0)
+
+    # Products without a price are counted above but left out of these.
+    priced_count = Column(Integer, nullable=False, default=0)
+    price_sum = Column(Float, nullable=False, default=0)
+    price_min = Column(Float)
+    price_max = Column(Float)
+
+    # Return the category stats object in a format for JSON.
+    @property
+    def serialize(self):
+        return {'category_id': self.category_id,
+                'product_count': self.product_count,
+                'price_min': self.price_min,
+                'price_max': self.price_max,
+                'price_avg': (self.price_sum / self.priced_count
+                              if self.priced_count else None)
+                }
+
+
+# A SQLite FTS5 full-text index over product names and descriptions. It
+# reads the text from the product table itself, and the triggers keep it in
+# sync with every insert, update and delete, however the change is made.
+PRODUCT_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5(
+        name, description, content='product', content_rowid='id')""",
+    """CREATE TRIGGER IF NOT EXISTS product_search_insert
+        AFTER INSERT ON product BEGIN
+            INSERT INTO product_search(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS product_search_delete
+        AFTER DELETE ON product BEGIN
+            INSERT INTO product_search(product_search, rowid, name,
+                                       description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS product_search_update
+        AFTER UPDATE OF name, description ON product BEGIN
+            INSERT INTO product_search(product_search, rowid, name,
+                                       description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO product_search(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END""",
+]
+
+for statement in PRODUCT_SEARCH_DDL:
+    event.listen(Product.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+
+
+class Version(Base):
+    __tablename__ = 'version'
+
+    # A named change counter. Every process serving the catalog reads these
+    # to find out whether its in-memory caches are stale.
+    name = Column(String(80), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+    # When the counter was last bumped, in UTC.
+    modified = Column(DateTime)
+
+
+class Job(Base):
+    __tablename__ = 'job'
+
+    # Workers look for queued jobs that are due, and count the running jobs
+    # of a kind to stay within its concurrency limit.
+    __table_args__ = (
+        Index('ix_job_status_run_after', 'status', 'run_after'),
+        Index('ix_job_kind_status', 'kind', 'status'),
+        Index('ix_job_key', 'key'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(40), nullable=False)
+
+    # The job's arguments as JSON, and a hash of the kind and arguments that
+    # finds an earlier run of the same job.
+    params = Column(Text, nullable=False)
+    key = Column(String(40))
+
+    # queued, running, done or failed.
+    status = Column(String(20), nullable=False, default='queued')
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    error = Column(Text)
+
+    # How far the job has got, in steps of its own choosing.
+    progress = Column(Integer, nullable=False, default=0)
+    total = Column(Integer)
+
+    # The file the job produced, if any.
+    result_path = Column(String(250))
+
+    # All times are in UTC. A queued job is not started before run_after,
+    # a running job whose heartbeat stops is given to another worker.
+    created = Column(DateTime)
+    run_after = Column(DateTime)
+    started = Column(DateTime)
+    heartbeat = Column(DateTime)
+    finished = Column(DateTime)
+    locked_by = Column(String(80))
+
+    user_id = Column(Integer, ForeignKey('user.id'))
+    user = relationship(User)
+
+    # Return the job object in a format for JSON.
+    @property
+    def serialize(self):
+        return {'id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'attempts': self.attempts,
+                'progress': self.progress,
+                'total': self.total,
+                'error': self.error,
+                'created': self.created and self.created.isoformat(),
+                'finished': self.finished and self.finished.isoformat()
+                }
+
+
 # Connect to the db engine.
-engine = create_engine('sqlite:///itemcatalog.db')
+engine = CreateEngine()
 
 # Create a db and all required tables.
 Base.metadata.create_all(engine)
@@ -1,9 +1,10 @@
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from database_engine import CreateEngine
 from database_schema import Base, Category, Product, User
+from catalog_stats import RebuildCategoryStats
 
 
-engine = create_engine('sqlite:///itemcatalog.db')
+engine = CreateEngine()
 Base.metadata.bind = engine
 DBSession = sessionmaker(bind=engine)
 session = DBSession()
@@ -210,3 +211,9 @@ AddProduct("Grippy Yoga Mat Towel",
 
 
 print "database populated."
+
+
+# The products above were added one by one, so compute the price
+# aggregates of every category in one go.
+RebuildCategoryStats(session)
+session.commit()
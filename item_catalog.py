@@ -1,43 +1,343 @@
 from flask import Flask, render_template, url_for, request, redirect, jsonify
 from flask import session as login_session
-from flask import make_response
-from flask import abort, g
+from flask import make_response, Response, stream_with_context
+from flask import abort, flash, g, send_file
+from flask import _app_ctx_stack, has_request_context
 from functools import wraps
+from jinja2 import FileSystemBytecodeCache, Markup
 
-from xml.etree.ElementTree import Element, SubElement, Comment, tostring
-
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
 
+from database_engine import CreateEngines, CreateJobEngine
 from database_schema import Base, Category, Product, User
 
-from oauth2client.client import flow_from_clientsecrets
+from catalog_cache import CategoryCache, FragmentCache
+from catalog_delete import CountProducts, DeleteCategory
+from catalog_delete import BACKGROUND_DELETE_THRESHOLD
+from catalog_jobs import DebounceJob, EnqueueJob, FindJob, JobWorker
+from catalog_jobs import APP_JOB_THREADS, EXPORT_FORMATS, JOB_DIR
+from database_schema import Job
+from catalog_cache import UserProfile
+from catalog_export import GetProductRows, GetProductPage
+from catalog_export import StreamJSON, StreamNDJSON, StreamXML
+from catalog_export import PRODUCT_FIELDS
+from catalog_import import ImportProducts, READERS
+from catalog_search import SearchProducts, SEARCH_FIELDS
+from catalog_search import DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from catalog_filters import ParseCategoryIDs, ParseProductFilters
+from catalog_queries import CategoryQuery, ProductListQuery
+from catalog_queries import LatestProductsQuery, ProductQuery
+from catalog_queries import UserByEmailQuery, UserProfileQuery
+from catalog_stats import ParseProductPrice, ProductsAdded, ProductRemoved
+from catalog_stats import ProductPriceChanged
+from catalog_stats import GetCategoryStats
+from catalog_paging import GetPage, ParsePageArgs
+from catalog_paging import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from catalog_paging import DEFAULT_API_PAGE_SIZE, MAX_API_PAGE_SIZE
+from catalog_snapshots import FindSnapshot, SNAPSHOT_DELAY, SNAPSHOT_FILES
+from catalog_version import BumpVersion, GetVersion, GetVersions
+from catalog_version import GetVersionInfo
+from catalog_version import CategoryVersionName, ProductVersionName
+from catalog_version import CATEGORIES_VERSION, CATALOG_VERSION
+
+from response_cache import CreateResponseCache, MakePrivateDirectory
+from compression import ResponseCompressor
+from static_assets import StaticAssets
+from request_profiler import RequestProfiler
+from session_store import CreateSessionInterface
+from metrics import registry
+from process_local import ProcessLocal
+
 from oauth2client.client import FlowExchangeError
+import requests
 
+from auth_providers import GOOGLE_CLIENT_ID, FACEBOOK_CLIENT_ID
+from auth_providers import ProviderError, ExchangeGoogleCode
+from auth_providers import FetchGoogleProfile, RevokeGoogleToken
+from auth_providers import FetchFacebookProfile, RevokeFacebookPermissions
+
+from timeit import default_timer
+import datetime
+import glob
+import hashlib
+import os
 import random
+import tempfile
 import string
-import httplib2
 import json
-import requests
+
+
+# Where compiled templates are kept, so that a new worker loads them
+# instead of compiling every template again. By default Jinja's own
+# directory for this user is used.
+TEMPLATE_CACHE_DIR = os.environ.get('ITEMCATALOG_TEMPLATE_CACHE_DIR')
+
+
+def CreateBytecodeCache(directory=TEMPLATE_CACHE_DIR):
+    """ Create the Jinja bytecode cache, and its directory if needed.
+
+    Args:
+        directory: where to keep compiled templates, None for Jinja's
+                   default. It must be private to this user, see
+                   MakePrivateDirectory.
+    Returns:
+        bytecode_cache: a FileSystemBytecodeCache.
+    """
+    if directory is None:
+        return FileSystemBytecodeCache()
+    MakePrivateDirectory(directory)
+    return FileSystemBytecodeCache(directory)
 
 
 app = Flask(__name__)
+app.jinja_options = dict(Flask.jinja_options,
+                         bytecode_cache=CreateBytecodeCache())
 
+# Let a fronting web server send snapshot, job and static files, through
+# the X-Sendfile header, instead of the app.
+app.config['USE_X_SENDFILE'] = os.environ.get(
+    'ITEMCATALOG_USE_X_SENDFILE', '') in ('1', 'true')
 
-GOOGLE_CLIENT_ID = json.loads(
-    open('client_secrets_google.json', 'r').read())['web']['client_id']
+# The /admin/ and /metrics endpoints describe the process to anyone who
+# asks, so they answer 404 unless turned on, e.g. behind a firewall.
+ADMIN_ENDPOINTS = os.environ.get('ITEMCATALOG_ADMIN_ENDPOINTS',
+                                 '') in ('1', 'true')
 
-FACEBOOK_CLIENT_ID = json.loads(
-    open('client_secrets_facebook.json', 'r').read())['web']['app_id']
+# Responses are compressed, and static files are linked to and served as
+# their fingerprinted, precompressed copies.
+compressor = ResponseCompressor(app)
+static_assets = StaticAssets(app)
 
-FACEBOOK_CLIENT_SECRET = json.loads(
-    open('client_secrets_facebook.json', 'r').read())['web']['app_secret']
+# Only a session ID goes in the cookie, the login session itself is kept on
+# the server.
+app.session_interface = CreateSessionInterface()
 
 
-engine = create_engine('sqlite:///itemcatalog.db')
+write_engine, read_engine = CreateEngines()
+engine = write_engine
 Base.metadata.bind = engine
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+
+
+class RoutingSession(Session):
+    """ A session that sends reads and writes to different engines.
+
+    GET and HEAD requests read through the read-only pool. Everything else,
+    including any flush and any work done outside of a request, goes to the
+    single writer connection.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or not IsReadOnlyRequest():
+            return write_engine
+        return read_engine
+
+
+def IsReadOnlyRequest():
+    """ Check if the current request only reads from the db.
+
+    Returns:
+        True if handling a GET or HEAD request, False otherwise.
+    """
+    return has_request_context() and request.method in ('GET', 'HEAD')
+
+
+DBSession = sessionmaker(class_=RoutingSession)
+
+# Each application context, and so each request, gets its own session.
+# Outside of a request the session is scoped to the current thread.
+session = scoped_session(DBSession, scopefunc=_app_ctx_stack.__ident_func__)
+
+category_cache = CategoryCache()
+sidebar_cache = FragmentCache()
+
+response_cache = CreateResponseCache()
+
+# Runs queued jobs, such as exports and large deletes, in this process.
+# Plain sessions are used, as the jobs run outside of any request.
+job_worker = JobWorker(sessionmaker(bind=CreateJobEngine(APP_JOB_THREADS,
+                                                         write_engine)),
+                       sessionmaker(bind=read_engine),
+                       threads=APP_JOB_THREADS)
+job_worker_threads = ProcessLocal(job_worker.start)
+
+
+@app.before_request
+def StartJobWorker():
+    """ Start the job worker threads of this process, if it has any. """
+    if job_worker.threads:
+        job_worker_threads.get()
+
+
+@app.teardown_appcontext
+def RemoveSession(exception=None):
+    """ Discard the request's session and return its connection to the pool.
+
+    Args:
+        exception: the exception that ended the request, if any.
+    """
+    if exception is not None:
+        session.rollback()
+    session.remove()
+
+
+# Query Budget Helper Methods -------------------------------------------------
+
+
+# The maximum number of SQL statements each page may run. Only enforced in
+# testing mode or when QUERY_BUDGET_CHECK is set, so that a template that
+# starts lazy loading relationships fails instead of silently slowing the
+# page down.
+# Budgets are measured with cold caches, so they include the two statements
+# that reload the category cache: its version row and the category list.
+# Cached pages also read the versions their cache key is built from.
+# Logged-in users' profiles come from the login session, so none of these
+# include a User lookup.
+QUERY_BUDGETS = {
+    'categoryListing': 5,
+    # Includes the category's precomputed stats.
+    'productListing': 7,
+    'viewProduct': 5,
+    'addCategory': 2,
+    'editCategory': 3,
+    # Includes the lookup of the category's delete job.
+    'deleteCategory': 4,
+    'addProduct': 2,
+    'editProduct': 3,
+    'deleteProduct': 3,
+}
+
+
+def CountQuery(conn, cursor, statement, parameters, context, executemany):
+    """ Count every SQL statement run while handling a request. """
+    if g:
+        g.query_count = g.get('query_count', 0) + 1
+
+
+for bound_engine in set([write_engine, read_engine]):
+    event.listen(bound_engine, 'before_cursor_execute', CountQuery)
+
+
+@app.after_request
+def CheckQueryBudget(response):
+    """ Fail the request if it ran more queries than its route allows. """
+    if not (app.testing or app.config.get('QUERY_BUDGET_CHECK')):
+        return response
+    # The budgets are for rendering pages, form submissions write as much as
+    # they need to.
+    if request.method != 'GET':
+        return response
+    budget = QUERY_BUDGETS.get(request.endpoint)
+    query_count = g.get('query_count', 0)
+    if budget is not None and query_count > budget:
+        raise AssertionError('%s ran %d queries, its budget is %d.'
+                             % (request.endpoint, query_count, budget))
+    return response
+
+
+# Timings of every request, when ITEMCATALOG_PROFILE is set.
+profiler = RequestProfiler(app, [write_engine, read_engine])
+
+
+# Metrics Helper Methods ------------------------------------------------------
+
+
+def RequestsInProgress():
+    """ Count the requests being handled, for the in-progress gauge. """
+    totals = registry.collect()
+    return [((), registry.total('itemcatalog_requests_started_total', totals) -
+             registry.total('itemcatalog_requests_total', totals))]
+
+
+def PoolsCheckedOut():
+    """ Count the connections checked out of each pool. """
+    pools = [('write', write_engine.pool)]
+    if read_engine is not write_engine:
+        pools.append(('read', read_engine.pool))
+    return [((('pool', name),), pool.checkedout())
+            for name, pool in pools
+            if hasattr(pool, 'checkedout')]
+
+
+def ResponseCacheStat(key):
+    """ Read one of the response cache's counters when scraped. """
+    return lambda: [((), response_cache.stats()[key])]
+
+
+registry.declare('itemcatalog_requests_started_total', 'counter',
+                 'Requests that have started.')
+registry.declare('itemcatalog_requests_total', 'counter',
+                 'Requests handled, by endpoint, method and status.')
+registry.declare('itemcatalog_request_duration_seconds', 'histogram',
+                 'Time spent handling requests, by endpoint.')
+registry.declare('itemcatalog_requests_in_progress', 'gauge',
+                 'Requests being handled.',
+                 callback=RequestsInProgress)
+registry.declare('itemcatalog_sql_statements_total', 'counter',
+                 'SQL statements run, by pool.')
+registry.declare('itemcatalog_db_pool_checked_out', 'gauge',
+                 'Connections checked out of each db pool.',
+                 callback=PoolsCheckedOut)
+registry.declare('itemcatalog_response_cache_hits_total', 'counter',
+                 'Pages served from the response cache.',
+                 callback=ResponseCacheStat('hits'))
+registry.declare('itemcatalog_response_cache_misses_total', 'counter',
+                 'Pages rendered because they were not in the response cache.',
+                 callback=ResponseCacheStat('misses'))
+
+
+def CountStatements(name):
+    """ Create a listener that counts the SQL statements run on an engine.
+
+    Args:
+        name: the pool label, 'read' or 'write'.
+    """
+    labels = (('pool', name),)
+
+    def CountStatement(*args):
+        registry.inc('itemcatalog_sql_statements_total', labels)
+    return CountStatement
+
+
+event.listen(write_engine, 'before_cursor_execute', CountStatements('write'))
+if read_engine is not write_engine:
+    event.listen(read_engine, 'before_cursor_execute', CountStatements('read'))
+
+
+@app.before_request
+def StartRequestMetrics():
+    """ Note when the request started. """
+    g.metrics_start = default_timer()
+    registry.inc('itemcatalog_requests_started_total')
+
+
+@app.after_request
+def RecordResponseStatus(response):
+    """ Note the status of the response for the request metrics. """
+    g.metrics_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def RecordRequestMetrics(exception=None):
+    """ Count the request and record how long it took.
+
+    Streamed responses are torn down once their body has been sent, so
+    their time includes the streaming.
+    """
+    start = g.get('metrics_start')
+    if start is None:
+        return
+    endpoint = request.endpoint or 'none'
+    status = 500 if exception is not None else g.get('metrics_status', 500)
+    registry.inc('itemcatalog_requests_total',
+                 (('endpoint', endpoint),
+                  ('method', request.method),
+                  ('status', str(status))))
+    registry.observe('itemcatalog_request_duration_seconds',
+                     default_timer() - start,
+                     (('endpoint', endpoint),))
 
 
 # Category Helper Methods -----------------------------------------------------
@@ -46,11 +346,46 @@ session = DBSession()
 def GetAllCategories():
     """ Get a list of all categories in the catalog.
 
+    The list is served from the process-local category cache and only
+    reloaded when a category has been added, edited or deleted.
+
     Returns:
-        categories: a list of Category tuples of all categories in the catalog.
+        categories: a tuple of CategoryRow tuples of all categories in the
+                    catalog.
     """
-    categories = session.query(Category).order_by(Category.name)
-    return categories
+    return category_cache.get(session)
+
+
+@app.template_global('category_buttons')
+def CategoryButtons(user):
+    """ Render the sidebar's category buttons, from the fragment cache.
+
+    Viewers that own the same categories, such as everyone who owns none,
+    share one rendering for each version of the category list.
+
+    Args:
+        user: the profile of the viewer, or None.
+    Returns:
+        html: the rendered buttons.
+    """
+    categories = GetAllCategories()
+    owned = sidebar_cache.owned(categories, user.id if user else None)
+    return Markup(sidebar_cache.get(
+        categories,
+        owned,
+        lambda: render_template('category_buttons.html',
+                                categories=categories,
+                                owned=owned)))
+
+
+def CategoriesChanged():
+    """ Record a category change in the current transaction.
+
+    Call before committing an add, edit or delete of a category.
+    """
+    BumpVersion(session, CATEGORIES_VERSION)
+    BumpVersion(session, CATALOG_VERSION)
+    ScheduleSnapshot()
 
 
 def GetSingleCategory(category_id):
@@ -61,29 +396,46 @@ def GetSingleCategory(category_id):
     Returns:
         singleCategory: a Category object.
     """
-    singleCategory = session.query(Category).filter_by(id=category_id).one()
+    singleCategory = CategoryQuery(session, category_id).one()
     return singleCategory
 
 
 # Product Helper Methods ------------------------------------------------------
 
 
-def GetAllProducts(category_id):
-    """ Get a list of all products in a category.
+def GetAllProducts(category_id, after=None, limit=DEFAULT_PAGE_SIZE,
+                   filters=None):
+    """ Get a page of the products in a category.
 
     Args:
         category_id: the ID of the category to get the products for.
+        after: the cursor of the page to get, None for the first page.
+        limit: the number of products per page.
+        filters: a ProductFilters tuple to filter and sort by, None for all
+                 products sorted by name.
     Returns:
-        products: a list of Product tuples of all products in a category.
+        page: a Page tuple of Product objects and the next page's cursor.
+    Raises:
+        ValueError: if the cursor is malformed.
     """
-    if category_id == 0:
-        products = session.query(Product).\
-            order_by(Product.category_id, Product.id)
-    else:
-        products = session.query(Product).\
-            filter_by(category_id=category_id).\
-            order_by(Product.name)
-    return products
+    products, order = ProductListQuery(session, category_id, filters)
+    return GetPage(products, order, after, limit)
+
+
+def ProductsChanged(category_id, product_id=None):
+    """ Record a product change in the current transaction.
+
+    Call before committing an add, edit or delete of a product.
+
+    Args:
+        category_id: the ID of the category the product is in.
+        product_id: the ID of the product, None for a new product.
+    """
+    BumpVersion(session, CATALOG_VERSION)
+    BumpVersion(session, CategoryVersionName(category_id))
+    if product_id is not None:
+        BumpVersion(session, ProductVersionName(product_id))
+    ScheduleSnapshot()
 
 
 def GetLatestProducts():
@@ -92,7 +444,7 @@ def GetLatestProducts():
     Returns:
         products: a list of Product tuples of the last 5 products added.
     """
-    products = session.query(Product).order_by(Product.id.desc()).limit(5)
+    products = LatestProductsQuery(session)
     return products
 
 
@@ -104,7 +456,7 @@ def GetSingleProduct(product_id):
     Returns:
         singleProduct: a Product object.
     """
-    singleProduct = session.query(Product).filter_by(id=product_id).one()
+    singleProduct = ProductQuery(session, product_id).one()
     return singleProduct
 
 
@@ -126,8 +478,8 @@ def CreateUser(login_session):
     session.add(newUser)
     session.commit()
 
-    user = session.query(User).filter_by(email=login_session['email'],
-                                         provider=login_session['provider']).one()
+    user = UserByEmailQuery(session, login_session['email'],
+                            login_session['provider']).one()
     return user.id
 
 
@@ -141,8 +493,8 @@ def GetUserIDFromEmail(email):
         None: if the user is not found then None is returned.
     """
     try:
-        user = session.query(User).filter_by(email=email,
-                                             provider=login_session['provider']).one()
+        user = UserByEmailQuery(session, email,
+                                login_session['provider']).one()
         return user.id
     except:
         return None
@@ -161,17 +513,311 @@ def GetUserIDFromLoginSession():
 
 
 def GetUserInfo(user_id):
-    """ Get user information from the db.
+    """ Get the profile of a user, from the login session if it is theirs.
+
+    The login session holds the profile the provider sent at login, so the
+    logged-in user is not looked up in the db.
 
     Args:
         user_id: the ID of the user to get.
     Returns:
-        user: a User object.
+        user: a UserProfile tuple.
     """
     if user_id is None:
         return None
-    user = session.query(User).filter_by(id=user_id).one()
-    return user
+    if (login_session.get('user_id') == user_id and
+            'username' in login_session and
+            'picture' in login_session):
+        return UserProfile(user_id,
+                           login_session['username'],
+                           login_session['picture'])
+    return UserProfile(*UserProfileQuery(session, user_id).one())
+
+
+# Paging Helper Methods -------------------------------------------------------
+
+
+def GetPageArgs(default, maximum):
+    """ Read the page size and cursor from the query string.
+
+    Aborts with a 400 if either one is malformed.
+
+    Args:
+        default: the page size to use when limit is not given.
+        maximum: the largest page size a client may ask for.
+    Returns:
+        limit: the page size.
+        after: the cursor of the page to get, None for the first page.
+    """
+    try:
+        return ParsePageArgs(request.args, default, maximum)
+    except ValueError:
+        abort(400)
+
+
+def IsPagedRequest():
+    """ Check if the client asked an API endpoint for a single page.
+
+    Returns:
+        True if the query string holds limit or after.
+    """
+    return 'limit' in request.args or 'after' in request.args
+
+
+def GetNextPageURL(cursor, external=False):
+    """ Build the URL of the next page of the current request.
+
+    Args:
+        cursor: the cursor of the next page, None on the last page.
+        external: if True an absolute URL is returned.
+    Returns:
+        url: the URL of the next page, None on the last page.
+    """
+    if cursor is None:
+        return None
+    args = request.args.to_dict()
+    args.update(request.view_args)
+    args['after'] = cursor
+    return url_for(request.endpoint, _external=external, **args)
+
+
+def AddNextPageLink(response, next_url):
+    """ Advertise the next page in a Link header.
+
+    Args:
+        response: the response to add the header to.
+        next_url: the URL of the next page, None on the last page.
+    Returns:
+        response: the same response.
+    """
+    if next_url is not None:
+        response.headers['Link'] = '<%s>; rel="next"' % next_url
+    return response
+
+
+# Filter Helper Methods -------------------------------------------------------
+
+
+def GetProductFilters(default_sort):
+    """ Read the product filters from the query string.
+
+    Aborts with a 400 if a filter is malformed.
+
+    Args:
+        default_sort: the sort to use when none is given.
+    Returns:
+        filters: a ProductFilters tuple.
+    """
+    try:
+        return ParseProductFilters(request.args, default_sort)
+    except ValueError:
+        abort(400)
+
+
+def GetCategoryIDs():
+    """ Read the category IDs from the query string.
+
+    Aborts with a 400 if one is not a number.
+
+    Returns:
+        category_ids: a list of ints, empty if none were given.
+    """
+    try:
+        return ParseCategoryIDs(request.args)
+    except ValueError:
+        abort(400)
+
+
+def GetSubmittedPrice():
+    """ Read the price from a submitted product form.
+
+    Aborts with a 400 if the price is not a finite number or is negative,
+    the same prices an import refuses.
+
+    Returns:
+        price: the price as a float, None if it was left empty.
+    """
+    try:
+        return ParseProductPrice(request.form.get('price'))
+    except ValueError:
+        abort(400)
+
+
+# Conditional GET Helper Methods ----------------------------------------------
+
+
+def HashBuild(root=os.path.dirname(os.path.abspath(__file__))):
+    """ Identify the deployed build of the app.
+
+    Pages are made from the app's modules, its templates and the static
+    files, whose manifest changes with them. A deploy that changes any of
+    them must change the pages' validators as well.
+
+    Args:
+        root: the app's directory.
+    Returns:
+        build_id: a hash of the files' names and contents.
+        built: the time the newest of them was changed, in UTC.
+    """
+    paths = sorted(glob.glob(os.path.join(root, '*.py')) +
+                   glob.glob(os.path.join(root, 'templates', '*.html')) +
+                   glob.glob(os.path.join(root, 'static', 'build',
+                                          'manifest.json')))
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(os.path.relpath(path, root) + '\0')
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    built = max(os.path.getmtime(path) for path in paths)
+    return (digest.hexdigest()[:12],
+            datetime.datetime.utcfromtimestamp(int(built)))
+
+
+BUILD_ID, BUILT = HashBuild()
+
+
+def ConditionalGet(anonymous_only=False):
+    """ Answer conditional GET requests from the catalog change version.
+
+    The wrapped route gets an ETag and a Last-Modified header derived from
+    the catalog change version and the build of the app. A request whose If-None-Match or
+    If-Modified-Since matches the current version gets an empty 304 reply
+    without the route running a single catalog query.
+
+    Args:
+        anonymous_only: if True logged-in users, whose pages differ from
+                        everyone else's, always get a full response.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if anonymous_only and 'user_id' in login_session:
+                return f(*args, **kwargs)
+
+            version, modified = GetVersionInfo(session, CATALOG_VERSION)
+            g.catalog_version = version
+            etag = 'catalog-%s-%d' % (BUILD_ID, version)
+            if modified is not None:
+                modified = max(modified.replace(microsecond=0), BUILT)
+
+            if request.if_none_match:
+                # Compressed responses carry the ETag as a weak one.
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = (modified is not None and
+                                request.if_modified_since is not None and
+                                modified <= request.if_modified_since)
+
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.last_modified = modified
+            response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
+
+
+# Snapshot Helper Methods -----------------------------------------------------
+
+
+def ScheduleSnapshot():
+    """ Queue a rebuild of the export snapshots in the current transaction.
+
+    The rebuild waits SNAPSHOT_DELAY seconds, so that a burst of changes
+    leads to a single rebuild.
+    """
+    DebounceJob(session, 'snapshot', {}, SNAPSHOT_DELAY)
+
+
+def IsSnapshotRequest(*allowed):
+    """ Check if the request asks for a whole export, which snapshots hold.
+
+    Args:
+        allowed: the query string arguments that don't change which rows
+                 are exported.
+    Returns:
+        True if every argument is allowed, False otherwise.
+    """
+    return all(key in allowed for key in request.args)
+
+
+def SnapshotResponse(name):
+    """ Send an export from the snapshot of the current catalog version.
+
+    The file is sent as is, brotli or gzip compressed if the client accepts
+    it, so the export isn't generated or compressed again. If there is no
+    snapshot of the current version a rebuild is queued.
+
+    Args:
+        name: the snapshot file, one of SNAPSHOT_FILES.
+    Returns:
+        The file response, or None if the snapshot is stale.
+    """
+    version = g.get('catalog_version')
+    if version is None:
+        version = GetVersion(session, CATALOG_VERSION)
+    path, encoding = FindSnapshot(version, name, request.accept_encodings)
+    if path is None:
+        ScheduleSnapshot()
+        session.commit()
+        return None
+
+    response = send_file(path, mimetype=SNAPSHOT_FILES[name],
+                         conditional=True)
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+# Response Cache Helper Methods -----------------------------------------------
+
+
+def CachedPage(*scopes):
+    """ Serve a page to anonymous visitors from the response cache.
+
+    Logged-in users always get a freshly rendered page. The page is cached
+    under the current values of the change counters named by scopes, so it
+    is only rendered again once one of them is bumped.
+
+    Args:
+        scopes: the names of the change counters the page depends on. Each
+                one is formatted with the route's URL arguments, e.g.
+                'category:{category_id}'.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if 'user_id' in login_session:
+                return f(*args, **kwargs)
+
+            names = [scope.format(**kwargs) for scope in scopes]
+            key = response_cache.key(request.endpoint,
+                                     kwargs,
+                                     request.query_string,
+                                     GetVersions(session, names))
+            page = response_cache.get(key)
+            if page is not None:
+                status, headers, body = page
+                return Response(body, status=status, headers=headers)
+
+            response = make_response(f(*args, **kwargs))
+            if (response.status_code == 200 and
+                    not response.is_streamed and
+                    'Set-Cookie' not in response.headers):
+                response_cache.set(key,
+                                   response.status_code,
+                                   list(response.headers),
+                                   response.get_data())
+            return response
+        return decorated_function
+    return decorator
 
 
 # Login Helper Methods --------------------------------------------------------
@@ -186,6 +832,28 @@ def LoginRequired(f):
     return decorated_function
 
 
+def AdminEndpoint(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not ADMIN_ENDPOINTS:
+            abort(404)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def ProviderTimeoutResponse():
+    """ Tell the client that the login provider did not answer in time.
+
+    Returns:
+        response: a 504 JSON response.
+    """
+    response = make_response(
+        json.dumps('The login provider did not respond, please try again.'),
+        504)
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+
 def ConnectUser():
     """ Handles user login from any provider.
 
@@ -215,10 +883,7 @@ def ConnectUser():
 
         try:
             # Exchange the authorization code for a credentials object.
-            oauth_flow = flow_from_clientsecrets(
-                'client_secrets_google.json', scope='')
-            oauth_flow.redirect_uri = 'postmessage'
-            credentials = oauth_flow.step2_exchange(auth_code)
+            credentials = ExchangeGoogleCode(auth_code)
         except FlowExchangeError:
             # Something went wrong in the exchange process,
             # notify the user and exit.
@@ -227,12 +892,14 @@ def ConnectUser():
             response.headers['Content-Type'] = 'application/json'
             return response
 
-        # Verify that the access token is valid.
+        # Verify that the access token is valid, and get the user's profile
+        # at the same time. The profile is only used once the token checks
+        # out.
         access_token = credentials.access_token
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s'
-               % access_token)
-        h = httplib2.Http()
-        result = json.loads(h.request(url, 'GET')[1])
+        try:
+            result, data = FetchGoogleProfile(access_token)
+        except ProviderError:
+            return ProviderTimeoutResponse()
 
         # If there was an error in the access token info, abort.
         if result.get('error') is not None:
@@ -268,59 +935,31 @@ def ConnectUser():
         login_session['credentials'] = credentials.access_token
         login_session['gplus_id'] = gplus_id
 
-        # Use the Goolge Plus API to get more info about the user.
-        userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-        params = {'access_token': credentials.access_token, 'alt': 'json'}
-        answer = requests.get(userinfo_url, params=params)
-
-        # Save the user data to a json object.
-        data = answer.json()
-
         # Store the user data in the login session.
         login_session['username'] = data['name']
         login_session['picture'] = data['picture']
         login_session['email'] = data['email']
 
     elif login_session['provider'] == 'facebook':
-        # Exchange short-lived token for long-lived token.
-        access_token = request.data
-        url = 'https://graph.facebook.com/oauth/access_token?grant_type=fb_exchange_token&client_id=%s&client_secret=%s&fb_exchange_token=%s' % (
-            FACEBOOK_CLIENT_ID, FACEBOOK_CLIENT_SECRET, access_token)
-        h = httplib2.Http()
-        result = h.request(url, 'GET')[1]
-
-        # Strip expire tag from long-lived token.
-        token = result.split("&")[0]
-
-        # Use token to get user data from API.
-        url = 'https://graph.facebook.com/v2.4/me?%s&fields=name,id,email' % token
-        h = httplib2.Http()
-        result = h.request(url, 'GET')[1]
-
-        # Save the user data to a json object.
-        data = json.loads(result)
+        # Exchange short-lived token for long-lived token, then use it to
+        # get the user's data and picture from the API concurrently.
+        try:
+            access_token, data, picture = FetchFacebookProfile(request.data)
+        except ProviderError:
+            return ProviderTimeoutResponse()
 
         # Store the user data in the login session.
         login_session['username'] = data["name"]
         login_session['email'] = data["email"]
         login_session['facebook_id'] = data["id"]
+        login_session['picture'] = picture
 
         # The token must be stored in the login_session in
-        # order to properly logout. Strip out the information
-        # before the equals sign in the token.
-        stored_token = token.split("=")[1]
-        login_session['access_token'] = stored_token
-
-        # Get user picture.
-        url = 'https://graph.facebook.com/v2.4/me/picture?%s&redirect=0&height=200&width=200' % token
-        h = httplib2.Http()
-        result = h.request(url, 'GET')[1]
+        # order to properly logout.
+        login_session['access_token'] = access_token
 
-        # Save the user picture to a json object.
-        data = json.loads(result)
-
-        # Store the user picture in the login session.
-        login_session['picture'] = data["data"]["url"]
+    # Give the logged in session a new ID.
+    login_session.regenerate()
 
     # Determine if the user exists, if it doesn't then create a new one.
     user_id = GetUserIDFromEmail(login_session['email'])
@@ -355,6 +994,32 @@ def GenerateNonce():
     return login_session['csrf_token']
 
 
+# Form Helper Methods ---------------------------------------------------------
+
+
+def FlushUnique(item, message):
+    """ Write a new or edited item, unless it breaks a unique index.
+
+    Categories need unique names, and so do the products in a category.
+    When the db refuses the item, the transaction is rolled back and the
+    message is flashed, so that the form can be shown again.
+
+    Args:
+        item: the Category or Product to write.
+        message: the message to show when the name is taken.
+    Returns:
+        flushed: True if the item was written, False if it was refused.
+    """
+    session.add(item)
+    try:
+        session.flush()
+    except IntegrityError:
+        session.rollback()
+        flash(message)
+        return False
+    return True
+
+
 # Login / Logout Routing Methods ----------------------------------------------
 
 
@@ -409,19 +1074,22 @@ def userLogout():
             return redirect(url_for('categoryListing'))
 
         # Use Google API to revoke the token.
-        url = 'https://accounts.google.com/o/oauth2/revoke?token=%s' % access_token
-        h = httplib2.Http()
-
-        # Grab the result from Google.
-        result = h.request(url, 'GET')[0]
-
-        if result['status'] == '200':
+        try:
+            status = RevokeGoogleToken(access_token)
+        except requests.RequestException as e:
+            # Google could not be reached. The token still expires on its
+            # own, so the user is logged out of the catalog anyway.
+            print 'Could not revoke the token: %s' % e
+            status = None
+
+        if status == 200 or status is None:
             # Success, user was logged out.
             del login_session['credentials']
             del login_session['gplus_id']
             del login_session['username']
             del login_session['email']
             del login_session['picture']
+            login_session.pop('user_id', None)
             print "success logout"
             response = make_response(json.dumps(
                 'Successfully disconnected.'), 200)
@@ -431,15 +1099,18 @@ def userLogout():
             # Something went wrong, notify the user.
             print "FAIL logout"
             response = make_response(json.dumps(
-                result, 400))
+                status, 400))
             response.headers['Content-Type'] = 'application/json'
             return response
 
     elif login_session['provider'] == 'facebook':
-        facebook_id = login_session['facebook_id']
-        url = 'https://graph.facebook.com/%s/permissions' % facebook_id
-        h = httplib2.Http()
-        result = h.request(url, 'DELETE')[1]
+        try:
+            RevokeFacebookPermissions(login_session['facebook_id'],
+                                      login_session.get('access_token'))
+        except requests.RequestException as e:
+            # The user is logged out of the catalog even if Facebook could
+            # not be reached.
+            print 'Could not revoke the permissions: %s' % e
 
         del login_session['username']
         del login_session['email']
@@ -458,6 +1129,8 @@ def userLogout():
 
 @app.route('/')
 @app.route('/catalog/')
+@ConditionalGet(anonymous_only=True)
+@CachedPage(CATEGORIES_VERSION, CATALOG_VERSION)
 def categoryListing():
     """ Display the home page of the catalog.
 
@@ -469,7 +1142,6 @@ def categoryListing():
         user_id = login_session['user_id']
 
     return render_template('list_all_categories.html',
-                           categories=GetAllCategories(),
                            products=GetLatestProducts(),
                            user=GetUserInfo(GetUserIDFromLoginSession()))
 
@@ -490,13 +1162,19 @@ def addCategory():
         if request.form['name']:
             newCategory = Category(name=request.form['name'],
                                    user_id=login_session['user_id'])
-        session.add(newCategory)
+        if not FlushUnique(newCategory, 'A category named %s already '
+                                        'exists.' % newCategory.name):
+            return render_template('add_category.html',
+                                   user=GetUserInfo(
+                                       GetUserIDFromLoginSession()),
+                                   csrf_token=GenerateNonce())
+        CategoriesChanged()
         session.commit()
+        category_cache.invalidate()
         return redirect(url_for('productListing',
                                 category_id=newCategory.id))
     else:
         return render_template('add_category.html',
-                               categories=GetAllCategories(),
                                user=GetUserInfo(GetUserIDFromLoginSession()),
                                csrf_token=GenerateNonce())
 
@@ -515,7 +1193,7 @@ def editCategory(category_id):
     """
     editedCategory = GetSingleCategory(category_id)
 
-    if login_session['user_id'] != editedCategory.user.id:
+    if login_session['user_id'] != editedCategory.user_id:
         return redirect(url_for('userLogin'))
 
     if request.method == 'POST':
@@ -523,13 +1201,20 @@ def editCategory(category_id):
 
         if request.form['name']:
             editedCategory.name = request.form['name']
-        session.add(editedCategory)
+        if not FlushUnique(editedCategory, 'A category named %s already '
+                                           'exists.' % request.form['name']):
+            return render_template('edit_category.html',
+                                   editedCategory=editedCategory,
+                                   user=GetUserInfo(
+                                       GetUserIDFromLoginSession()),
+                                   csrf_token=GenerateNonce())
+        CategoriesChanged()
         session.commit()
+        category_cache.invalidate()
         return redirect(url_for('productListing',
                                 category_id=editedCategory.id))
     else:
         return render_template('edit_category.html',
-                               categories=GetAllCategories(),
                                editedCategory=editedCategory,
                                user=GetUserInfo(GetUserIDFromLoginSession()),
                                csrf_token=GenerateNonce())
@@ -541,27 +1226,54 @@ def editCategory(category_id):
 def deleteCategory(category_id):
     """ Delete a category. Supports GET and POST.
 
+    Categories with more than BACKGROUND_DELETE_THRESHOLD products are
+    deleted by a background job, and the form shows its progress instead.
+
     Args:
         category_id: the ID of the category to delete.
     Returns:
-        GET: the Delete Category form.
-        POST: the home page of the catalog.
+        GET: the Delete Category form, or the progress of its deletion.
+        POST: the home page of the catalog, or the deletion progress.
     """
-    deletedCategory = GetSingleCategory(category_id)
+    params = {'category_id': category_id}
+    job = FindJob(session, 'delete_category', params)
+    deletedCategory = CategoryQuery(session, category_id).first()
+    if job is not None and job.status == 'done':
+        if deletedCategory is None:
+            category_cache.invalidate()
+            return redirect(url_for('categoryListing'))
+        # SQLite hands the ID of a deleted category to the next one, so a
+        # finished job with the category still there deleted an earlier
+        # category with the same ID.
+        job = None
+
+    if deletedCategory is None:
+        abort(404)
 
-    if login_session['user_id'] != deletedCategory.user.id:
+    if login_session['user_id'] != deletedCategory.user_id:
         return redirect(url_for('userLogin'))
 
     if request.method == 'POST':
         ValidateNonce()
 
-        session.delete(deletedCategory)
+        total = CountProducts(session, category_id)
+        if total > BACKGROUND_DELETE_THRESHOLD:
+            if job is None or job.status == 'failed':
+                EnqueueJob(session, 'delete_category', params,
+                           login_session['user_id'])
+                session.commit()
+            return redirect(url_for('deleteCategory',
+                                    category_id=category_id))
+
+        DeleteCategory(session, category_id)
+        ScheduleSnapshot()
         session.commit()
+        category_cache.invalidate()
         return redirect(url_for('categoryListing'))
     else:
         return render_template('delete_category.html',
-                               categories=GetAllCategories(),
                                deletedCategory=deletedCategory,
+                               job=job,
                                user=GetUserInfo(GetUserIDFromLoginSession()),
                                csrf_token=GenerateNonce())
 
@@ -570,23 +1282,40 @@ def deleteCategory(category_id):
 
 
 @app.route('/catalog/<int:category_id>/')
+@ConditionalGet(anonymous_only=True)
+@CachedPage(CATEGORIES_VERSION, 'category:{category_id}')
 def productListing(category_id):
-    """ List all products for a category.
+    """ List a page of the products in a category.
+
+    The page size and position are taken from the limit and after query
+    string arguments. min_price, max_price and sort ('name', 'price' or
+    '-price') filter and sort the products.
 
     Args:
         category_id: the ID of the category to get the product listing for.
     Returns:
         The product listing for the selected category.
     """
+    limit, after = GetPageArgs(DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    filters = GetProductFilters('name')
     listCategory = GetSingleCategory(category_id)
+    try:
+        page = GetAllProducts(category_id, after, limit, filters)
+    except ValueError:
+        abort(400)
+    stats = GetCategoryStats(session, [category_id])
     return render_template('list_all_products.html',
-                           categories=GetAllCategories(),
                            listCategory=listCategory,
-                           products=GetAllProducts(category_id),
+                           stats=stats[0].serialize if stats else None,
+                           filters=filters,
+                           products=page.rows,
+                           next_url=GetNextPageURL(page.next_cursor),
                            user=GetUserInfo(GetUserIDFromLoginSession()))
 
 
 @app.route('/catalog/<int:category_id>/<int:product_id>/view/')
+@ConditionalGet(anonymous_only=True)
+@CachedPage(CATEGORIES_VERSION, 'product:{product_id}')
 def viewProduct(category_id, product_id):
     """ View the details of the selected product.
 
@@ -597,7 +1326,6 @@ def viewProduct(category_id, product_id):
         A page with the product details.
     """
     return render_template('view_product.html',
-                           categories=GetAllCategories(),
                            singleproduct=GetSingleProduct(product_id),
                            user=GetUserInfo(GetUserIDFromLoginSession()))
 
@@ -617,19 +1345,27 @@ def addProduct(category_id):
     if request.method == 'POST':
         ValidateNonce()
 
+        price = GetSubmittedPrice()
         if request.form['name']:
             newProduct = Product(name=request.form['name'],
                                  description=request.form['description'],
-                                 price=request.form['price'],
+                                 price=price,
                                  category_id=category_id,
                                  user_id=login_session['user_id'])
-        session.add(newProduct)
+        if not FlushUnique(newProduct, 'A product named %s is already in '
+                                       'this category.' % newProduct.name):
+            return render_template('add_product.html',
+                                   category_id=category_id,
+                                   user=GetUserInfo(
+                                       GetUserIDFromLoginSession()),
+                                   csrf_token=GenerateNonce())
+        ProductsAdded(session, category_id, [price])
+        ProductsChanged(category_id)
         session.commit()
         return redirect(url_for('productListing',
                                 category_id=category_id))
     else:
         return render_template('add_product.html',
-                               categories=GetAllCategories(),
                                category_id=category_id,
                                user=GetUserInfo(GetUserIDFromLoginSession()),
                                csrf_token=GenerateNonce())
@@ -650,23 +1386,36 @@ def editProduct(category_id, product_id):
     """
     editedProduct = GetSingleProduct(product_id)
 
-    if login_session['user_id'] != editedProduct.user.id:
+    if login_session['user_id'] != editedProduct.user_id:
         return redirect(url_for('userLogin'))
 
     if request.method == 'POST':
         ValidateNonce()
 
+        price = GetSubmittedPrice()
+        old_price = editedProduct.price
         if request.form['name']:
             editedProduct.name = request.form['name']
             editedProduct.description = request.form['description']
-            editedProduct.price = request.form['price']
-        session.add(editedProduct)
+            editedProduct.price = price
+        if not FlushUnique(editedProduct, 'A product named %s is already '
+                                          'in this category.' %
+                                          request.form['name']):
+            return render_template('edit_product.html',
+                                   editedProduct=editedProduct,
+                                   user=GetUserInfo(
+                                       GetUserIDFromLoginSession()),
+                                   csrf_token=GenerateNonce())
+        ProductPriceChanged(session,
+                            editedProduct.category_id,
+                            old_price,
+                            editedProduct.price)
+        ProductsChanged(editedProduct.category_id, editedProduct.id)
         session.commit()
         return redirect(url_for('productListing',
                                 category_id=editedProduct.category_id))
     else:
         return render_template('edit_product.html',
-                               categories=GetAllCategories(),
                                editedProduct=editedProduct,
                                user=GetUserInfo(GetUserIDFromLoginSession()),
                                csrf_token=GenerateNonce())
@@ -687,25 +1436,154 @@ def deleteProduct(category_id, product_id):
     """
     deletedProduct = GetSingleProduct(product_id)
 
-    if login_session['user_id'] != deletedProduct.user.id:
+    if login_session['user_id'] != deletedProduct.user_id:
         return redirect(url_for('userLogin'))
 
     if request.method == 'POST':
         ValidateNonce()
 
         session.delete(deletedProduct)
+        ProductRemoved(session,
+                       deletedProduct.category_id,
+                       deletedProduct.price)
+        ProductsChanged(deletedProduct.category_id, deletedProduct.id)
         session.commit()
         return redirect(url_for('productListing',
                                 category_id=category_id))
     else:
         return render_template('delete_product.html',
-                               categories=GetAllCategories(),
                                category_id=category_id,
                                deletedProduct=deletedProduct,
                                user=GetUserInfo(GetUserIDFromLoginSession()),
                                csrf_token=GenerateNonce())
 
 
+@app.route('/catalog/import/',
+           methods=['GET', 'POST'])
+@LoginRequired
+def importProducts():
+    """ Bulk import products from a CSV or NDJSON file. Supports GET and POST.
+
+    The file is posted as 'file'. Its format is taken from the 'format'
+    field, or guessed from the file name. If the 'background' field is set,
+    the file is imported by a background job instead.
+
+    Returns:
+        GET: the Import Products form.
+        POST: a JSON response with the number of products imported and the
+              line number and reason of every record that was skipped, or
+              the queued job.
+    """
+    if request.method == 'POST':
+        ValidateNonce()
+
+        upload = request.files.get('file')
+        if upload is None:
+            abort(400)
+        file_format = request.form.get('format')
+        if not file_format:
+            if upload.filename.endswith('.csv'):
+                file_format = 'csv'
+            else:
+                file_format = 'ndjson'
+        if file_format not in READERS:
+            abort(400)
+
+        if request.form.get('background'):
+            if not os.path.isdir(JOB_DIR):
+                os.makedirs(JOB_DIR)
+            handle, path = tempfile.mkstemp(prefix='upload-',
+                                            suffix='.' + file_format,
+                                            dir=JOB_DIR)
+            os.close(handle)
+            upload.save(path)
+            job = EnqueueJob(session, 'import_products',
+                             {'path': path, 'format': file_format},
+                             login_session['user_id'])
+            session.commit()
+            return JobResponse(job)
+
+        result = ImportProducts(session,
+                                READERS[file_format](upload.stream),
+                                login_session['user_id'])
+        if result.imported:
+            ScheduleSnapshot()
+            session.commit()
+        return jsonify(imported=result.imported,
+                       errors=[{'line': error.line, 'error': error.message}
+                               for error in result.errors])
+    else:
+        return render_template('import_products.html',
+                               user=GetUserInfo(GetUserIDFromLoginSession()),
+                               csrf_token=GenerateNonce())
+
+
+# Search Routing Methods ------------------------------------------------------
+
+
+def GetSearchResults(external=False):
+    """ Run the product search described by the query string.
+
+    The query string holds the search text in q, and optionally a
+    category_id to search in, and limit and offset to page through the
+    results.
+
+    Args:
+        external: if True the next page URL is absolute.
+    Returns:
+        rows: a list of tuples in the order of SEARCH_FIELDS.
+        next_url: the URL of the next page of results, None on the last
+                  page.
+    """
+    limit = request.args.get('limit', DEFAULT_SEARCH_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    rows = SearchProducts(session,
+                          request.args.get('q'),
+                          category_id=request.args.get('category_id',
+                                                       type=int),
+                          limit=limit,
+                          offset=offset)
+
+    next_url = None
+    if len(rows) == limit:
+        args = request.args.to_dict()
+        args['offset'] = offset + limit
+        next_url = url_for(request.endpoint, _external=external, **args)
+    return rows, next_url
+
+
+@app.route('/catalog/search/')
+def searchProducts():
+    """ Search the names and descriptions of all products.
+
+    Returns:
+        A page with the best matching products first.
+    """
+    rows, next_url = GetSearchResults()
+    return render_template('search_results.html',
+                           terms=request.args.get('q', ''),
+                           products=rows,
+                           next_url=next_url,
+                           user=GetUserInfo(GetUserIDFromLoginSession()))
+
+
+@app.route('/catalog/search/json/')
+@ConditionalGet()
+def searchProductsJSON():
+    """ API endpoint for JSON GET request - Product Search.
+
+    Returns:
+        A JSON response containing the best matching products first.
+    """
+    rows, next_url = GetSearchResults(external=True)
+    products = [dict(zip(SEARCH_FIELDS, row)) for row in rows]
+    if next_url is None:
+        return jsonify(Product=products)
+    return AddNextPageLink(jsonify(Product=products, next=next_url),
+                           next_url)
+
+
 # API Routing Methods ---------------------------------------------------------
 
 
@@ -720,82 +1598,328 @@ def apiList():
 
 
 @app.route('/catalog/allcategories/json/')
+@ConditionalGet()
 def allCategoriesJSON():
     """ API endpoint for JSON GET request - All Categories.
 
+    Served from the export snapshot when it is up to date.
+
     Returns:
         A JSON response containing all categories in the catalog.
     """
+    if IsSnapshotRequest():
+        response = SnapshotResponse('categories.json')
+        if response is not None:
+            return response
+
     categories = GetAllCategories()
     return jsonify(Category=[category.serialize for category in categories])
 
 
 @app.route('/catalog/allProducts/json/')
+@ConditionalGet()
 def allProductsJSON():
     """ API endpoint for JSON GET request - All Products.
 
+    The response is streamed as the rows are read, so memory use stays flat
+    however large the catalog is. min_price, max_price, category_id (may be
+    repeated) and sort ('id', 'name', 'price' or '-price') filter and sort
+    the products. Pass format=ndjson to get one product per
+    line instead of a single JSON document. Pass limit and/or after to get
+    a single page, with a link to the next one. Without filters or paging
+    the products are served from the export snapshot when it is up to date.
+
     Returns:
         A JSON response containing all products in the catalog.
     """
-    products = GetAllProducts(0)
-    return jsonify(Product=[product.serialize for product in products])
+    if IsSnapshotRequest('format'):
+        if request.args.get('format') == 'ndjson':
+            response = SnapshotResponse('products.ndjson')
+        else:
+            response = SnapshotResponse('products.json')
+        if response is not None:
+            return response
 
+    filters = GetProductFilters('id')
+    next_url = None
+    if IsPagedRequest():
+        limit, after = GetPageArgs(DEFAULT_API_PAGE_SIZE, MAX_API_PAGE_SIZE)
+        try:
+            page = GetProductPage(session, after, limit, filters)
+        except ValueError:
+            abort(400)
+        rows = page.rows
+        next_url = GetNextPageURL(page.next_cursor, external=True)
+    else:
+        rows = GetProductRows(session, filters)
 
-@app.route('/catalog/allcategories/xml/')
-def allCategoriesXML():
-    """ API endpoint for XML GET request - All Categories.
+    if request.args.get('format') == 'ndjson':
+        response = Response(stream_with_context(StreamNDJSON(PRODUCT_FIELDS,
+                                                             rows)),
+                            mimetype='application/x-ndjson')
+    else:
+        response = Response(stream_with_context(StreamJSON('Product',
+                                                           PRODUCT_FIELDS,
+                                                           rows,
+                                                           next_url=next_url)),
+                            mimetype='application/json')
+    return AddNextPageLink(response, next_url)
+
+
+@app.route('/catalog/facets/json/')
+@ConditionalGet()
+def categoryFacetsJSON():
+    """ API endpoint for JSON GET request - Category Facets.
+
+    The counts and prices come from the precomputed category stats, so no
+    product is read. Pass category_id, which may be repeated, to get only
+    some categories.
 
     Returns:
-        An XML response containing all categories in the catalog.
+        A JSON response containing the product count and the lowest,
+        highest and average price of each category.
     """
-    top = Element('catalog')
+    stats = GetCategoryStats(session, GetCategoryIDs())
+    return jsonify(CategoryStats=[row.serialize for row in stats])
 
-    categories = GetAllCategories()
 
-    for category in categories:
-        category_root = SubElement(top, 'category')
+@app.route('/catalog/allcategories/xml/')
+@ConditionalGet()
+def allCategoriesXML():
+    """ API endpoint for XML GET request - All Categories.
 
-        category_root_id = SubElement(category_root, 'id')
-        category_root_id.text = str(category.id)
+    Served from the export snapshot when it is up to date.
 
-        category_root_name = SubElement(category_root, 'name')
-        category_root_name.text = str(category.name)
+    Returns:
+        An XML response containing all categories in the catalog.
+    """
+    if IsSnapshotRequest():
+        response = SnapshotResponse('categories.xml')
+        if response is not None:
+            return response
 
-    return render_template('xml_response.xml',
-                           xml_string=tostring(top))
+    rows = ((category.id, category.name) for category in GetAllCategories())
+    return Response(StreamXML('catalog', 'category', ('id', 'name'), rows),
+                    mimetype='application/xml')
 
 
 @app.route('/catalog/allProducts/xml/')
+@ConditionalGet()
 def allProductsXML():
     """ API endpoint for XML GET request - All Products.
 
+    The response is streamed as the rows are read, so memory use stays flat
+    however large the catalog is. min_price, max_price, category_id (may be
+    repeated) and sort ('id', 'name', 'price' or '-price') filter and sort
+    the products. Pass limit and/or after to get a single
+    page, with a link to the next one. Without filters or paging the
+    products are served from the export snapshot when it is up to date.
+
     Returns:
         An XML response containing all products in the catalog.
     """
-    top = Element('catalog')
+    if IsSnapshotRequest():
+        response = SnapshotResponse('products.xml')
+        if response is not None:
+            return response
 
-    products = GetAllProducts(0)
+    filters = GetProductFilters('id')
+    next_url = None
+    if IsPagedRequest():
+        limit, after = GetPageArgs(DEFAULT_API_PAGE_SIZE, MAX_API_PAGE_SIZE)
+        try:
+            page = GetProductPage(session, after, limit, filters)
+        except ValueError:
+            abort(400)
+        rows = page.rows
+        next_url = GetNextPageURL(page.next_cursor, external=True)
+    else:
+        rows = GetProductRows(session, filters)
 
-    for product in products:
-        product_root = SubElement(top, 'product')
+    response = Response(stream_with_context(StreamXML('catalog',
+                                                      'product',
+                                                      PRODUCT_FIELDS,
+                                                      rows,
+                                                      next_url=next_url)),
+                        mimetype='application/xml')
+    return AddNextPageLink(response, next_url)
 
-        product_root_id = SubElement(product_root, 'id')
-        product_root_id.text = str(product.id)
 
-        product_root_name = SubElement(product_root, 'name')
-        product_root_name.text = str(product.name)
+@app.route('/catalog/allProducts/<any(json, ndjson, xml):export_format>/'
+           'export/')
+def exportProducts(export_format):
+    """ Pre-generate a full product export. Supports GET.
 
-        product_root_desc = SubElement(product_root, 'description')
-        product_root_desc.text = str(product.description)
+    The export is written to a file by a background job, so that a large
+    catalog doesn't hold up a web worker. It takes the same min_price,
+    max_price, category_id and sort arguments as allProductsJSON. An export
+    is made once per version of the catalog and arguments, and shared by
+    everyone who asks for it.
 
-        product_root_price = SubElement(product_root, 'price')
-        product_root_price.text = str(product.price)
+    Args:
+        export_format: 'json', 'ndjson' or 'xml'.
+    Returns:
+        A redirect to the file if it is ready, otherwise a 202 JSON response
+        containing the export job.
+    """
+    filters = GetProductFilters('id')
+    # Only the parsed filters go into the job, so that other query string
+    # arguments, or the same filters spelled differently, share its export.
+    params = {'format': export_format,
+              'filters': filters._replace(
+                  category_ids=sorted(set(filters.category_ids)))._asdict(),
+              'version': GetVersion(session, CATALOG_VERSION)}
+    job = FindJob(session, 'export', params)
+    if job is not None and job.status == 'done' and \
+            os.path.exists(job.result_path):
+        return redirect(url_for('downloadJobResult', job_id=job.id))
+    if job is None or job.status in ('done', 'failed'):
+        job = EnqueueJob(session, 'export', params)
+        session.commit()
+    return JobResponse(job)
+
+
+# Job Routing Methods ---------------------------------------------------------
+
+
+def GetJob(job_id):
+    """ Get a job the current user may see.
+
+    Jobs that belong to a user are only shown to that user. Others, such as
+    exports, are shown to anyone.
+
+    Args:
+        job_id: the ID of the job to get.
+    Returns:
+        job: a Job object. Aborts with 404 if there is none.
+    """
+    job = session.query(Job).filter_by(id=job_id).first()
+    if job is None or (job.user_id is not None and
+                       job.user_id != login_session.get('user_id')):
+        abort(404)
+    return job
 
-        product_root_categoryid = SubElement(product_root, 'category_id')
-        product_root_categoryid.text = str(product.category.id)
 
-    return render_template('xml_response.xml',
-                           xml_string=tostring(top))
+def SerializeJob(job):
+    """ Get a job for JSON, with the URLs of its status and result.
+
+    Args:
+        job: the Job object.
+    Returns:
+        serialized: a dict.
+    """
+    serialized = job.serialize
+    serialized['status_url'] = url_for('jobStatusJSON', job_id=job.id,
+                                       _external=True)
+    if job.status == 'done' and job.result_path:
+        serialized['download_url'] = url_for('downloadJobResult',
+                                             job_id=job.id, _external=True)
+    return serialized
+
+
+def JobResponse(job):
+    """ Respond that a job was accepted and hasn't finished yet.
+
+    Args:
+        job: the queued or running Job.
+    Returns:
+        A 202 JSON response containing the job, with its status URL in the
+        Location header.
+    """
+    response = jsonify(Job=SerializeJob(job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('jobStatusJSON', job_id=job.id,
+                                           _external=True)
+    response.headers['Retry-After'] = '2'
+    return response
+
+
+@app.route('/jobs/<int:job_id>/json/')
+def jobStatusJSON(job_id):
+    """ API endpoint for JSON GET request - Job Status.
+
+    Args:
+        job_id: the ID of the job.
+    Returns:
+        A JSON response containing the job's status, progress and error,
+        and the URL of its result once it is done.
+    """
+    return jsonify(Job=SerializeJob(GetJob(job_id)))
+
+
+@app.route('/jobs/<int:job_id>/download/')
+def downloadJobResult(job_id):
+    """ Download the file a job made.
+
+    Args:
+        job_id: the ID of the job.
+    Returns:
+        The file, which supports conditional and range requests. 404 if the
+        job hasn't finished or its file has been pruned.
+    """
+    job = GetJob(job_id)
+    if job.status != 'done' or not job.result_path or \
+            not os.path.exists(job.result_path):
+        abort(404)
+    mimetype = 'application/json'
+    if job.kind == 'export':
+        mimetype = EXPORT_FORMATS[json.loads(job.params)['format']][1]
+    return send_file(job.result_path,
+                     mimetype=mimetype,
+                     as_attachment=True,
+                     attachment_filename=os.path.basename(job.result_path),
+                     conditional=True)
+
+
+# Admin Routing Methods -------------------------------------------------------
+
+
+@app.route('/admin/cache/json/')
+@AdminEndpoint
+def responseCacheJSON():
+    """ API endpoint for JSON GET request - Response Cache Statistics.
+
+    Only available when ITEMCATALOG_ADMIN_ENDPOINTS is set.
+
+    Returns:
+        A JSON response containing the hit and miss counts of the response
+        cache of this process.
+    """
+    return jsonify(ResponseCache=response_cache.stats())
+
+
+@app.route('/admin/profile/json/')
+@AdminEndpoint
+def requestProfileJSON():
+    """ API endpoint for JSON GET request - Request Timings.
+
+    Only available when profiling and ITEMCATALOG_ADMIN_ENDPOINTS are
+    enabled.
+
+    Returns:
+        A JSON response containing the rolling latency histogram of each
+        endpoint served by this process, and the slow requests whose
+        profiles were kept.
+    """
+    if not profiler.enabled:
+        abort(404)
+    return jsonify(Profile=profiler.stats())
+
+
+@app.route('/metrics')
+@AdminEndpoint
+def metrics():
+    """ Metrics of this process in the Prometheus text format.
+
+    Only available when ITEMCATALOG_ADMIN_ENDPOINTS is set.
+
+    Returns:
+        Request counts and latencies per endpoint, requests in progress, db
+        pool checkouts and waits, SQL statement counts, login provider call
+        latencies and response cache hits.
+    """
+    return Response(registry.render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 # -----------------------------------------------------------------------------
@@ -804,4 +1928,4 @@ def allProductsXML():
 if __name__ == '__main__':
     app.secret_key = 'super_secret_key'
     app.debug = True
-    app.run(host="0.0.0.0", port=5000)
+    app.run(host="0.0.0.0", port=5000, threaded=True)
@@ -0,0 +1,199 @@
+from bisect import bisect_left
+import threading
+
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+# Once this many threads have written metrics, the counts of the threads
+# that have exited are folded together.
+MAX_SHARDS = 64
+
+
+class MetricsRegistry(object):
+    """ Counters and histograms in the Prometheus text format.
+
+    Every thread writes to its own shard, a plain dict only that thread
+    changes, so recording a value takes no lock. The shards are only summed
+    when the metrics are scraped.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._shards = []
+        self._retired = {}
+
+    def declare(self, name, kind, description, buckets=DEFAULT_BUCKETS,
+                callback=None):
+        """ Describe a metric so that it is exposed.
+
+        Args:
+            name: the metric name.
+            kind: 'counter', 'gauge' or 'histogram'.
+            description: the help text.
+            buckets: the bucket upper bounds of a histogram.
+            callback: for values read when scraped rather than recorded, a
+                      function returning a list of (labels, value) tuples.
+        """
+        self._metrics[name] = (kind, description, tuple(buckets), callback)
+
+    # Recording.
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                if len(self._shards) >= MAX_SHARDS:
+                    self._retire_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def inc(self, name, labels=(), value=1):
+        """ Add to a counter.
+
+        Args:
+            name: the metric name.
+            labels: a tuple of (label, value) pairs.
+            value: the amount to add.
+        """
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        """ Record a value in a histogram.
+
+        Args:
+            name: the metric name.
+            value: the value, in seconds for latencies.
+            labels: a tuple of (label, value) pairs.
+        """
+        buckets = self._metrics[name][2]
+        shard = self._shard()
+        key = (name, labels)
+        counts = shard.get(key)
+        if counts is None:
+            # One count per bucket, one for +Inf, then the sum.
+            counts = shard[key] = [0] * (len(buckets) + 1) + [0.0]
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+    # Collecting.
+
+    def _retire_shards(self):
+        # The threads of retired shards have exited, so nothing changes
+        # them any more. Called with the lock held.
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                Merge(self._retired, shard)
+        self._shards = live
+
+    def collect(self):
+        """ Sum the shards of every thread.
+
+        Returns:
+            totals: a dict of (name, labels) to a count, or to a list of
+                    bucket counts and a sum for histograms.
+        """
+        with self._lock:
+            self._retire_shards()
+            totals = {}
+            Merge(totals, self._retired)
+            for thread, shard in self._shards:
+                Merge(totals, shard.copy())
+        return totals
+
+    def total(self, name, totals=None):
+        """ Sum a counter over all its labels.
+
+        Args:
+            name: the metric name.
+            totals: the result of collect(), collected again if not given.
+        Returns:
+            total: the sum.
+        """
+        if totals is None:
+            totals = self.collect()
+        return sum(value for (key_name, labels), value in totals.items()
+                   if key_name == name)
+
+    def render(self):
+        """ Format every declared metric in the Prometheus text format.
+
+        Returns:
+            text: the exposition text.
+        """
+        totals = self.collect()
+        by_name = {}
+        for (name, labels), value in totals.items():
+            by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name in sorted(self._metrics):
+            kind, description, buckets, callback = self._metrics[name]
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            if callback is not None:
+                values = callback()
+            else:
+                values = by_name.get(name, [])
+            for labels, value in sorted(values):
+                if kind != 'histogram':
+                    lines.append('%s%s %s' % (name, FormatLabels(labels),
+                                              FormatValue(value)))
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value):
+                    cumulative += count
+                    le = (('le', bound if bound == '+Inf' else repr(bound)),)
+                    lines.append('%s_bucket%s %d' % (
+                        name, FormatLabels(labels + le), cumulative))
+                lines.append('%s_sum%s %s' % (name, FormatLabels(labels),
+                                              FormatValue(value[-1])))
+                lines.append('%s_count%s %d' % (name, FormatLabels(labels),
+                                                cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+# Format Helper Methods -------------------------------------------------------
+
+
+def Merge(totals, shard):
+    """ Add the values of one shard to a dict of totals. """
+    for key, value in shard.items():
+        if isinstance(value, list):
+            current = totals.get(key)
+            if current is None:
+                totals[key] = list(value)
+            else:
+                totals[key] = [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def FormatLabels(labels):
+    """ Format (label, value) pairs as a Prometheus label set. """
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (label, ('%s' % (value,)).replace('\\', '\\\\').
+                     replace('"', '\\"').replace('\n', '\\n'))
+        for label, value in labels)
+
+
+def FormatValue(value):
+    """ Format a sample value. """
+    if isinstance(value, float):
+        return repr(value)
+    return '%d' % value
+
+
+# The registry shared by the whole process.
+registry = MetricsRegistry()
@@ -0,0 +1,39 @@
+import os
+import threading
+
+
+class ProcessLocal(object):
+    """ A value made on first use, once in every process that uses it.
+
+    Threads don't survive a fork. A thread or pool started at import, in a
+    parent that then forks the web workers, would leave each worker with a
+    copy that no thread is running. Background threads and pools are
+    therefore made the first time a request needs them, in the worker
+    process itself, and made again if that process forks.
+    """
+
+    def __init__(self, create):
+        """ Create a value that is made on first use.
+
+        Args:
+            create: a function that makes the value.
+        """
+        self._create = create
+        self._lock = threading.Lock()
+        self._value = None
+        self._pid = None
+
+    def get(self):
+        """ Get the value, making it if this process hasn't yet.
+
+        Returns:
+            value: what create returned in this process.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._value
+        with self._lock:
+            if self._pid != pid:
+                self._value = self._create()
+                self._pid = pid
+            return self._value
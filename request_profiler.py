@@ -0,0 +1,260 @@
+from collections import deque
+from timeit import default_timer
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+
+from flask import before_render_template, template_rendered, g, request
+from sqlalchemy import event
+
+
+# Profiling is off unless asked for, so production requests pay nothing.
+PROFILE_ENABLED = os.environ.get('ITEMCATALOG_PROFILE', '') in ('1', 'true')
+
+# The number of recent requests per endpoint the histograms are built from.
+PROFILE_WINDOW = int(os.environ.get('ITEMCATALOG_PROFILE_WINDOW', 1000))
+
+# The fraction of requests run under cProfile, and how slow, in
+# milliseconds, one of those must be for its profile to be kept.
+PROFILE_SAMPLE_RATE = float(os.environ.get('ITEMCATALOG_PROFILE_SAMPLE_RATE',
+                                           0))
+PROFILE_SLOW_MS = float(os.environ.get('ITEMCATALOG_PROFILE_SLOW_MS', 500))
+
+# Where kept profiles are written, as pstats files.
+PROFILE_DIR = os.environ.get('ITEMCATALOG_PROFILE_DIR',
+                             os.path.join(tempfile.gettempdir(),
+                                          'itemcatalog-profiles'))
+
+# The number of kept profiles listed by the admin endpoint.
+PROFILE_CAPTURES = 20
+
+# Upper bounds, in milliseconds, of the histogram buckets.
+HISTOGRAM_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+log = logging.getLogger('itemcatalog.profile')
+
+
+class RequestTimings(object):
+    """ What one request spent its time on. """
+
+    def __init__(self):
+        self.start = default_timer()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self.render_start = None
+        self.profile = None
+
+    def server_timing(self, wall_time):
+        """ Format the timings as a Server-Timing header value.
+
+        Args:
+            wall_time: the seconds the request took.
+        Returns:
+            header: the header value, durations in milliseconds.
+        """
+        return ('app;dur=%.1f, db;dur=%.1f;desc="%d queries", '
+                'render;dur=%.1f' % (wall_time * 1000,
+                                     self.sql_time * 1000,
+                                     self.sql_count,
+                                     self.render_time * 1000))
+
+
+class RollingHistogram(object):
+    """ The timings of an endpoint's most recent requests. """
+
+    def __init__(self, window=PROFILE_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def add(self, wall_ms, sql_count, sql_ms, render_ms):
+        self._samples.append((wall_ms, sql_count, sql_ms, render_ms))
+
+    def stats(self):
+        """ Summarize the window.
+
+        Returns:
+            stats: a dict of percentiles, means and bucket counts.
+        """
+        samples = list(self._samples)
+        count = len(samples)
+        walls = sorted(sample[0] for sample in samples)
+        buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for wall_ms in walls:
+            for i, bound in enumerate(HISTOGRAM_BUCKETS):
+                if wall_ms <= bound:
+                    buckets[i] += 1
+                    break
+            else:
+                buckets[-1] += 1
+
+        def Percentile(percent):
+            return walls[min(count - 1, int(count * percent / 100.0))]
+
+        return {'count': count,
+                'p50_ms': Percentile(50),
+                'p95_ms': Percentile(95),
+                'p99_ms': Percentile(99),
+                'sql_count': sum(s[1] for s in samples) / float(count),
+                'sql_ms': sum(s[2] for s in samples) / count,
+                'render_ms': sum(s[3] for s in samples) / count,
+                'buckets': dict(zip([str(bound)
+                                     for bound in HISTOGRAM_BUCKETS] +
+                                    ['+Inf'], buckets))}
+
+
+class RequestProfiler(object):
+    """ Opt-in timing of every request, its SQL statements and templates.
+
+    Each request gets a Server-Timing header and a JSON log line, and its
+    timings are added to a per-endpoint rolling histogram. A sample of
+    requests also runs under cProfile, and the profiles of the slow ones are
+    written to PROFILE_DIR.
+
+    Streamed responses are timed up to the point their body starts, which
+    is when after_request runs.
+    """
+
+    def __init__(self, app, engines, enabled=PROFILE_ENABLED,
+                 sample_rate=PROFILE_SAMPLE_RATE, slow_ms=PROFILE_SLOW_MS,
+                 profile_dir=PROFILE_DIR):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.profile_dir = profile_dir
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._captures = deque(maxlen=PROFILE_CAPTURES)
+        if not enabled:
+            return
+
+        app.before_request(self.start_request)
+        app.after_request(self.end_request)
+        app.teardown_request(self.stop_profile)
+        before_render_template.connect(self.start_render, app)
+        template_rendered.connect(self.end_render, app)
+        for engine in set(engines):
+            event.listen(engine, 'before_cursor_execute', self.start_query)
+            event.listen(engine, 'after_cursor_execute', self.end_query)
+            event.listen(engine, 'handle_error', self.failed_query)
+
+    # Flask and SQLAlchemy hooks.
+
+    def start_request(self):
+        g.request_timings = timings = RequestTimings()
+        if self.sample_rate and random.random() < self.sample_rate:
+            timings.profile = cProfile.Profile()
+            timings.profile.enable()
+
+    def end_request(self, response):
+        timings = g.get('request_timings')
+        if timings is None:
+            return response
+        wall_time = default_timer() - timings.start
+        if timings.profile is not None:
+            timings.profile.disable()
+            if wall_time * 1000 >= self.slow_ms:
+                self.keep_profile(timings.profile, wall_time)
+
+        response.headers['Server-Timing'] = timings.server_timing(wall_time)
+        endpoint = request.endpoint or 'unknown'
+        wall_ms = wall_time * 1000
+        sql_ms = timings.sql_time * 1000
+        render_ms = timings.render_time * 1000
+        log.info(json.dumps({'endpoint': endpoint,
+                             'method': request.method,
+                             'path': request.path,
+                             'status': response.status_code,
+                             'wall_ms': round(wall_ms, 2),
+                             'sql_count': timings.sql_count,
+                             'sql_ms': round(sql_ms, 2),
+                             'render_ms': round(render_ms, 2)},
+                            sort_keys=True))
+        with self._lock:
+            histogram = self._histograms.get(endpoint)
+            if histogram is None:
+                histogram = self._histograms[endpoint] = RollingHistogram()
+            histogram.add(wall_ms, timings.sql_count, sql_ms, render_ms)
+        return response
+
+    def stop_profile(self, exception=None):
+        # A request that raised never reached end_request, and its thread
+        # must not stay profiled.
+        timings = g.get('request_timings')
+        if timings is not None and timings.profile is not None:
+            timings.profile.disable()
+
+    def start_render(self, sender, template, context, **extra):
+        timings = g.get('request_timings')
+        if timings is not None:
+            timings.render_start = default_timer()
+
+    def end_render(self, sender, template, context, **extra):
+        timings = g.get('request_timings')
+        if timings is not None and timings.render_start is not None:
+            timings.render_time += default_timer() - timings.render_start
+            timings.render_start = None
+
+    def start_query(self, conn, cursor, statement, parameters, context,
+                    executemany):
+        conn.info.setdefault('query_start', []).append(default_timer())
+
+    def end_query(self, conn, cursor, statement, parameters, context,
+                  executemany):
+        self.add_query(conn.info['query_start'].pop())
+
+    def failed_query(self, context):
+        # after_cursor_execute is not called for a statement that raised, so
+        # its start is popped here, or it would stay on the connection's
+        # stack for as long as the pool keeps the connection.
+        if context.connection is None:
+            return
+        starts = context.connection.info.get('query_start')
+        if starts:
+            self.add_query(starts.pop())
+
+    def add_query(self, start):
+        timings = g.get('request_timings') if g else None
+        if timings is not None:
+            timings.sql_count += 1
+            timings.sql_time += default_timer() - start
+
+    # Captured profiles.
+
+    def keep_profile(self, profile, wall_time):
+        """ Write a slow request's profile to the profile directory.
+
+        Args:
+            profile: the disabled cProfile.Profile.
+            wall_time: the seconds the request took.
+        """
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        path = os.path.join(self.profile_dir, '%s-%d-%d.prof'
+                            % (request.endpoint or 'unknown',
+                               time.time() * 1000,
+                               threading.current_thread().ident))
+        stats = pstats.Stats(profile)
+        stats.dump_stats(path)
+        with self._lock:
+            self._captures.append({'endpoint': request.endpoint,
+                                   'path': request.path,
+                                   'wall_ms': round(wall_time * 1000, 2),
+                                   'profile': path})
+
+    def stats(self):
+        """ Get the histograms of every endpoint and the kept profiles.
+
+        Returns:
+            stats: a dict for JSON.
+        """
+        with self._lock:
+            return {'endpoints': dict((endpoint, histogram.stats())
+                                      for endpoint, histogram
+                                      in self._histograms.items()),
+                    'slow_profiles': list(self._captures)}
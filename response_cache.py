@@ -0,0 +1,221 @@
+from collections import OrderedDict
+import errno
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+import threading
+
+
+# Which backend to store cached pages in: 'memory' keeps them in each
+# process, 'disk' shares them between all processes on the machine.
+RESPONSE_CACHE_BACKEND = os.environ.get('ITEMCATALOG_RESPONSE_CACHE',
+                                        'memory')
+
+# The number of pages kept before the least recently used are dropped.
+RESPONSE_CACHE_SIZE = int(os.environ.get('ITEMCATALOG_RESPONSE_CACHE_SIZE',
+                                         1000))
+
+# Where the disk backend keeps its files. The default is per user, as the
+# directory may only be used by the user the app runs as.
+RESPONSE_CACHE_DIR = os.environ.get('ITEMCATALOG_RESPONSE_CACHE_DIR',
+                                    os.path.join(tempfile.gettempdir(),
+                                                 'itemcatalog-pages-%d' %
+                                                 os.getuid()))
+
+
+def MakePrivateDirectory(directory):
+    """ Create a directory only this user can open, or check that it is one.
+
+    Cached pages are unpickled and compiled templates are run, so anyone
+    who can write to a cache directory can run code in the app.
+
+    Args:
+        directory: the path of the directory.
+    Raises:
+        RuntimeError: if the path is not a directory of this user, or other
+                      users have access to it.
+    """
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    info = os.lstat(directory)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or
+            info.st_mode & 0o077):
+        raise RuntimeError('%s must be a directory owned by this user that '
+                           'no other user has access to.' % directory)
+
+
+class MemoryBackend(object):
+    """ An in-process LRU store. """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DiskBackend(object):
+    """ A store of one file per page, shared by every process. """
+
+    # How many writes to allow between scans for files to prune.
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, directory=RESPONSE_CACHE_DIR,
+                 max_entries=RESPONSE_CACHE_SIZE):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        MakePrivateDirectory(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+                            hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, value):
+        # Write to a temporary file first so that readers never see a
+        # partially written page.
+        handle, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, self._path(key))
+
+        self._writes += 1
+        if self._writes % self.PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def prune(self):
+        """ Delete the oldest files beyond max_entries. """
+        paths = [os.path.join(self.directory, name)
+                 for name in os.listdir(self.directory)]
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=lambda path: os.path.getmtime(path))
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+class ResponseCache(object):
+    """ A cache of rendered pages.
+
+    Keys are built from the route, its arguments and the values of the
+    change counters the page depends on, so a page drops out of the cache
+    as soon as anything it shows changes, in every process.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, endpoint, view_args, query_string, versions):
+        """ Build the cache key of a page.
+
+        Args:
+            endpoint: the route's endpoint name.
+            view_args: the route's URL arguments.
+            query_string: the raw query string of the request.
+            versions: a dict of the change counters the page depends on.
+        Returns:
+            key: a string.
+        """
+        if isinstance(query_string, bytes):
+            query_string = query_string.decode('latin-1')
+        return '%s|%s|%s|%s' % (
+            endpoint,
+            ','.join('%s=%s' % item for item in sorted(view_args.items())),
+            query_string,
+            ','.join('%s=%s' % item for item in sorted(versions.items())))
+
+    def get(self, key):
+        """ Get a cached page.
+
+        Args:
+            key: the page's cache key.
+        Returns:
+            page: a (status, headers, body) tuple, None if not cached.
+        """
+        page = self.backend.get(key)
+        with self._lock:
+            if page is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return page
+
+    def set(self, key, status, headers, body):
+        """ Store a rendered page.
+
+        Args:
+            key: the page's cache key.
+            status: the HTTP status code.
+            headers: a list of (name, value) header tuples.
+            body: the response body.
+        """
+        self.backend.set(key, (status, headers, body))
+
+    def stats(self):
+        """ Get the hit and miss counts of the cache.
+
+        Returns:
+            stats: a dict of hits, misses and hit_ratio.
+        """
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {'backend': type(self.backend).__name__,
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': float(hits) / total if total else 0.0}
+
+
+def CreateResponseCache(backend=RESPONSE_CACHE_BACKEND):
+    """ Create a response cache using the configured backend.
+
+    Args:
+        backend: 'memory' or 'disk'.
+    Returns:
+        cache: a ResponseCache.
+    """
+    if backend == 'disk':
+        return ResponseCache(DiskBackend())
+    return ResponseCache(MemoryBackend())
@@ -0,0 +1,259 @@
+from collections import OrderedDict
+import binascii
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from process_local import ProcessLocal
+
+
+# Which backend to keep sessions in: 'memory' keeps them in each process,
+# 'sqlite' shares them between all processes on the machine.
+SESSION_BACKEND = os.environ.get('ITEMCATALOG_SESSION_BACKEND', 'sqlite')
+
+# The SQLite file the 'sqlite' backend keeps sessions in.
+SESSION_DATABASE = os.environ.get('ITEMCATALOG_SESSION_DATABASE',
+                                  'sessions.db')
+
+# The number of sessions the 'memory' backend keeps before dropping the
+# least recently used.
+SESSION_CACHE_SIZE = int(os.environ.get('ITEMCATALOG_SESSION_CACHE_SIZE',
+                                        10000))
+
+# Seconds a session lives after it was last used.
+SESSION_LIFETIME = int(os.environ.get('ITEMCATALOG_SESSION_LIFETIME',
+                                      7 * 24 * 3600))
+
+# Seconds between background sweeps for expired sessions.
+SESSION_SWEEP_INTERVAL = int(os.environ.get(
+    'ITEMCATALOG_SESSION_SWEEP_INTERVAL', 300))
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """ Session data kept on the server, found by the ID in the cookie. """
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.new = sid is None
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """ Move the data to a new session ID.
+
+        Called on login, so that an ID someone learned before the login
+        can't be used to act as the logged in user.
+        """
+        if self.sid is not None:
+            self.replaced_sid = self.sid
+            self.sid = None
+        self.modified = True
+
+
+class MemoryBackend(object):
+    """ An in-process LRU store. """
+
+    def __init__(self, max_entries=SESSION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.pop(sid, None)
+            if entry is None or entry[1] <= time.time():
+                return None
+            self._entries[sid] = entry
+        return dict(entry[0]), entry[1]
+
+    def set(self, sid, data, expires):
+        with self._lock:
+            self._entries.pop(sid, None)
+            self._entries[sid] = (dict(data), expires)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def sweep(self, now):
+        with self._lock:
+            expired = [sid for sid, (data, expires) in self._entries.items()
+                       if expires <= now]
+            for sid in expired:
+                del self._entries[sid]
+        return len(expired)
+
+
+class SqliteBackend(object):
+    """ A store in a SQLite file, shared by every process. """
+
+    def __init__(self, path=SESSION_DATABASE):
+        self.path = path
+        self._local = threading.local()
+        # The backend is created when the app is imported, often before the
+        # server forks its workers, so the schema is created with a
+        # connection that is closed straight away rather than inherited.
+        connection = self._open()
+        try:
+            with connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS session ('
+                                   'sid TEXT PRIMARY KEY, '
+                                   'data BLOB NOT NULL, '
+                                   'expires REAL NOT NULL)')
+                connection.execute('CREATE INDEX IF NOT EXISTS '
+                                   'ix_session_expires ON session (expires)')
+        finally:
+            connection.close()
+
+    def _open(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _connect(self):
+        # sqlite3 connections may not be shared between threads or
+        # processes, so each thread opens its own on first use and keeps
+        # it. A forked child inherits the thread-local of the thread that
+        # forked, so a connection opened in another process is replaced,
+        # and left for that process to close.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = self._open()
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, sid):
+        row = self._connect().execute(
+            'SELECT data, expires FROM session WHERE sid = ? AND expires > ?',
+            (sid, time.time())).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(bytes(row[0])), row[1]
+
+    def set(self, sid, data, expires):
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO session (sid, data, expires) '
+                'VALUES (?, ?, ?)',
+                (sid,
+                 sqlite3.Binary(pickle.dumps(dict(data),
+                                             pickle.HIGHEST_PROTOCOL)),
+                 expires))
+
+    def delete(self, sid):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM session WHERE sid = ?', (sid,))
+
+    def sweep(self, now):
+        with self._connect() as connection:
+            return connection.execute('DELETE FROM session WHERE expires <= ?',
+                                      (now,)).rowcount
+
+
+class ServerSessionInterface(SessionInterface):
+    """ Keeps session data in a backend, and only its ID in the cookie.
+
+    The ID is a random token, so it needs no signature. The cookie is only
+    set when a session is created, so changes to the data, such as a new
+    CSRF token, don't send a new cookie. Expired sessions are deleted by a
+    background thread rather than during requests.
+    """
+
+    def __init__(self, backend, lifetime=SESSION_LIFETIME,
+                 sweep_interval=SESSION_SWEEP_INTERVAL):
+        self.backend = backend
+        self.lifetime = lifetime
+        self.sweep_interval = sweep_interval
+        self._sweeper = ProcessLocal(self.create_sweeper)
+
+    def open_session(self, app, request):
+        self.start_sweeper()
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            stored = self.backend.get(sid)
+            if stored is not None:
+                data, expires = stored
+                return ServerSession(data, sid, expires)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            for sid in (session.sid, session.replaced_sid):
+                if sid is not None:
+                    self.backend.delete(sid)
+            if session.sid is not None or session.replaced_sid is not None:
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain,
+                                       path=path)
+            return
+
+        if session.replaced_sid is not None:
+            self.backend.delete(session.replaced_sid)
+
+        now = time.time()
+        # Unchanged sessions are only written again once half their lifetime
+        # has passed, to push back their expiry.
+        if (not session.modified and session.expires is not None and
+                session.expires - now > self.lifetime / 2):
+            return
+
+        sid = session.sid
+        if sid is None:
+            sid = binascii.hexlify(os.urandom(20))
+        self.backend.set(sid, session, now + self.lifetime)
+
+        if session.sid is None:
+            response.set_cookie(app.session_cookie_name,
+                                sid,
+                                httponly=self.get_cookie_httponly(app),
+                                secure=self.get_cookie_secure(app),
+                                domain=domain,
+                                path=path)
+
+    def start_sweeper(self):
+        """ Start the thread that deletes expired sessions, once. """
+        self._sweeper.get()
+
+    def create_sweeper(self):
+        sweeper = threading.Thread(target=self.sweep_forever)
+        sweeper.daemon = True
+        sweeper.start()
+        return sweeper
+
+    def sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.backend.sweep(time.time())
+            except sqlite3.Error:
+                # The db was busy, try again next time.
+                pass
+
+
+def CreateSessionInterface(backend=SESSION_BACKEND):
+    """ Create a session interface using the configured backend.
+
+    Args:
+        backend: 'memory' or 'sqlite'.
+    Returns:
+        session_interface: a ServerSessionInterface.
+    """
+    if backend == 'memory':
+        return ServerSessionInterface(MemoryBackend())
+    return ServerSessionInterface(SqliteBackend())
@@ -0,0 +1,202 @@
+""" Fingerprinted, precompressed copies of the static files.
+
+Usage:
+    python static_assets.py    build static/build/ and its manifest
+
+Every file in static/ is copied to static/build/ under a name that holds a
+hash of its contents, e.g. build/style.3f2a9c0d1e4b.css, with gzip and, if
+the brotli module is installed, brotli compressed copies next to it. The
+manifest maps each file to its copy, so that templates can link to the
+copy with static_url(). A copy's name changes whenever its contents do, so
+browsers may cache it forever.
+"""
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import sys
+import tempfile
+
+from flask import current_app, request, send_file, url_for
+
+from compression import ChooseEncoding, WriteCompressedFiles
+from compression import COMPRESSIBLE_TYPES
+
+
+# Where the app's static files are.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'static')
+
+# The directory in the static directory the copies are built in, and the
+# manifest's name in it.
+BUILD_DIR = 'build'
+MANIFEST_NAME = 'manifest.json'
+
+# Seconds browsers may cache a fingerprinted copy, a year.
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+# The suffix of the compressed copy for each content coding.
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+# Build Helper Methods --------------------------------------------------------
+
+
+def Fingerprint(data):
+    """ Hash a file's contents for its name.
+
+    Args:
+        data: the file's contents.
+    Returns:
+        fingerprint: the first 12 hex digits of the MD5 digest.
+    """
+    return hashlib.md5(data).hexdigest()[:12]
+
+
+def IsCompressible(filename):
+    """ Check if a file is worth compressing, from its name.
+
+    Args:
+        filename: the file's name.
+    Returns:
+        True if the file's mimetype is one of COMPRESSIBLE_TYPES.
+    """
+    return mimetypes.guess_type(filename)[0] in COMPRESSIBLE_TYPES
+
+
+def BuildStatic(static_dir=STATIC_DIR):
+    """ Build the fingerprinted copies of the static files and the manifest.
+
+    Copies from earlier builds are deleted.
+
+    Args:
+        static_dir: the static directory.
+    Returns:
+        manifest: a dict of each file's path to its copy's path, both
+                  relative to the static directory.
+    """
+    build_dir = os.path.join(static_dir, BUILD_DIR)
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        if root == static_dir and BUILD_DIR in dirs:
+            dirs.remove(BUILD_DIR)
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, static_dir).\
+                replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            base, extension = os.path.splitext(relative)
+            built = '%s/%s.%s%s' % (BUILD_DIR, base, Fingerprint(data),
+                                    extension)
+            target = os.path.join(static_dir, built)
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            if IsCompressible(name):
+                # Built once and sent many times, so use the best levels.
+                WriteCompressedFiles(target, [data], 9, 11)
+            else:
+                shutil.copyfile(source, target)
+            manifest[relative] = built
+
+    handle, temp_path = tempfile.mkstemp(dir=build_dir)
+    with os.fdopen(handle, 'wb') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(temp_path, os.path.join(build_dir, MANIFEST_NAME))
+    return manifest
+
+
+def LoadManifest(static_dir=STATIC_DIR):
+    """ Load the manifest of the last build.
+
+    Args:
+        static_dir: the static directory.
+    Returns:
+        manifest: a dict of each file's path to its copy's path, empty if
+                  the static files were never built.
+    """
+    path = os.path.join(static_dir, BUILD_DIR, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as f:
+        return json.load(f)
+
+
+# Serving Methods -------------------------------------------------------------
+
+
+class StaticAssets(object):
+    """ Links to and serves the fingerprinted copies of the static files.
+
+    Adds the static_url() template global, and takes over the app's static
+    route. Fingerprinted copies are sent precompressed in the best coding
+    the client accepts, with a Cache-Control header that lets browsers keep
+    them for a year without checking back. Other files are served as Flask
+    normally does.
+    """
+
+    def __init__(self, app, static_dir=None):
+        self.static_dir = static_dir or app.static_folder
+        self.manifest = LoadManifest(self.static_dir)
+        self.built = frozenset(self.manifest.values())
+        app.add_template_global(self.url, 'static_url')
+        app.view_functions['static'] = self.send
+
+    def url(self, filename):
+        """ Get the URL of a static file, fingerprinted if it was built.
+
+        Args:
+            filename: the file's path in the static directory.
+        Returns:
+            url: the URL of its fingerprinted copy, or of the file itself if
+                 the static files were not built.
+        """
+        return url_for('static', filename=self.manifest.get(filename,
+                                                            filename))
+
+    def send(self, filename):
+        if filename not in self.built:
+            return current_app.send_static_file(filename)
+
+        path = os.path.join(self.static_dir, filename)
+        mimetype = mimetypes.guess_type(filename)[0] or \
+            'application/octet-stream'
+        encoding = None
+        if IsCompressible(filename):
+            encoding = ChooseEncoding(request.accept_encodings)
+            if encoding is not None and \
+                    os.path.exists(path + ENCODING_SUFFIXES[encoding]):
+                path += ENCODING_SUFFIXES[encoding]
+            else:
+                encoding = None
+
+        response = send_file(path, mimetype=mimetype, conditional=True,
+                             cache_timeout=STATIC_MAX_AGE)
+        if encoding is not None:
+            response.content_encoding = encoding
+        if IsCompressible(filename):
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = \
+            'public, max-age=%d, immutable' % STATIC_MAX_AGE
+        return response
+
+
+# -----------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build fingerprinted, precompressed static files.')
+    parser.add_argument('--dir', default=STATIC_DIR,
+                        help='the static directory')
+    args = parser.parse_args()
+
+    manifest = BuildStatic(args.dir)
+    for source in sorted(manifest):
+        print '%s -> %s' % (source, manifest[source])
+    sys.exit(0)
@@ -0,0 +1,33 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def item_catalog():
+    """ The app, imported once against a seeded temporary db.
+
+    The app reads its settings when it is imported, so every test shares
+    it. Modules that open the db themselves must be imported after it.
+    """
+    directory = tempfile.mkdtemp(prefix='itemcatalog-test-')
+    os.environ['ITEMCATALOG_APP_JOB_THREADS'] = '0'
+    import benchmark
+    # The app reads its client secrets from the working directory.
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        module = benchmark.LoadApp(
+            'sqlite:///' + os.path.join(directory, 'catalog.db'), directory)
+    finally:
+        os.chdir(cwd)
+    benchmark.SeedCatalog(module.engine, users=3, categories=5, products=20)
+    module.app.testing = True
+    yield module
+    shutil.rmtree(directory, ignore_errors=True)
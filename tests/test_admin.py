@@ -0,0 +1,15 @@
+import pytest
+
+
+ADMIN_URLS = ['/admin/cache/json/', '/metrics']
+
+
+@pytest.mark.parametrize('url', ADMIN_URLS + ['/admin/profile/json/'])
+def test_admin_endpoints_are_off_by_default(item_catalog, url):
+    assert item_catalog.app.test_client().get(url).status_code == 404
+
+
+@pytest.mark.parametrize('url', ADMIN_URLS)
+def test_admin_endpoints_can_be_turned_on(item_catalog, monkeypatch, url):
+    monkeypatch.setattr(item_catalog, 'ADMIN_ENDPOINTS', True)
+    assert item_catalog.app.test_client().get(url).status_code == 200
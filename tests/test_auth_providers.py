@@ -0,0 +1,175 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from timeit import default_timer
+import json
+import threading
+import time
+import urlparse
+
+import pytest
+
+
+# Seconds the stub provider takes to answer each request.
+STUB_DELAY = 0.5
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubProvider(BaseHTTPRequestHandler):
+    """ Answers every GET like Google's token info and user info calls. """
+
+    def do_GET(self):
+        time.sleep(STUB_DELAY)
+        body = json.dumps({'user_id': '1', 'issued_to': 'client',
+                           'name': 'Stub', 'email': 'stub@example.com',
+                           'picture': 'http://example.com/stub.png'})
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except IOError:
+            # The client timed out and hung up.
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubFacebook(StubProvider):
+    """ Answers the Graph API calls of a Facebook login.
+
+    The profile calls check that they got the exchanged token. Paths in
+    failing are answered by hanging up.
+    """
+
+    paths = []
+    failing = set()
+
+    def do_GET(self):
+        time.sleep(STUB_DELAY)
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        self.paths.append(url.path)
+        if url.path in self.failing:
+            return
+        if url.path == '/oauth/access_token':
+            body = {'access_token': 'long-lived'}
+        elif query.get('access_token') != ['long-lived']:
+            body = {'error': 'Invalid token.'}
+        elif url.path == '/v2.4/me':
+            body = {'name': 'Stub', 'id': '1', 'email': 'stub@example.com'}
+        else:
+            body = {'data': {'url': 'http://example.com/stub.png'}}
+        body = json.dumps(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def StartStub(monkeypatch, handler, url_name):
+    """ Serve a stub provider and point one of the provider URLs at it. """
+    import auth_providers
+    server = StubServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    monkeypatch.setattr(auth_providers, url_name,
+                        'http://127.0.0.1:%d' % server.server_port)
+    return server
+
+
+@pytest.fixture
+def stub_provider(item_catalog, monkeypatch):
+    """ Point the Google API at a slow local stub server. """
+    import auth_providers
+    server = StartStub(monkeypatch, StubProvider, 'GOOGLE_API_URL')
+    yield auth_providers
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def stub_facebook(item_catalog, monkeypatch):
+    """ Point the Facebook Graph API at a slow local stub server. """
+    import auth_providers
+    monkeypatch.setattr(StubFacebook, 'paths', [])
+    monkeypatch.setattr(StubFacebook, 'failing', set())
+    server = StartStub(monkeypatch, StubFacebook, 'FACEBOOK_GRAPH_URL')
+    yield auth_providers
+    server.shutdown()
+    server.server_close()
+
+
+def test_profile_calls_run_concurrently(stub_provider):
+    start = default_timer()
+    token_info, profile = stub_provider.FetchGoogleProfile('token')
+    elapsed = default_timer() - start
+    assert token_info['user_id'] == '1'
+    assert profile['email'] == 'stub@example.com'
+    # One after the other, the two calls would take twice the delay.
+    assert elapsed < STUB_DELAY * 1.8
+
+
+def test_slow_provider_is_a_provider_error(stub_provider):
+    start = default_timer()
+    with pytest.raises(stub_provider.ProviderError):
+        stub_provider.FetchGoogleProfile('token', budget=STUB_DELAY / 5)
+    assert default_timer() - start < STUB_DELAY
+
+
+def test_facebook_profile_calls_run_after_the_exchange(stub_facebook):
+    start = default_timer()
+    access_token, profile, picture = \
+        stub_facebook.FetchFacebookProfile('short-lived')
+    elapsed = default_timer() - start
+    assert access_token == 'long-lived'
+    assert profile['email'] == 'stub@example.com'
+    assert picture == 'http://example.com/stub.png'
+    assert StubFacebook.paths[0] == '/oauth/access_token'
+    assert sorted(StubFacebook.paths[1:]) == ['/v2.4/me', '/v2.4/me/picture']
+    # The exchange, then the two profile calls at once, instead of three
+    # calls one after the other.
+    assert elapsed < STUB_DELAY * 2.8
+
+
+@pytest.mark.parametrize('path', ['/oauth/access_token', '/v2.4/me/picture'])
+def test_failing_facebook_call_is_a_provider_error(stub_facebook, path):
+    StubFacebook.failing.add(path)
+    with pytest.raises(stub_facebook.ProviderError):
+        stub_facebook.FetchFacebookProfile('short-lived')
+    if path == '/oauth/access_token':
+        # Without a token the profile calls are never made.
+        assert StubFacebook.paths == [path]
+
+
+@pytest.mark.parametrize('provider', ['google', 'facebook'])
+def test_logout_clears_the_session_when_revoking_fails(item_catalog,
+                                                       monkeypatch,
+                                                       provider):
+    import auth_providers
+    # Nothing listens on port 1, so the revoke fails to connect.
+    monkeypatch.setattr(auth_providers, 'GOOGLE_ACCOUNTS_URL',
+                        'http://127.0.0.1:1')
+    monkeypatch.setattr(auth_providers, 'FACEBOOK_GRAPH_URL',
+                        'http://127.0.0.1:1')
+    client = item_catalog.app.test_client()
+    with client.session_transaction() as session:
+        session.update({'provider': provider,
+                        'credentials': 'token',
+                        'gplus_id': '1',
+                        'facebook_id': '1',
+                        'access_token': 'token',
+                        'username': 'Stub',
+                        'email': 'stub@example.com',
+                        'picture': 'http://example.com/stub.png',
+                        'user_id': 1})
+    response = client.get('/logout/')
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert 'username' not in session
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+
+# Text that breaks a document unless it is escaped.
+AWKWARD_NAME = u'Fish & Chips <"Deluxe">'
+AWKWARD_DESCRIPTION = u'Tom\'s "best" <b>&amp;</b> – ]]> \\ done'
+
+ROWS = [(1, AWKWARD_NAME, AWKWARD_DESCRIPTION, 2.5, 1),
+        (2, u'Plain', u'', None, 2),
+        (3, u'<', u'&', 0.0, 1)]
+
+
+@pytest.fixture
+def awkward_product(item_catalog):
+    session = sessionmaker(bind=item_catalog.engine)()
+    product = item_catalog.Product(name=AWKWARD_NAME,
+                                   description=AWKWARD_DESCRIPTION,
+                                   price=2.5,
+                                   category_id=1,
+                                   user_id=1)
+    session.add(product)
+    session.commit()
+    yield product
+    session.delete(product)
+    session.commit()
+    session.close()
+
+
+def AllProducts(item_catalog):
+    session = sessionmaker(bind=item_catalog.engine)()
+    products = session.query(item_catalog.Product).\
+        order_by(item_catalog.Product.id).all()
+    session.close()
+    return products
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 1000])
+def test_stream_json_matches_json_dumps(item_catalog, batch_size):
+    import catalog_export
+    fields = catalog_export.PRODUCT_FIELDS
+    chunks = list(catalog_export.StreamJSON('Product', fields, ROWS,
+                                            batch_size=batch_size))
+    document = ''.join(chunks)
+    expected = json.dumps({'Product': [dict(zip(fields, row))
+                                       for row in ROWS]})
+    assert json.loads(document) == json.loads(expected)
+    assert json.loads(document)['Product'][0]['name'] == AWKWARD_NAME
+
+
+def test_stream_json_empty_and_paged(item_catalog):
+    import catalog_export
+    fields = catalog_export.PRODUCT_FIELDS
+    document = ''.join(catalog_export.StreamJSON('Product', fields, []))
+    assert json.loads(document) == {'Product': []}
+
+    document = ''.join(catalog_export.StreamJSON('Product', fields, ROWS[:1],
+                                                 next_url='/?after="&"'))
+    assert json.loads(document)['next'] == '/?after="&"'
+
+
+def test_stream_ndjson_has_one_product_per_line(item_catalog):
+    import catalog_export
+    fields = catalog_export.PRODUCT_FIELDS
+    lines = ''.join(catalog_export.StreamNDJSON(fields, ROWS,
+                                                batch_size=1)).splitlines()
+    assert [json.loads(line) for line in lines] == \
+        [dict(zip(fields, row)) for row in ROWS]
+
+
+def test_json_export_matches_serialize(item_catalog, awkward_product):
+    client = item_catalog.app.test_client()
+    response = client.get('/catalog/allProducts/json/?sort=id')
+    assert response.status_code == 200
+    expected = [product.serialize for product in AllProducts(item_catalog)]
+    assert json.loads(response.data) == {'Product': expected}
+    assert AWKWARD_NAME in [product['name'] for product in expected]
+
+    response = client.get('/catalog/allProducts/json/?sort=id&format=ndjson')
+    assert [json.loads(line) for line in response.data.splitlines()] == \
+        expected
+
+
+def BuildXML(root, element, fields, rows):
+    from xml.etree.ElementTree import Element, SubElement, tostring
+    top = Element(root)
+    for row in rows:
+        row_element = SubElement(top, element)
+        for field, value in zip(fields, row):
+            SubElement(row_element, field).text = u'%s' % (value,)
+    return tostring(top, encoding='utf-8')
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 1000])
+def test_stream_xml_matches_element_tree(item_catalog, batch_size):
+    import catalog_export
+    fields = catalog_export.PRODUCT_FIELDS
+    document = ''.join(catalog_export.StreamXML('catalog', 'product', fields,
+                                                ROWS, batch_size=batch_size))
+    assert document.encode('utf-8') == \
+        BuildXML('catalog', 'product', fields, ROWS)
+    assert '&amp;amp;' in document
+    assert '&lt;"Deluxe"&gt;' in document
+
+
+def test_stream_xml_escapes_the_next_link(item_catalog):
+    from xml.etree.ElementTree import fromstring
+    import catalog_export
+    document = ''.join(catalog_export.StreamXML('catalog', 'product',
+                                                catalog_export.PRODUCT_FIELDS,
+                                                [],
+                                                next_url='/?a=1&b="<"'))
+    assert fromstring(document.encode('utf-8')).find('next').text == \
+        '/?a=1&b="<"'
+
+
+def test_xml_export_matches_element_tree(item_catalog, awkward_product):
+    import catalog_export
+    client = item_catalog.app.test_client()
+    response = client.get('/catalog/allProducts/xml/?sort=id')
+    assert response.status_code == 200
+    rows = [[getattr(product, field)
+             for field in catalog_export.PRODUCT_FIELDS]
+            for product in AllProducts(item_catalog)]
+    assert response.data == BuildXML('catalog', 'product',
+                                     catalog_export.PRODUCT_FIELDS, rows)
+
+    response = client.get('/catalog/allcategories/xml/')
+    session = sessionmaker(bind=item_catalog.engine)()
+    rows = session.query(item_catalog.Category.id,
+                         item_catalog.Category.name).\
+        order_by(item_catalog.Category.name).all()
+    session.close()
+    assert response.data == BuildXML('catalog', 'category', ('id', 'name'),
+                                     rows)
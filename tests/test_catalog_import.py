@@ -0,0 +1,97 @@
+from StringIO import StringIO
+import json
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+
+@pytest.fixture
+def db(item_catalog):
+    session = sessionmaker(bind=item_catalog.engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def category(item_catalog, db):
+    """ The name of a category to import into. """
+    return db.query(item_catalog.Category.name).\
+        order_by(item_catalog.Category.id).first()[0]
+
+
+def Import(db, records, chunk_size=1000):
+    import catalog_import
+    stream = StringIO('\n'.join(json.dumps(record) for record in records))
+    return catalog_import.ImportProducts(db,
+                                         catalog_import.ReadNDJSON(stream),
+                                         1,
+                                         chunk_size)
+
+
+@pytest.mark.parametrize('record, message', [
+    ({'name': ''}, 'Name is required.'),
+    ({'name': 'x' * 81}, 'Name is longer than 80 characters.'),
+    ({'name': 'Negative', 'price': -1}, 'Price is negative.'),
+    ({'name': 'Wordy', 'price': 'ten'}, 'Price is not a number.'),
+    ({'name': 'Endless', 'price': 'inf'}, 'Price is not a number.'),
+    ({'name': 'Listed', 'price': [1]}, 'Price is not a number.'),
+])
+def test_invalid_records_are_skipped(db, category, record, message):
+    record.setdefault('category', category)
+    result = Import(db, [record])
+    assert result.imported == 0
+    assert [(error.line, error.message) for error in result.errors] == \
+        [(1, message)]
+
+
+def test_unknown_category_is_skipped(db):
+    result = Import(db, [{'name': 'Lost', 'category': 'No Such Category'}])
+    assert result.imported == 0
+    assert result.errors[0].message == \
+        'Category "No Such Category" does not exist.'
+
+
+def test_csv_records_are_imported(item_catalog, db, category):
+    import catalog_import
+    stream = StringIO('name,category,description,price\n'
+                      'CSV One,%s,First,1.50\n'
+                      'CSV Two,%s,,\n' % (category, category))
+    result = catalog_import.ImportProducts(db,
+                                           catalog_import.ReadCSV(stream),
+                                           1)
+    assert (result.imported, result.errors) == (2, [])
+    prices = dict(db.query(item_catalog.Product.name,
+                           item_catalog.Product.price).
+                  filter(item_catalog.Product.name.in_(['CSV One',
+                                                        'CSV Two'])))
+    assert prices == {'CSV One': 1.5, 'CSV Two': None}
+
+
+def test_duplicates_are_skipped(db, category):
+    result = Import(db, [{'name': 'Twice', 'category': category},
+                         {'name': 'Twice', 'category': category}])
+    assert result.imported == 1
+    assert [error.line for error in result.errors] == [2]
+
+    # The product is in the db now, so a second import skips it.
+    result = Import(db, [{'name': 'Twice', 'category': category}])
+    assert result.imported == 0
+    assert 'already exists' in result.errors[0].message
+
+
+def test_duplicates_across_chunks_are_skipped(db, category):
+    names = ['Chunked 1', 'Chunked 2', 'Chunked 3', 'Chunked 1',
+             'Chunked 4', 'Chunked 3']
+    result = Import(db, [{'name': name, 'category': category}
+                         for name in names], chunk_size=2)
+    assert result.imported == 4
+    assert [error.line for error in result.errors] == [4, 6]
+
+
+def test_errors_are_in_line_order(db, category):
+    # The duplicate is found when its chunk is inserted, after the invalid
+    # record that follows it was checked.
+    result = Import(db, [{'name': 'Ordered', 'category': category},
+                         {'name': 'Ordered', 'category': category},
+                         {'name': '', 'category': category}])
+    assert [error.line for error in result.errors] == [2, 3]
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+
+def RequestExport(client, query_string=''):
+    return client.get('/catalog/allProducts/ndjson/export/' + query_string)
+
+
+def test_export_with_bad_filters_is_rejected(item_catalog):
+    client = item_catalog.app.test_client()
+    assert RequestExport(client, '?min_price=cheap').status_code == 400
+    assert RequestExport(client, '?category_id=x').status_code == 400
+    assert RequestExport(client, '?sort=color').status_code == 400
+
+
+def test_export_ignores_arguments_that_are_not_filters(item_catalog):
+    client = item_catalog.app.test_client()
+    first = RequestExport(client, '?category_id=2&category_id=1')
+    assert first.status_code == 202
+    job = json.loads(first.data)['Job']
+
+    for query_string in ['?category_id=1&category_id=2',
+                         '?category_id=2&category_id=1&category_id=2',
+                         '?category_id=1&category_id=2&junk=1',
+                         '?category_id=1&category_id=2&sort=id']:
+        response = RequestExport(client, query_string)
+        assert response.status_code == 202
+        assert json.loads(response.data)['Job']['id'] == job['id']
+
+
+def test_export_job_applies_the_filters(item_catalog):
+    client = item_catalog.app.test_client()
+    response = RequestExport(client, '?min_price=10&sort=-price')
+    assert response.status_code == 202
+
+    # The app runs no worker threads in the tests, so run its jobs here.
+    item_catalog.job_worker.run(once=True)
+    response = RequestExport(client, '?min_price=10&sort=-price')
+    assert response.status_code == 302
+    response = client.get(response.headers['Location'])
+    prices = [json.loads(line)['price']
+              for line in response.data.splitlines()]
+    assert prices
+    assert all(price >= 10 for price in prices)
+    assert prices == sorted(prices, reverse=True)
+
+
+@pytest.mark.parametrize('error, status', [
+    (OperationalError('UPDATE', {}, 'database is locked'), 'queued'),
+    (IOError('No space left on device'), 'queued'),
+    (ValueError('Unknown sort color.'), 'failed'),
+    (KeyError('filters'), 'failed'),
+])
+def test_only_transient_errors_are_retried(item_catalog, monkeypatch, error,
+                                           status):
+    import catalog_jobs
+
+    def Fail(session, read_session, job, params, progress):
+        raise error
+
+    monkeypatch.setitem(catalog_jobs.JOB_HANDLERS, 'snapshot', Fail)
+    session = sessionmaker(bind=item_catalog.engine)()
+    job = catalog_jobs.EnqueueJob(session, 'snapshot', {'test': status})
+    job.attempts = 1
+    session.commit()
+    catalog_jobs.RunJob(session, session, job)
+
+    job = session.query(item_catalog.Job).get(job.id)
+    assert job.status == status
+    assert job.error.startswith(type(error).__name__)
+    session.delete(job)
+    session.commit()
+    session.close()
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+
+@pytest.fixture
+def db(item_catalog):
+    session = sessionmaker(bind=item_catalog.engine)()
+    yield session
+    session.close()
+
+
+def Search(db, terms, **kwargs):
+    import catalog_search
+    return [row[1] for row in
+            catalog_search.SearchProducts(db, terms, **kwargs)]
+
+
+def AddProduct(item_catalog, db, name, description='', category_id=1):
+    product = item_catalog.Product(name=name,
+                                   description=description,
+                                   category_id=category_id,
+                                   user_id=1)
+    db.add(product)
+    db.commit()
+    return product
+
+
+def test_match_query_quotes_every_word(item_catalog):
+    import catalog_search
+    assert catalog_search.BuildMatchQuery('gog') == '"gog"*'
+    assert catalog_search.BuildMatchQuery('red OR "blue"') == \
+        '"red"* "OR"* "blue"*'
+    assert catalog_search.BuildMatchQuery(' -*" ') is None
+    assert catalog_search.BuildMatchQuery(None) is None
+
+
+def test_index_follows_inserts_updates_and_deletes(item_catalog, db):
+    product = AddProduct(item_catalog, db, 'Zyzzyva Lamp',
+                         'A lamp shaped like a weevil.')
+    assert Search(db, 'zyzzyva') == ['Zyzzyva Lamp']
+    assert Search(db, 'weev') == ['Zyzzyva Lamp']
+
+    product.name = 'Quokka Lamp'
+    db.commit()
+    assert Search(db, 'zyzzyva') == []
+    assert Search(db, 'quokka') == ['Quokka Lamp']
+
+    db.delete(product)
+    db.commit()
+    assert Search(db, 'quokka') == []
+    assert Search(db, 'weevil') == []
+
+
+def test_search_ranks_and_filters(item_catalog, db):
+    products = [AddProduct(item_catalog, db, 'Wombat Hat',
+                           'Wombat wool, from a wombat farm.', 1),
+                AddProduct(item_catalog, db, 'Plain Scarf',
+                           'Goes well with a wombat hat.', 2)]
+    assert Search(db, 'wombat') == ['Wombat Hat', 'Plain Scarf']
+    assert Search(db, 'wombat', category_id=2) == ['Plain Scarf']
+    assert Search(db, 'wombat scarf') == ['Plain Scarf']
+    assert Search(db, 'wombat', limit=1, offset=1) == ['Plain Scarf']
+    for product in products:
+        db.delete(product)
+    db.commit()
+
+
+def test_search_pages(item_catalog, db):
+    products = [AddProduct(item_catalog, db, 'Numbat %d' % number)
+                for number in range(3)]
+    client = item_catalog.app.test_client()
+
+    response = client.get('/catalog/search/json/?q=numbat&limit=2')
+    data = json.loads(response.data)
+    names = [product['name'] for product in data['Product']]
+    assert len(names) == 2
+    response = client.get(data['next'])
+    data = json.loads(response.data)
+    names += [product['name'] for product in data['Product']]
+    assert sorted(names) == ['Numbat 0', 'Numbat 1', 'Numbat 2']
+    assert 'next' not in data
+
+    response = client.get('/catalog/search/?q=numbat')
+    assert response.status_code == 200
+    assert 'Numbat 0' in response.data
+    for product in products:
+        db.delete(product)
+    db.commit()
@@ -0,0 +1,105 @@
+import gzip
+import json
+import os
+import shutil
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import benchmark
+
+
+@pytest.fixture
+def db(item_catalog):
+    session = sessionmaker(bind=item_catalog.engine)()
+    yield session
+    session.close()
+
+
+def ReadFile(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as stream:
+        return stream.read()
+
+
+def test_snapshot_holds_every_export(item_catalog, db, tmpdir):
+    import catalog_snapshots
+    snapshot_dir = str(tmpdir)
+    version = catalog_snapshots.BuildSnapshot(db, snapshot_dir)
+    path = catalog_snapshots.SnapshotPath(version, snapshot_dir)
+
+    for name in catalog_snapshots.SNAPSHOT_FILES:
+        expected = ''.join(catalog_snapshots.SnapshotChunks(db, name))
+        assert ReadFile(os.path.join(path, name)).decode('utf-8') == expected
+        assert ReadFile(os.path.join(path, name + '.gz')).decode('utf-8') == \
+            expected
+
+    client = item_catalog.app.test_client()
+    live = client.get('/catalog/allProducts/json/?sort=id')
+    assert json.loads(ReadFile(os.path.join(path, 'products.json'))) == \
+        json.loads(live.data)
+
+
+def test_snapshot_is_reused_for_its_version(item_catalog, db, tmpdir,
+                                            monkeypatch):
+    import catalog_snapshots
+    snapshot_dir = str(tmpdir)
+    version = catalog_snapshots.BuildSnapshot(db, snapshot_dir)
+
+    def WriteCompressedFiles(*args):
+        raise AssertionError('The snapshot was written again.')
+    monkeypatch.setattr(catalog_snapshots, 'WriteCompressedFiles',
+                        WriteCompressedFiles)
+    assert catalog_snapshots.BuildSnapshot(db, snapshot_dir) == version
+
+    path, encoding = catalog_snapshots.FindSnapshot(
+        version, 'products.json', ['gzip'], snapshot_dir)
+    assert path.endswith('products.json.gz')
+    assert encoding == 'gzip'
+    path, encoding = catalog_snapshots.FindSnapshot(
+        version, 'products.json', [], snapshot_dir)
+    assert path.endswith('products.json')
+    assert encoding is None
+    assert catalog_snapshots.FindSnapshot(
+        version + 1, 'products.json', ['gzip'], snapshot_dir) == (None, None)
+
+
+def test_write_makes_the_snapshot_stale(item_catalog, db):
+    import catalog_jobs
+    import catalog_snapshots
+    client = item_catalog.app.test_client()
+    version = catalog_snapshots.BuildSnapshot(db)
+    path = catalog_snapshots.SnapshotPath(version)
+    # The app needs the only writer connection.
+    db.close()
+    try:
+        # Mark the snapshot, so that it can be told from the live export.
+        with open(os.path.join(path, 'categories.json'), 'wb') as stream:
+            stream.write('{"Category": "from the snapshot"}')
+        for _, suffix in catalog_snapshots.ENCODINGS:
+            if os.path.exists(os.path.join(path, 'categories.json' + suffix)):
+                os.remove(os.path.join(path, 'categories.json' + suffix))
+        response = client.get('/catalog/allcategories/json/')
+        assert json.loads(response.data) == {'Category': 'from the snapshot'}
+
+        csrf_token = benchmark.LogIn(client, 1)
+        response = client.post('/catalog/add/',
+                               data={'name': 'Snapshot Test',
+                                     'csrf_token': csrf_token})
+        assert response.status_code == 302
+
+        response = client.get('/catalog/allcategories/json/')
+        names = [category['name']
+                 for category in json.loads(response.data)['Category']]
+        assert 'Snapshot Test' in names
+        assert catalog_jobs.FindJob(db, 'snapshot', {}).status == 'queued'
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    category_id = db.query(item_catalog.Category.id).\
+        filter_by(name='Snapshot Test').scalar()
+    db.close()
+    csrf_token = benchmark.LogIn(client, 1)
+    response = client.post('/catalog/%d/delete/' % category_id,
+                           data={'csrf_token': csrf_token})
+    assert response.status_code == 302
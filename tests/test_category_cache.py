@@ -0,0 +1,68 @@
+from sqlalchemy.orm import sessionmaker
+
+import benchmark
+
+
+def Categories(item_catalog):
+    session = sessionmaker(bind=item_catalog.engine)()
+    categories = dict((category.name, category.id)
+                      for category in item_catalog.category_cache.get(session))
+    session.close()
+    return categories
+
+
+def Names(item_catalog):
+    session = sessionmaker(bind=item_catalog.engine)()
+    names = [category.name
+             for category in item_catalog.category_cache.get(session)]
+    session.close()
+    return names
+
+
+def Post(item_catalog, client, url, data):
+    data['csrf_token'] = benchmark.LogIn(client, 1)
+    response = client.post(url, data=data)
+    assert response.status_code == 302
+
+
+def test_cache_follows_category_changes(item_catalog, monkeypatch):
+    # Only an invalidation, never the change counter, can refresh the cache.
+    monkeypatch.setattr(item_catalog.category_cache, 'check_interval', 3600)
+    client = item_catalog.app.test_client()
+    Names(item_catalog)
+
+    Post(item_catalog, client, '/catalog/add/', {'name': 'Kites'})
+    category_id = Categories(item_catalog)['Kites']
+
+    Post(item_catalog, client, '/catalog/%d/edit/' % category_id,
+         {'name': 'Box Kites'})
+    names = Names(item_catalog)
+    assert 'Kites' not in names
+    assert 'Box Kites' in names
+    assert names == sorted(names)
+
+    Post(item_catalog, client, '/catalog/%d/delete/' % category_id, {})
+    assert 'Box Kites' not in Names(item_catalog)
+
+
+def test_cache_follows_changes_from_other_processes(item_catalog,
+                                                    monkeypatch):
+    import catalog_version
+    monkeypatch.setattr(item_catalog.category_cache, 'check_interval', 0)
+    Names(item_catalog)
+
+    # Another process renames a category without touching this cache.
+    session = sessionmaker(bind=item_catalog.engine)()
+    category = session.query(item_catalog.Category).\
+        order_by(item_catalog.Category.id).first()
+    old_name = category.name
+    category.name = 'Renamed Elsewhere'
+    catalog_version.BumpVersion(session, catalog_version.CATEGORIES_VERSION)
+    session.commit()
+    assert 'Renamed Elsewhere' in Names(item_catalog)
+
+    category.name = old_name
+    catalog_version.BumpVersion(session, catalog_version.CATEGORIES_VERSION)
+    session.commit()
+    session.close()
+    assert 'Renamed Elsewhere' not in Names(item_catalog)
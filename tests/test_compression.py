@@ -0,0 +1,20 @@
+import pytest
+
+
+@pytest.mark.parametrize('accept_encoding, weak', [('gzip', True),
+                                                    ('identity', False)])
+def test_not_modified_has_the_etag_of_the_full_response(item_catalog,
+                                                        accept_encoding,
+                                                        weak):
+    client = item_catalog.app.test_client()
+    headers = {'Accept-Encoding': accept_encoding}
+    response = client.get('/', headers=headers)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.startswith('W/') == weak
+
+    headers['If-None-Match'] = etag
+    response = client.get('/', headers=headers)
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert 'Accept-Encoding' in response.headers['Vary']
@@ -0,0 +1,51 @@
+from sqlalchemy.orm import sessionmaker
+
+
+def GetHome(client, etag=None):
+    headers = {'Accept-Encoding': 'identity'}
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    return client.get('/', headers=headers)
+
+
+def test_matching_etag_is_not_modified(item_catalog):
+    client = item_catalog.app.test_client()
+    etag = GetHome(client).headers['ETag']
+    response = GetHome(client, etag)
+    assert response.status_code == 304
+    assert response.data == ''
+
+
+def test_changed_catalog_is_sent_again(item_catalog):
+    import catalog_version
+    client = item_catalog.app.test_client()
+    etag = GetHome(client).headers['ETag']
+
+    session = sessionmaker(bind=item_catalog.engine)()
+    catalog_version.BumpVersion(session, catalog_version.CATALOG_VERSION)
+    session.commit()
+    session.close()
+
+    response = GetHome(client, etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_new_build_is_sent_again(item_catalog, monkeypatch):
+    client = item_catalog.app.test_client()
+    etag = GetHome(client).headers['ETag']
+    monkeypatch.setattr(item_catalog, 'BUILD_ID', 'newbuild')
+    response = GetHome(client, etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_build_id_follows_the_templates(item_catalog, tmpdir):
+    tmpdir.join('app.py').write('app = None\n')
+    template = tmpdir.mkdir('templates').join('page.html')
+    template.write('<p>old</p>')
+    build_id, built = item_catalog.HashBuild(str(tmpdir))
+    assert item_catalog.HashBuild(str(tmpdir))[0] == build_id
+
+    template.write('<p>new</p>')
+    assert item_catalog.HashBuild(str(tmpdir))[0] != build_id
@@ -0,0 +1,49 @@
+from sqlalchemy.orm import sessionmaker
+
+import benchmark
+
+
+def AddCategory(item_catalog, client, name):
+    csrf_token = benchmark.LogIn(client, 1)
+    response = client.post('/catalog/add/',
+                           data={'name': name, 'csrf_token': csrf_token})
+    assert response.status_code == 302
+    session = sessionmaker(bind=item_catalog.engine)()
+    category_id = session.query(item_catalog.Category.id).\
+        filter_by(name=name).scalar()
+    session.close()
+    return category_id
+
+
+def DeleteInBackground(item_catalog, client, category_id):
+    csrf_token = benchmark.LogIn(client, 1)
+    response = client.post('/catalog/%d/delete/' % category_id,
+                           data={'csrf_token': csrf_token})
+    assert response.status_code == 302
+    # The app runs no worker threads in the tests, so run its jobs here.
+    item_catalog.job_worker.run(once=True)
+    benchmark.LogIn(client, 1)
+    return client.get('/catalog/%d/delete/' % category_id)
+
+
+def test_recreated_category_can_be_deleted_again(item_catalog, monkeypatch):
+    # Send every delete to a background job.
+    monkeypatch.setattr(item_catalog, 'BACKGROUND_DELETE_THRESHOLD', -1)
+    client = item_catalog.app.test_client()
+
+    category_id = AddCategory(item_catalog, client, 'Short Lived')
+    response = DeleteInBackground(item_catalog, client, category_id)
+    assert response.status_code == 302
+
+    # SQLite gives the new category the ID of the deleted one.
+    assert AddCategory(item_catalog, client, 'Short Lived') == category_id
+    benchmark.LogIn(client, 1)
+    response = client.get('/catalog/%d/delete/' % category_id)
+    assert response.status_code == 200
+    assert 'Are you sure' in response.data
+
+    response = DeleteInBackground(item_catalog, client, category_id)
+    assert response.status_code == 302
+    session = sessionmaker(bind=item_catalog.engine)()
+    assert session.query(item_catalog.Category).get(category_id) is None
+    session.close()
@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize('value', ['nan', 'inf', '-inf', 'abc'])
+def test_price_must_be_a_finite_number(item_catalog, value):
+    from catalog_stats import ParsePrice
+
+    with pytest.raises(ValueError):
+        ParsePrice(value)
+
+
+@pytest.mark.parametrize('url', [
+    '/catalog/allProducts/json/?min_price=nan',
+    '/catalog/allProducts/json/?max_price=inf',
+    '/catalog/allProducts/json/?category_id=abc',
+    '/catalog/facets/json/?category_id=abc',
+])
+def test_malformed_filters_are_a_bad_request(item_catalog, url):
+    assert item_catalog.app.test_client().get(url).status_code == 400
+
+
+def test_facets_filter_by_category(item_catalog):
+    response = item_catalog.app.test_client().get(
+        '/catalog/facets/json/?category_id=1')
+    assert response.status_code == 200
+    assert [row['category_id'] for row in
+            json.loads(response.data)['CategoryStats']] == [1]
@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import benchmark
+
+
+@pytest.fixture
+def owned(item_catalog):
+    """ Two categories of user 1, each with a product of user 1. """
+    session = sessionmaker(bind=item_catalog.engine)()
+    Category, Product = item_catalog.Category, item_catalog.Product
+    categories = session.query(Category).filter_by(user_id=1).\
+        order_by(Category.id).all()
+    category = categories[0]
+    products = session.query(Product).\
+        filter_by(category_id=category.id, user_id=1).\
+        order_by(Product.id).limit(2).all()
+    owned = {'category_id': category.id,
+             'category_name': category.name,
+             'other_category_name': categories[1].name,
+             'product_id': products[0].id,
+             'product_name': products[0].name,
+             'other_product_name': products[1].name}
+    session.close()
+    assert len(products) == 2
+    return owned
+
+
+def Post(item_catalog, url, data):
+    client = item_catalog.app.test_client()
+    data['csrf_token'] = benchmark.LogIn(client, 1)
+    return client.post(url, data=data)
+
+
+def Count(item_catalog, model, **values):
+    session = sessionmaker(bind=item_catalog.engine)()
+    count = session.query(model).filter_by(**values).count()
+    session.close()
+    return count
+
+
+def test_add_category_with_a_taken_name(item_catalog, owned):
+    response = Post(item_catalog, '/catalog/add/',
+                    {'name': owned['category_name']})
+    assert response.status_code == 200
+    assert 'already exists' in response.data
+    assert Count(item_catalog, item_catalog.Category,
+                 name=owned['category_name']) == 1
+
+
+def test_rename_category_to_a_taken_name(item_catalog, owned):
+    response = Post(item_catalog,
+                    '/catalog/%d/edit/' % owned['category_id'],
+                    {'name': owned['other_category_name']})
+    assert response.status_code == 200
+    assert 'already exists' in response.data
+    assert Count(item_catalog, item_catalog.Category,
+                 id=owned['category_id'],
+                 name=owned['category_name']) == 1
+
+
+def test_add_product_with_a_taken_name(item_catalog, owned):
+    response = Post(item_catalog,
+                    '/catalog/%d/add/' % owned['category_id'],
+                    {'name': owned['product_name'],
+                     'description': '',
+                     'price': '1'})
+    assert response.status_code == 200
+    assert 'already in this category' in response.data
+    assert Count(item_catalog, item_catalog.Product,
+                 category_id=owned['category_id'],
+                 name=owned['product_name']) == 1
+
+
+def test_rename_product_to_a_taken_name(item_catalog, owned):
+    response = Post(item_catalog,
+                    '/catalog/%d/%d/edit/' % (owned['category_id'],
+                                              owned['product_id']),
+                    {'name': owned['other_product_name'],
+                     'description': '',
+                     'price': '1'})
+    assert response.status_code == 200
+    assert 'already in this category' in response.data
+    assert Count(item_catalog, item_catalog.Product,
+                 id=owned['product_id'],
+                 name=owned['product_name']) == 1
+
+
+@pytest.mark.parametrize('price', ['-1', 'ten', 'nan'])
+def test_add_product_with_a_bad_price(item_catalog, owned, price):
+    response = Post(item_catalog,
+                    '/catalog/%d/add/' % owned['category_id'],
+                    {'name': 'Badly Priced',
+                     'description': '',
+                     'price': price})
+    assert response.status_code == 400
+    assert Count(item_catalog, item_catalog.Product,
+                 name='Badly Priced') == 0
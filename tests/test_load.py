@@ -0,0 +1,41 @@
+from sqlalchemy.orm import sessionmaker
+
+import benchmark
+
+
+# The client thread counts to load the app with, and the seconds each runs.
+THREAD_COUNTS = [1, 2, 4, 8]
+DURATION = 1.5
+
+# How much throughput may drop from one thread count to the next, as a
+# fraction, before the drop is taken for contention rather than noise.
+TOLERANCE = 0.25
+
+
+def GetCatalog(item_catalog):
+    """ Describe the seeded catalog the way SeedCatalog does. """
+    session = sessionmaker(bind=item_catalog.engine)()
+    catalog = {
+        'users': [row[0] for row in session.query(item_catalog.User.id)],
+        'categories': [row[0] for row in
+                       session.query(item_catalog.Category.id)],
+        'products': dict((product_id, (category_id, user_id))
+                         for product_id, category_id, user_id in
+                         session.query(item_catalog.Product.id,
+                                       item_catalog.Product.category_id,
+                                       item_catalog.Product.user_id))}
+    session.close()
+    return catalog
+
+
+def test_throughput_holds_as_threads_are_added(item_catalog):
+    catalog = GetCatalog(item_catalog)
+    throughputs = []
+    for threads in THREAD_COUNTS:
+        results = benchmark.RunHTTPLoad(item_catalog, catalog, threads,
+                                        DURATION)
+        throughputs.append(results['all']['throughput'])
+
+    for fewer, more in zip(throughputs, throughputs[1:]):
+        assert more >= fewer * (1 - TOLERANCE), zip(THREAD_COUNTS,
+                                                    throughputs)
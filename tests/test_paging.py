@@ -0,0 +1,22 @@
+import pytest
+
+from catalog_paging import DecodeCursor, EncodeCursor
+
+
+def test_cursor_round_trip():
+    assert DecodeCursor(EncodeCursor([u'Lamp', 1.5, None, 7]), 4) == \
+        [u'Lamp', 1.5, None, 7]
+
+
+@pytest.mark.parametrize('values', [[{'a': 1}], [[1]], [True],
+                                    [float('nan')], [float('inf')]])
+def test_cursor_rejects_values_that_are_not_scalars(values):
+    with pytest.raises(ValueError):
+        DecodeCursor(EncodeCursor(values), 1)
+
+
+def test_crafted_cursor_is_a_bad_request(item_catalog):
+    client = item_catalog.app.test_client()
+    response = client.get('/catalog/allProducts/json/?after=' +
+                          EncodeCursor([{'a': 1}]))
+    assert response.status_code == 400
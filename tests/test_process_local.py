@@ -0,0 +1,23 @@
+import os
+import threading
+
+
+def test_value_is_made_once_per_process():
+    from process_local import ProcessLocal
+    made = []
+    value = ProcessLocal(lambda: made.append(os.getpid()) or len(made))
+
+    threads = [threading.Thread(target=value.get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert value.get() == 1
+    assert made == [os.getpid()]
+
+    pid = os.fork()
+    if pid == 0:
+        # A forked child makes its own value.
+        os._exit(0 if value.get() == 2 else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+    assert value.get() == 1
@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import benchmark
+
+
+# The budgeted pages, as URL templates filled with a category and a product
+# owned by the logged-in user.
+PAGES = ['/',
+         '/catalog/{category_id}/',
+         '/catalog/{category_id}/{product_id}/view/',
+         '/catalog/add/',
+         '/catalog/{category_id}/edit/',
+         '/catalog/{category_id}/delete/',
+         '/catalog/{category_id}/add/',
+         '/catalog/{category_id}/{product_id}/edit/',
+         '/catalog/{category_id}/{product_id}/delete/']
+
+
+@pytest.fixture(scope='module')
+def owned(item_catalog):
+    session = sessionmaker(bind=item_catalog.engine)()
+    user_id, category_id = session.query(
+        item_catalog.Category.user_id, item_catalog.Category.id).first()
+    product_id = session.query(item_catalog.Product.id).\
+        filter_by(category_id=category_id, user_id=user_id).first()[0]
+    session.close()
+    return {'user_id': user_id,
+            'category_id': category_id,
+            'product_id': product_id}
+
+
+def ClearCaches(item_catalog, user_id):
+    item_catalog.category_cache.invalidate()
+    item_catalog.response_cache.backend.clear()
+
+
+@pytest.mark.parametrize('page', PAGES)
+@pytest.mark.parametrize('logged_in', [False, True])
+def test_page_within_budget_with_cold_caches(item_catalog, owned, page,
+                                             logged_in):
+    client = item_catalog.app.test_client()
+    if logged_in:
+        benchmark.LogIn(client, owned['user_id'])
+    ClearCaches(item_catalog, owned['user_id'])
+
+    # CheckQueryBudget raises in testing mode when a page goes over.
+    response = client.get(page.format(**owned))
+    if logged_in:
+        assert response.status_code == 200
+    else:
+        # Pages that need a login redirect to it.
+        assert response.status_code in (200, 302)
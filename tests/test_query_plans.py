@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+
+# The helper queries database_migrate.py checks, by name.
+CHECKED_QUERIES = ['GetAllCategories',
+                   'GetSingleCategory',
+                   'GetAllProducts',
+                   'GetAllProducts(sort=price)',
+                   'GetProductRows',
+                   'GetProductPage',
+                   'GetLatestProducts',
+                   'GetSingleProduct',
+                   'GetCategoryStats',
+                   'GetUserIDFromEmail',
+                   'GetUserInfo']
+
+
+@pytest.fixture(scope='module')
+def checked_queries(item_catalog):
+    import database_migrate
+    session = sessionmaker(bind=item_catalog.engine)()
+    queries = database_migrate.GetCheckedQueries(session)
+    yield queries
+    session.close()
+
+
+def test_every_helper_query_is_checked(checked_queries):
+    assert [name for name, kind, query in checked_queries] == CHECKED_QUERIES
+
+
+@pytest.mark.parametrize('name', CHECKED_QUERIES)
+def test_query_plan_uses_an_index(item_catalog, checked_queries, name):
+    import database_migrate
+    kind, query = [(kind, query) for query_name, kind, query
+                   in checked_queries if query_name == name][0]
+    assert database_migrate.CheckQueryPlan(item_catalog.engine,
+                                           kind, query) == []
+
+
+def test_table_scan_is_reported(item_catalog):
+    import database_migrate
+    session = sessionmaker(bind=item_catalog.engine)()
+    query = session.query(item_catalog.Product).filter_by(description='')
+    assert database_migrate.CheckQueryPlan(item_catalog.engine,
+                                           'search', query) != []
+    session.close()
@@ -0,0 +1,19 @@
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from request_profiler import RequestProfiler
+
+
+def test_failed_statements_leave_no_start_behind():
+    # The profiler times templates through Flask's signals.
+    pytest.importorskip('blinker')
+    engine = create_engine('sqlite://')
+    RequestProfiler(Flask(__name__), [engine], enabled=True)
+    connection = engine.connect()
+    with pytest.raises(OperationalError):
+        connection.execute(text('SELECT * FROM missing'))
+    connection.execute(text('SELECT 1'))
+    assert connection.connection.info['query_start'] == []
+    connection.close()
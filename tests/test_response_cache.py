@@ -0,0 +1,32 @@
+import os
+import stat
+
+import pytest
+
+
+def test_disk_backend_creates_a_private_directory(item_catalog, tmpdir):
+    import response_cache
+    directory = str(tmpdir.join('pages'))
+    backend = response_cache.DiskBackend(directory)
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+    backend.set('/', {'body': 'page'})
+    assert backend.get('/') == {'body': 'page'}
+
+
+def test_disk_backend_refuses_a_shared_directory(item_catalog, tmpdir):
+    import response_cache
+    directory = str(tmpdir.join('pages'))
+    os.mkdir(directory)
+    os.chmod(directory, 0o777)
+    with pytest.raises(RuntimeError):
+        response_cache.DiskBackend(directory)
+
+
+def test_disk_backend_refuses_a_symlink(item_catalog, tmpdir):
+    import response_cache
+    os.mkdir(str(tmpdir.join('elsewhere')), 0o700)
+    directory = str(tmpdir.join('pages'))
+    os.symlink(str(tmpdir.join('elsewhere')), directory)
+    with pytest.raises(RuntimeError):
+        response_cache.DiskBackend(directory)
@@ -0,0 +1,20 @@
+import os
+
+
+def test_sqlite_backend_connects_lazily_per_process(item_catalog, tmpdir,
+                                                    monkeypatch):
+    from session_store import SqliteBackend
+
+    backend = SqliteBackend(str(tmpdir.join('sessions.db')))
+    assert getattr(backend._local, 'connection', None) is None
+
+    backend.set('sid', {'username': 'Stub'}, 2e9)
+    connection = backend._local.connection
+    assert backend.get('sid') == ({'username': 'Stub'}, 2e9)
+    assert backend._local.connection is connection
+
+    # A forked worker must not use its parent's connection.
+    pid = os.getpid()
+    monkeypatch.setattr(os, 'getpid', lambda: pid + 1)
+    assert backend.get('sid') == ({'username': 'Stub'}, 2e9)
+    assert backend._local.connection is not connection
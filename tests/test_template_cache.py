@@ -0,0 +1,19 @@
+import os
+import stat
+
+import pytest
+
+
+def test_template_cache_directory_is_private(item_catalog, tmpdir):
+    directory = str(tmpdir.join('templates'))
+    cache = item_catalog.CreateBytecodeCache(directory)
+    assert cache.directory == directory
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+
+def test_shared_template_cache_directory_is_refused(item_catalog, tmpdir):
+    directory = str(tmpdir.join('templates'))
+    os.mkdir(directory)
+    os.chmod(directory, 0o777)
+    with pytest.raises(RuntimeError):
+        item_catalog.CreateBytecodeCache(directory)
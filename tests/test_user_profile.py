@@ -0,0 +1,25 @@
+def GetProfile(item_catalog, user_id, login):
+    with item_catalog.app.test_request_context():
+        item_catalog.login_session.update(login)
+        profile = item_catalog.GetUserInfo(user_id)
+        item_catalog.session.remove()
+    return profile
+
+
+def test_profile_follows_a_new_login(item_catalog):
+    before = GetProfile(item_catalog, 1, {'user_id': 1,
+                                          'username': 'Before',
+                                          'picture': 'before.png'})
+    after = GetProfile(item_catalog, 1, {'user_id': 1,
+                                         'username': 'After',
+                                         'picture': 'after.png'})
+    assert (before.name, before.picture) == ('Before', 'before.png')
+    assert (after.name, after.picture) == ('After', 'after.png')
+
+
+def test_other_users_are_loaded_from_the_db(item_catalog):
+    profile = GetProfile(item_catalog, 2, {'user_id': 1,
+                                           'username': 'Someone',
+                                           'picture': ''})
+    assert profile.id == 2
+    assert profile.name != 'Someone'